@@ -1,27 +1,49 @@
+import asyncio
 import json
+import logging
+import os
 
+import click
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from flask import Flask, render_template, request, redirect
+from flask import Flask, render_template, request, redirect, url_for, make_response
+from markupsafe import Markup
 from datetime import datetime
-import asyncio
 
-from functions.additional_tickers import get_tech_stock_market_movers, get_biggest_losers
 from functions.financial_data_aggregator import *
 from functions.get_links_from_static import get_links_from_static
-from functions.settings import get_variables_from_db
-
-from functions.signal_calculator import CalculateSignal
-from scheduler.github import add_all_in_static_and_commit
-from scheduler.notifications import notify_slack_channel
-from sql.helpers import database_access
+from functions.indicators import SMA_WINDOWS
+from functions.jobs import JobRunner, JOB_FINISHED
+from functions.memo_store import memo_store, input_hash, SIGNAL_CARDS
+from functions.metrics import configure_logging, registry, span
+from functions.page_cache import page_cache, published_version, make_page, version_time
+from functions.pipeline import run_pipeline
+from functions.ranking import RankingIndex, RANKING_KEYS
+from functions.rate_limiter import rate_limiter
+from functions.revaluation import revalue_and_publish
+from functions.settings import get_variables_from_db, settings_service
+from functions.signal_api import SignalQuery, STREAM_CHUNK_RECORDS, dumps, encode_page, parse_fields, project, \
+    signal_records, stream_page
+
+from functions.static_build import build_chart_data, write_if_changed, chart_data_dir, CHART_WINDOW
+from sql.history import history_store
+from sql.indicators import indicator_store
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
+configure_logging()
 
 current_year = datetime.now().year
 
 PROJECT_NAME = 'automated-equity-valuation-full-stack'
 
+# 'grid' or 'monte_carlo' adds DCF percentile bands to every signal, can be overridden with ?sensitivity=
+SENSITIVITY_MODE = os.getenv('SENSITIVITY_MODE', '')
+
+# Written last when a run is published, its modification time versions the cached pages
+PUBLISHED_VERSION_PATH = 'static/financial_data_aggregate.json'
+
 app = Flask(__name__, static_url_path='/static')
 limiter = Limiter(
     get_remote_address,
@@ -30,8 +52,6 @@ limiter = Limiter(
     storage_uri="memory://",
 )
 
-signal_calculator = CalculateSignal()
-
 
 @app.errorhandler(Exception)
 def handle_global_error(error):
@@ -43,169 +63,402 @@ def handle_global_error(error):
     return jsonify(response), 500
 
 
+def serve_page(page):
+    ''' Answers with 304 when the browser or proxy already holds this version of the page '''
+    response = make_response(page.body)
+    response.content_type = 'text/html; charset=utf-8'
+    response.set_etag(page.etag)
+    response.last_modified = page.last_modified
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def render_homepage(version):
+    links = page_cache.get(version, 'links', get_links_from_static)
+    with span('render_homepage'):
+        return make_page(render_template('homepage.html', links=links, prod=False), version)
+
+
 @app.route('/')
 def index():
-    links = get_links_from_static()
-    development_html_homepage = render_template('homepage.html', links=links, prod=False)
+    version = published_version(PUBLISHED_VERSION_PATH)
+    return serve_page(page_cache.get(version, 'homepage', lambda: render_homepage(version)))
 
-    return development_html_homepage
 
+def remove_non_alphanumeric(strings):
+    return [''.join(char for char in string if char.isalnum()) for string in strings]
 
-async def get_financial_category_for_symbols(function_type, stock_symbols):
-    tasks = []
-    for ticker in stock_symbols:
-        tasks.append(financial_data_aggregator.get_data(function_type, ticker))
 
-    await asyncio.gather(*tasks)
+def signal_card_inputs(company, signal, symbol_data, news_articles, chart_file):
+    ''' Everything the card of one signal shows, the MACD series only through its chart file '''
+    symbol_keys = set(symbol_data.keys())
+    return {
+        'company': company,
+        'signal': {key: value for key, value in signal.items() if key != 'MACD'},
+        'overview': {key: symbol_data[key] for key, _ in ADDITIONAL_OVERVIEW_DATA if key in symbol_keys},
+        'news': [news_articles.get(reference['id']) for reference in signal.get('NEWS') or []],
+        'chart_file': chart_file,
+    }
 
 
-async def get_data_for_symbol(symbols):
-    tasks = []
-    for symbol in symbols:
-        tasks.append(financial_data_aggregator.get_overview_data(symbol))
-        tasks.append(financial_data_aggregator.get_price_data(symbol))
+def render_signal_cards(signals, financial_data_aggregate, news_articles, chart_files, prod):
+    '''
+    The card of every signal, rendered only when the card template or anything the card shows changed. None when
+    cards are not memoized, the signal page then renders them itself.
+    '''
+    if not memo_store.enabled(SIGNAL_CARDS):
+        return None
+    template_source = app.jinja_env.loader.get_source(app.jinja_env, 'signal_card.html')[0]
+    # Served pages link the chart data through url_for
+    static_url = None if prod else url_for('static', filename='')
+    template_hash = input_hash(template_source, prod, static_url)
+    keys = {company: input_hash(template_hash, signal_card_inputs(company, signal,
+                                                                  financial_data_aggregate.get(company) or {},
+                                                                  news_articles, chart_files.get(company)))
+            for company, signal in signals.items()}
+    cards = memo_store.get_many(SIGNAL_CARDS, keys.values())
+    rendered = {}
+    with span('render_signal_cards'):
+        for company, key in keys.items():
+            if key not in cards and key not in rendered:
+                rendered[key] = render_template('signal_card.html', company=company, signals=signals,
+                                                data=financial_data_aggregate,
+                                                additional_overview_data=ADDITIONAL_OVERVIEW_DATA,
+                                                chart_files=chart_files, news_articles=news_articles, prod=prod)
+    memo_store.put_many(SIGNAL_CARDS, rendered)
+    cards.update(rendered)
+    return {company: Markup(cards[key]) for company, key in keys.items()}
+
+
+def build_static_pages(signals, financial_data_aggregate, news_articles):
+    ''' Writes the dated signal page and the homepage to the static folder, returns the chart files used '''
+    chart_files = build_chart_data(signals)
+    with span('render_signal_page'):
+        cards = render_signal_cards(signals, financial_data_aggregate, news_articles, chart_files, prod=True)
+        production_html_signals = render_template('signal_page.html', data=financial_data_aggregate,
+                                                  signals=signals, additional_overview_data=ADDITIONAL_OVERVIEW_DATA,
+                                                  chart_files=chart_files, news_articles=news_articles, cards=cards,
+                                                  prod=True)
 
-    await asyncio.gather(*tasks)
+    # Write the rendered HTML to the static folder with a timestamp
+    try:
+        time_string = datetime.today().strftime('%Y-%m-%d')
+        static_path_output_html = 'static/' + time_string + '.html'
+        if not write_if_changed(static_path_output_html, production_html_signals):
+            logger.debug('signal page unchanged, skipped writing %s', static_path_output_html)
+    except PermissionError as e:
+        logger.error('PermissionError creating file: %s', e)
+    except IOError as e:
+        logger.error('IOError creating file: %s', e)
+
+    links = get_links_from_static()
+    logger.debug('links are: %s', links)
+    with span('render_homepage'):
+        production_html_homepage = render_template('homepage.html', links=links, prod=True)
+    try:
+        if write_if_changed('static/index.html', production_html_homepage):
+            logger.info('generated index.html file')
+    except IOError as e:
+        logger.error('Error generating index.html file: %s', e)
 
+    # The served pages of the new version are rendered here, so no request has to. Their url_for links need a
+    # request context, which jobs run without.
+    version = published_version(PUBLISHED_VERSION_PATH)
+    page_cache.put(version, 'run', (signals, financial_data_aggregate, news_articles, chart_files))
+    page_cache.put(version, 'links', links)
+    with app.test_request_context():
+        page_cache.put(version, signal_page_key(), render_signal_page(version))
+        page_cache.put(version, 'homepage', render_homepage(version))
+    return chart_files
 
-async def get_market_data():
-    return await financial_data_aggregator.get_treasury_data()
 
+async def run_check_stocks_job(job):
+    with app.app_context():
+        return await run_pipeline(job, build_static_pages)
+
+
+check_stocks_runner = JobRunner('check_stocks', run_check_stocks_job)
+unfinished_jobs_resumed = False
+
+
+@app.before_request
+def resume_unfinished_jobs():
+    # Resumed by the running server rather than at import, so CLI commands never start network jobs
+    global unfinished_jobs_resumed
+    if not unfinished_jobs_resumed:
+        unfinished_jobs_resumed = True
+        check_stocks_runner.resume_unfinished()
+
+
+def job_status(job_id):
+    job = check_stocks_runner.store.get(job_id)
+    if job is None:
+        return None
+    return {key: job[key] for key in ('id', 'status', 'stage', 'progress', 'result', 'error', 'created_at',
+                                      'updated_at')}
 
-def remove_non_alphanumeric(strings):
-    return [''.join(char for char in string if char.isalnum()) for string in strings]
 
 @app.route('/check_stocks', methods=['GET'])
-async def main_page_finance_data():
-    base_symbols = ['MTCH', 'PYPL']
-    market_movers = await get_tech_stock_market_movers()
-    biggest_losers = await get_biggest_losers()
-    symbols = list(set(base_symbols + market_movers + biggest_losers))
-    function_types = ['CASH_FLOW', 'INCOME_STATEMENT', 'BALANCE_SHEET']
+def main_page_finance_data():
     scheduler = request.args.get('scheduler')
     if not scheduler:
         scheduler = ''
-    for function_type in function_types:
-        await get_financial_category_for_symbols(function_type, symbols)
-
-    print('symbols to remove due to errors in querying', financial_data_aggregator.symbols_to_remove)
-    symbols = [symbol for symbol in symbols if symbol not in financial_data_aggregator.symbols_to_remove]
-
-    await get_data_for_symbol(symbols)
-    await get_market_data()
-    print('market data successfully queried for symbols', symbols)
-    if len(symbols) == 0:
-        raise Exception('No symbols to loop through')
-    for symbol in symbols:
-        await signal_calculator.do_calculations(symbol, financial_data_aggregator.financial_data_aggregate,
-                                                financial_data_aggregator.global_data)
-
-    signals = signal_calculator.get_sorted_dict()
-    # Convert signals to JSON format
-    signals_json = json.dumps(signals)
-
-    # Write signals JSON to a file
+    # planned=true only refreshes the data the refresh planner finds due, and does nothing when none is
+    params = {'started_at': datetime.now().isoformat(), 'scheduler': scheduler,
+              'planned': request.args.get('planned', ''),
+              'sensitivity': request.args.get('sensitivity', SENSITIVITY_MODE),
+              'settings': settings_service.get().as_dict()}
+    job_id = check_stocks_runner.submit(params)
+    logger.info('check_stocks job %s submitted', job_id)
+    return jsonify({'job_id': job_id, 'status_url': url_for('get_job', job_id=job_id)}), 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@limiter.exempt
+def get_job(job_id):
+    status = job_status(job_id)
+    if status is None:
+        return jsonify({'error': f'Unknown job {job_id}'}), 404
+    return jsonify(status)
+
+
+@app.route('/jobs/<job_id>/resume', methods=['POST'])
+def resume_job(job_id):
+    status = job_status(job_id)
+    if status is None:
+        return jsonify({'error': f'Unknown job {job_id}'}), 404
+    if status['status'] == JOB_FINISHED:
+        return jsonify(status)
+    check_stocks_runner.resume(job_id)
+    return jsonify(job_status(job_id)), 202
+
+
+@app.route('/revalue', methods=['POST'])
+async def revalue():
+    run_id = request.args.get('run_id', type=int)
+    sensitivity_mode = request.args.get('sensitivity', SENSITIVITY_MODE)
     try:
-        with open('static/signals.json', 'w') as f:
-            f.write(signals_json)
-        print("Signals saved to signals.json")
-    except IOError as e:
-        print("Error saving signals to file:", e)
+        result = await revalue_and_publish(build_static_pages, run_id, sensitivity_mode)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    return jsonify(result)
+
+
+@app.cli.command('revalue')
+@click.option('--run-id', type=int, default=None, help='Stored run to revalue, defaults to the latest one')
+@click.option('--sensitivity', default=SENSITIVITY_MODE, help="'grid' or 'monte_carlo' percentile bands")
+def revalue_command(run_id, sensitivity):
+    ''' Values a stored run with the current settings and regenerates the pages without calling the API '''
+    result = asyncio.run(revalue_and_publish(build_static_pages, run_id, sensitivity))
+    print('revalued run', result['run_id'], 'with settings version', result['settings_version'], '-',
+          result['signal_count'], 'signals')
 
-    financial_data_aggregate_json = json.dumps(financial_data_aggregator.financial_data_aggregate)
-    # Write signals JSON to a file
-    try:
-        with open('static/financial_data_aggregate.json', 'w') as f:
-            f.write(financial_data_aggregate_json)
-        print("Data aggregate saved to financial_data_aggregate.json")
-    except IOError as e:
-        print("Error saving signals to file:", e)
 
-    if scheduler != '':
-        redirect_route = '/signals?scheduler=' + scheduler
-        print('redirect route with scheduler', scheduler)
+def get_ranking(version, signals):
+    ''' The ranking of the published signals, built once per version '''
+    return page_cache.get(version, 'ranking', lambda: RankingIndex.from_signals(signals))
+
+
+RANKING_KEY_ERROR = f'Signals can only be ranked by one of {RANKING_KEYS}'
+
+
+def rank_signals(version, signals, key, limit=None, descending=False):
+    if key not in RANKING_KEYS:
+        raise ValueError(RANKING_KEY_ERROR)
+    ranking = get_ranking(version, signals)
+    if limit is None:
+        ranked_symbols = ranking.ranked_symbols(key, descending)
     else:
-        redirect_route = '/signals'
-    return redirect(redirect_route)
+        ranked_symbols = ranking.top_k(key, limit, descending)
+    return {symbol: signals[symbol] for symbol in ranked_symbols}
 
 
-@app.route('/signals', methods=['GET'])
-async def signals():
-    # Read signals data from the file
+def read_json_file(path, description):
     try:
-        with open('static/signals.json', 'r') as f:
-            signals_json = f.read()
-            signals = json.loads(signals_json)
-        print("Signals loaded from signals.json")
+        with open(path, 'r') as f:
+            data = json.load(f)
+        logger.info('%s loaded from %s', description, path)
+        return data
     except FileNotFoundError:
-        print("Signals file not found")
+        logger.warning('%s file not found', description)
     except json.JSONDecodeError as e:
-        print("Error decoding signals JSON:", e)
-
+        logger.error('Error decoding %s JSON: %s', description, e)
+    return {}
+
+
+def read_published_run():
+    ''' The signals, aggregate, news articles and chart files of the published run, read once per version '''
+    signals = read_json_file('static/signals.json', 'Signals')
+    financial_data_aggregate = read_json_file('static/financial_data_aggregate.json', 'Financial data aggregate')
+    news_articles = read_json_file('static/news_articles.json', 'News articles')
+    return signals, financial_data_aggregate, news_articles, build_chart_data(signals, write=False)
+
+
+def signal_page_key(sort_key=None, limit=None, descending=False):
+    return 'signals', sort_key, limit, descending
+
+
+def render_signal_page(version, sort_key=None, limit=None, descending=False):
+    signals, financial_data_aggregate, news_articles, chart_files = page_cache.get(version, 'run',
+                                                                                   read_published_run)
+    if sort_key:
+        signals = rank_signals(version, signals, sort_key, limit, descending)
+    with span('render_signal_page'):
+        cards = render_signal_cards(signals, financial_data_aggregate, news_articles, chart_files, prod=False)
+        html = render_template('signal_page.html', data=financial_data_aggregate, signals=signals,
+                               additional_overview_data=ADDITIONAL_OVERVIEW_DATA, chart_files=chart_files,
+                               news_articles=news_articles, cards=cards, prod=False)
+    return make_page(html, version)
+
+
+def get_published_run():
+    version = published_version(PUBLISHED_VERSION_PATH)
+    return version, page_cache.get(version, 'run', read_published_run)
+
+
+def json_response(version, body=None, chunks=None):
+    ''' JSON of the published version, a streamed response carries no ETag as its body is not known upfront '''
+    response = make_response(body if chunks is None else chunks)
+    response.content_type = 'application/json'
+    if chunks is None:
+        response.add_etag()
+    response.last_modified = version_time(version)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@app.route('/api/signals/top', methods=['GET'])
+def top_signals():
+    key = request.args.get('key', 'PERCENTAGE_DIFF')
+    if key not in RANKING_KEYS:
+        return jsonify({'error': RANKING_KEY_ERROR}), 400
+    limit = request.args.get('k', 10, type=int)
+    descending = request.args.get('order', 'desc') == 'desc'
+    version, (signals, _, _, _) = get_published_run()
+    ranked = rank_signals(version, signals, key, limit, descending)
+    return json_response(version, dumps(list(signal_records(signals, ranked, None))))
+
+
+@app.route('/api/signals', methods=['GET'])
+def list_signals():
+    '''
+    A page of the published signals, see SignalQuery for the filter, sort and cursor arguments. fields is a comma
+    separated projection, large pages are streamed.
+    '''
     try:
-        with open('static/financial_data_aggregate.json', 'r') as f:
-            financial_data_aggregate_json = f.read()
-            financial_data_aggregate = json.loads(financial_data_aggregate_json)
-        print("Financial data aggregate loaded from financial_data_aggregate.json")
-    except FileNotFoundError:
-        print("Financial data aggregate file not found")
-    except json.JSONDecodeError as e:
-        print("Error decoding financial data aggregate JSON:", e)
-
-    production_html_signals = render_template('signal_page.html', data=financial_data_aggregate,
-                                              signals=signals, additional_overview_data=ADDITIONAL_OVERVIEW_DATA,
-                                              prod=True)
+        query = SignalQuery.from_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    version, (signals, _, _, _) = get_published_run()
+    ranking = get_ranking(version, signals)
+    symbols, next_cursor = query.run(signals, ranking)
+    records = signal_records(signals, symbols, query.fields)
+    if len(symbols) > STREAM_CHUNK_RECORDS:
+        return json_response(version, chunks=stream_page(records, next_cursor))
+    return json_response(version, encode_page(records, next_cursor))
+
+
+@app.route('/api/signals/<symbol>', methods=['GET'])
+def get_signal(symbol):
+    version, (signals, _, _, _) = get_published_run()
+    symbol = symbol.upper()
+    if symbol not in signals:
+        return jsonify({'error': f'No signal for {symbol}'}), 404
+    return json_response(version, dumps({'symbol': symbol, **project(signals[symbol], parse_fields(request.args))}))
+
+
+@app.route('/api/signals/<symbol>/fundamentals', methods=['GET'])
+def get_fundamentals(symbol):
+    ''' The symbol's entry of the published financial data aggregate, fields is a comma separated projection '''
+    version, (_, financial_data_aggregate, _, _) = get_published_run()
+    symbol = symbol.upper()
+    if symbol not in financial_data_aggregate:
+        return jsonify({'error': f'No financial data for {symbol}'}), 404
+    return json_response(version, dumps({'symbol': symbol,
+                                         **project(financial_data_aggregate[symbol], parse_fields(request.args))}))
+
+
+@app.route('/api/signals/<symbol>/indicators', methods=['GET'])
+def get_indicator_series(symbol):
+    ''' The last limit stored daily closes and indicator values of the symbol, oldest first '''
+    limit = request.args.get('limit', CHART_WINDOW, type=int)
+    if not 0 < limit <= max(SMA_WINDOWS):
+        return jsonify({'error': f'limit must be between 1 and {max(SMA_WINDOWS)}'}), 400
+    symbol = symbol.upper()
+    closes = indicator_store.get_closes([symbol], limit)[symbol]
+    if not closes:
+        return jsonify({'error': f'No indicator series for {symbol}'}), 404
+    values = indicator_store.get_values([symbol], limit)[symbol]
+    return json_response(published_version(PUBLISHED_VERSION_PATH),
+                         dumps({'symbol': symbol,
+                                'closes': [{'price_date': row['price_date'], 'close': row['close']} for row in closes],
+                                'indicators': [{key: value for key, value in row.items() if key != 'symbol'}
+                                               for row in values]}))
+
+
+@app.route('/history/runs', methods=['GET'])
+def history_runs():
+    return jsonify(history_store.get_runs(request.args.get('limit', 100, type=int)))
+
+
+@app.route('/history/<symbol>', methods=['GET'])
+def symbol_history(symbol):
+    return jsonify(history_store.get_symbol_history(symbol.upper()))
+
+
+@app.route('/history/runs/<int:run_id>', methods=['GET'])
+def history_run(run_id):
+    signals = history_store.get_run_signals(run_id)
+    financial_data_aggregate = history_store.get_run_financial_data(run_id)
+    news_articles = history_store.get_run_news_articles(run_id)
+    # The chart files were written when the run was published, a GET only links the ones still on disk
+    chart_files = {symbol: file_name for symbol, file_name in build_chart_data(signals, write=False).items()
+                   if os.path.exists(os.path.join(chart_data_dir, file_name))}
+    cards = render_signal_cards(signals, financial_data_aggregate, news_articles, chart_files, prod=False)
+    return render_template('signal_page.html', data=financial_data_aggregate, signals=signals,
+                           additional_overview_data=ADDITIONAL_OVERVIEW_DATA, chart_files=chart_files,
+                           news_articles=news_articles, cards=cards, prod=False)
 
-    # Write the rendered HTML to the static folder with a timestamp
-    try:
-        time_string = datetime.today().strftime('%Y-%m-%d')
-        static_path_output_html = 'static/' + time_string + '.html'
-        with open(static_path_output_html, 'w') as f:
-            f.write(production_html_signals)
-    except PermissionError as e:
-        print('PermissionError creating file:', e)
-    except IOError as e:
-        print('IOError creating file:', e)
 
-    links = get_links_from_static()
-    print('links are:', links)
-    production_html_homepage = render_template('homepage.html', links=links, prod=True)
-    try:
-        with open('static/index.html', 'w') as f:
-            f.write(production_html_homepage)
-        print('generated index.html file')
-    except IOError as e:
-        print("Error generating index.html file:", e)
+@app.route('/signals', methods=['GET'])
+def signals():
+    ''' Serves the signal page of the published run, pages are only rendered once per version and sort order '''
+    version = published_version(PUBLISHED_VERSION_PATH)
+    sort_key = request.args.get('sort') or None
+    if sort_key is not None and sort_key not in RANKING_KEYS:
+        return jsonify({'error': RANKING_KEY_ERROR}), 400
+    limit = request.args.get('limit', type=int) if sort_key else None
+    descending = request.args.get('order', 'asc') == 'desc' if sort_key else False
+    page = page_cache.get(version, signal_page_key(sort_key, limit, descending),
+                          lambda: render_signal_page(version, sort_key, limit, descending))
+    return serve_page(page)
 
-    scheduler = request.args.get('scheduler')
-    print('scheduler value in signals endpoint', scheduler)
 
-    if scheduler == 'true':
-        signal_keys = signals.keys()  # Get all the keys from the dictionary
-        if signal_keys:  # Check if the keys are not empty
-            print("The signals dictionary has tickers.")
-            print("The signal keys are:", signal_keys)
-            add_all_in_static_and_commit()
-            notify_slack_channel(signal_keys)
+@app.route('/metrics', methods=['GET'])
+@limiter.exempt
+def metrics():
+    return registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
 
-    development_html_signals = render_template('signal_page.html', data=financial_data_aggregate,
-                                               signals=signals, additional_overview_data=ADDITIONAL_OVERVIEW_DATA,
-                                               prod=False)
-    # return dev version
-    return development_html_signals
+@app.route('/quota', methods=['GET'])
+def quota():
+    return jsonify(rate_limiter.remaining())
 
 
 @app.route('/settings', methods=['GET'])
 def settings():
     columns, values = get_variables_from_db()
     column_value_zip = zip(columns, values)
-    return render_template('settings.html', columns=columns, values=values, column_value_zip=column_value_zip)
+    return render_template('settings.html', columns=columns, values=values, column_value_zip=column_value_zip,
+                           version=settings_service.get().version)
 
 
 @app.route('/update_value', methods=['POST'])
 def update_value():
-    database_access.update_selected_value()
+    try:
+        settings_service.update(request.form['variable_type'], request.form['new_value'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     return redirect('/settings')
 
 
@@ -0,0 +1,175 @@
+'''
+Drives /check_stocks and /signals against the local stub server and reports stage timings, Alpha Vantage calls per
+symbol and peak memory for each universe size.
+
+Each size runs in a fresh copy of the repository in a temporary directory, so the real database, response cache, memo
+store and static folder are never touched. The rate limiter is lifted unless --calls-per-minute is given.
+
+    python -m benchmarks.run_benchmark --sizes 10 100 1000 5000 --latency 0.02 --error-rate 0.01
+'''
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+repository_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, repository_root)
+
+from benchmarks.stub_server import StubConfig, StubServer, make_universe  # noqa: E402
+
+RESULT_PREFIX = 'BENCHMARK_RESULT '
+JOB_POLL_SECONDS = 0.01
+UNLIMITED_CALLS = 10 ** 9
+
+
+def ignore_generated_files(directory, names):
+    relative = os.path.relpath(directory, repository_root)
+    ignored = {name for name in names if name in ('.git', '__pycache__') or name.startswith(('cache.db', 'memo.db'))}
+    if relative == 'static':
+        ignored |= {name for name in names if name[:2] == '20' or name == 'data'}
+    return ignored
+
+
+def stage_timings(progress, finished_at):
+    ''' Seconds spent in each stage, a stage ends when the next one starts or the job finishes '''
+    starts = sorted((datetime.fromisoformat(stage['started_at']), name) for name, stage in progress.items())
+    ends = [start for start, _ in starts[1:]] + [datetime.fromisoformat(finished_at)]
+    return {name: round((end - start).total_seconds(), 3) for (start, name), end in zip(starts, ends)}
+
+
+def run_worker(trace_memory):
+    ''' Runs inside the repository copy, prints one JSON line with the measurements '''
+    import resource
+    import tracemalloc
+
+    if trace_memory:
+        tracemalloc.start()
+    sys.path.insert(0, os.getcwd())
+    import app
+
+    client = app.app.test_client()
+    started = time.perf_counter()
+    job_id = client.get('/check_stocks').get_json()['job_id']
+    while True:
+        job = client.get(f'/jobs/{job_id}').get_json()
+        if job['status'] in ('finished', 'failed'):
+            break
+        time.sleep(JOB_POLL_SECONDS)
+    job_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    signals_status = client.get('/signals').status_code
+    signals_seconds = time.perf_counter() - started
+
+    with open('static/financial_data_aggregate.json') as f:
+        symbol_count = len(json.load(f))
+    result = {
+        'status': job['status'],
+        'error': job['error'],
+        'symbols': symbol_count,
+        'signals': (job['result'] or {}).get('signal_count'),
+        'job_seconds': round(job_seconds, 3),
+        'stage_seconds': stage_timings(job['progress'], job['updated_at']),
+        'signals_page_status': signals_status,
+        'signals_page_seconds': round(signals_seconds, 3),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'traced_peak_mb': round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1) if trace_memory else None,
+    }
+    print(RESULT_PREFIX + json.dumps(result))
+
+
+def run_size(size, args):
+    config = StubConfig(make_universe(size), args.latency, args.error_rate, args.throttle_rate, args.history_days,
+                        args.seed, not args.no_bulk_quotes)
+    server = StubServer(config).start()
+    try:
+        with tempfile.TemporaryDirectory(prefix='benchmark-') as workdir:
+            shutil.copytree(repository_root, workdir, ignore=ignore_generated_files, dirs_exist_ok=True)
+            env = {key: value for key, value in os.environ.items()
+                   if key not in ('RESPONSE_CACHE_PATH', 'MEMO_STORE_PATH')}
+            env.update({
+                'ALPHA_VANTAGE_URL': server.url + '/query',
+                'YAHOO_FINANCE_URL': server.url,
+                'ALPHA_VANTAGE_API_KEY': 'benchmark',
+                'ALPHA_VANTAGE_CALLS_PER_MINUTE': str(args.calls_per_minute or UNLIMITED_CALLS),
+                'ALPHA_VANTAGE_DAILY_LIMIT': str(UNLIMITED_CALLS),
+            })
+            command = [sys.executable, os.path.join(workdir, 'benchmarks', 'run_benchmark.py'), '--worker']
+            if args.tracemalloc:
+                command.append('--tracemalloc')
+            completed = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+    finally:
+        stats = server.stats()
+        server.stop()
+
+    result_lines = [line for line in completed.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+    if not result_lines:
+        raise RuntimeError(f'benchmark worker for {size} symbols failed:\n{completed.stderr[-4000:]}')
+    result = json.loads(result_lines[-1][len(RESULT_PREFIX):])
+    api_calls = sum(stats['calls'].values())
+    result.update({
+        'universe': size,
+        'api_calls': api_calls,
+        'api_calls_by_function': stats['calls'],
+        'calls_per_symbol': round(api_calls / result['symbols'], 2) if result['symbols'] else None,
+    })
+    return result
+
+
+def print_report(results):
+    stages = []
+    for result in results:
+        stages += [stage for stage in result['stage_seconds'] if stage not in stages]
+    header = ['symbols', 'status', 'job s'] + [f'{stage} s' for stage in stages] + [
+        '/signals s', 'api calls', 'calls/symbol', 'signals', 'max rss MB', 'traced peak MB']
+    rows = [[result['symbols'], result['status'], result['job_seconds']] +
+            [result['stage_seconds'].get(stage, '') for stage in stages] +
+            [result['signals_page_seconds'], result['api_calls'], result['calls_per_symbol'], result['signals'],
+             result['max_rss_mb'], result['traced_peak_mb'] if result['traced_peak_mb'] is not None else '']
+            for result in results]
+    widths = [max(len(str(row[idx])) for row in [header] + rows) for idx in range(len(header))]
+    for row in [header] + rows:
+        print('  '.join(str(value).rjust(width) for value, width in zip(row, widths)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the valuation pipeline against the local stub server')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 5000],
+                        help='universe sizes listed on the stub Yahoo pages')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--history-days', type=int, default=2500, help='days in a full daily series')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-bulk-quotes', action='store_true',
+                        help='have the stub refuse bulk quotes like a free API key')
+    parser.add_argument('--calls-per-minute', type=int, default=None,
+                        help='keep the Alpha Vantage rate limit at this value instead of lifting it')
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='also report the peak traced Python allocation, slows the run down noticeably')
+    parser.add_argument('--json', help='write the full results to this file')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        return run_worker(args.tracemalloc)
+    results = []
+    for size in args.sizes:
+        print(f'benchmarking {size} symbols...', file=sys.stderr)
+        results.append(run_size(size, args))
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
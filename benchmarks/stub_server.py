@@ -0,0 +1,298 @@
+'''
+Local stand-in for Alpha Vantage and the two scraped Yahoo Finance pages.
+
+Every Alpha Vantage function the app calls gets a synthetic payload that is deterministic per symbol, and the Yahoo
+pages list the benchmark universe. Latency, the share of failed responses and the share of throttled responses are
+configurable. GET /__stats returns the number of calls per function and per symbol, POST /__reset clears them.
+
+    python -m benchmarks.stub_server --symbols 100 --latency 0.05 --error-rate 0.01 --throttle-rate 0.01
+'''
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import date, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+MOVERS_PATH = '/u/yahoo-finance/watchlists/tech-stocks-that-move-the-market/'
+LOSERS_PATH = '/losers/'
+
+PREMIUM_MESSAGE = ('Thank you for using Alpha Vantage! This is a premium endpoint. You may subscribe to any of the '
+                   'premium plans at https://www.alphavantage.co/premium/ to instantly unlock all premium endpoints')
+THROTTLE_MESSAGE = ('Thank you for using Alpha Vantage! Our standard API rate limit is 25 requests per day. '
+                    'Please subscribe to any of the premium plans to instantly remove all daily rate limits.')
+
+LAST_TRADING_DAY = date(2024, 4, 4)
+YEARS_REPORTED = 5
+PRICE_DAYS = 100
+NEWS_ARTICLES = 50
+
+
+@dataclass
+class StubConfig:
+    symbols: list
+    latency: float = 0.0
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    history_days: int = 2500
+    seed: int = 0
+    bulk_quotes: bool = True
+
+
+def make_universe(count):
+    return [f'B{idx:04d}' for idx in range(count)]
+
+
+def symbol_random(symbol, function_type):
+    return random.Random(f'{symbol}-{function_type}')
+
+
+def latest_revenue(symbol):
+    return symbol_random(symbol, 'REVENUE').randint(2_000, 30_000) * 10 ** 6
+
+
+def annual_reports(symbol, function_type):
+    rng = symbol_random(symbol, function_type)
+    reports = []
+    revenue = latest_revenue(symbol)
+    for _ in range(YEARS_REPORTED):
+        revenue = int(revenue / (1 + rng.uniform(-0.05, 0.15)))
+        if function_type == 'CASH_FLOW':
+            reports.append({'operatingCashflow': str(int(revenue * rng.uniform(0.05, 0.3))),
+                            'capitalExpenditures': str(int(revenue * rng.uniform(0.01, 0.08)))})
+        elif function_type == 'INCOME_STATEMENT':
+            income_before_tax = int(revenue * rng.uniform(-0.05, 0.25))
+            reports.append({'totalRevenue': str(revenue),
+                            'netIncome': str(int(income_before_tax * 0.8)),
+                            'incomeBeforeTax': str(income_before_tax),
+                            'interestAndDebtExpense': str(int(revenue * rng.uniform(0, 0.02))),
+                            'incomeTaxExpense': str(int(income_before_tax * rng.uniform(0, 0.25))),
+                            'interestExpense': str(int(revenue * rng.uniform(0, 0.02)))})
+        else:
+            reports.append({'commonStockSharesOutstanding': str(rng.randint(100, 2_000) * 10 ** 6),
+                            'shortTermDebt': str(int(revenue * rng.uniform(0, 0.2))),
+                            'longTermDebt': str(int(revenue * rng.uniform(0, 1)))})
+    for year, report in enumerate(reports):
+        report['fiscalDateEnding'] = date(LAST_TRADING_DAY.year - 1 - year, 12, 31).isoformat()
+    return {'symbol': symbol, 'annualReports': reports}
+
+
+def overview(symbol):
+    rng = symbol_random(symbol, 'OVERVIEW')
+    data = {'Symbol': symbol, 'Beta': str(round(rng.uniform(0.4, 2.0), 3)),
+            # Priced between a deep discount and a rich premium to its revenue so a share of symbols pass the DCF
+            'MarketCapitalization': str(int(latest_revenue(symbol) * rng.uniform(0.3, 4))),
+            'SharesOutstanding': str(rng.randint(100, 2_000) * 10 ** 6),
+            'Description': f'{symbol} is a synthetic company served by the benchmark stub.',
+            'LatestQuarter': '2024-03-31'}
+    for key in ['52WeekHigh', '52WeekLow', 'AnalystTargetPrice', 'PERatio', 'ForwardPE', 'ProfitMargin',
+                'PriceToSalesRatioTTM', 'PriceToBookRatio']:
+        data[key] = str(round(rng.uniform(0.1, 200), 2))
+    return data
+
+
+def trading_days(count):
+    return [(LAST_TRADING_DAY - timedelta(days=idx)).isoformat() for idx in range(count)]
+
+
+def daily_prices(symbol, days=PRICE_DAYS):
+    rng = symbol_random(symbol, 'PRICE')
+    base = rng.uniform(5, 500)
+    series = {}
+    for idx, day in enumerate(trading_days(days)):
+        close = round(base * (1 + 0.05 * math.sin(idx / 7)), 2)
+        series[day] = {'1. open': str(close), '2. high': str(close), '3. low': str(close), '4. close': str(close),
+                       '5. adjusted close': str(close), '6. volume': '1000000'}
+    return {'Meta Data': {'2. Symbol': symbol}, 'Time Series (Daily)': series}
+
+
+def latest_close(symbol):
+    return daily_prices(symbol, days=1)['Time Series (Daily)'][LAST_TRADING_DAY.isoformat()]['4. close']
+
+
+def global_quote(symbol):
+    return {'Global Quote': {'01. symbol': symbol, '05. price': latest_close(symbol),
+                             '07. latest trading day': LAST_TRADING_DAY.isoformat()}}
+
+
+def bulk_quotes(symbols):
+    return {'endpoint': 'Realtime Bulk Quotes', 'message': '',
+            'data': [{'symbol': symbol, 'timestamp': f'{LAST_TRADING_DAY.isoformat()} 16:00:00.000',
+                      'close': latest_close(symbol)} for symbol in symbols.split(',')]}
+
+
+def macd(symbol, days):
+    rng = symbol_random(symbol, 'MACD')
+    phase = rng.uniform(0, 2 * math.pi)
+    series = {}
+    for idx, day in enumerate(trading_days(days)):
+        value = math.sin(idx / 12 + phase)
+        signal = math.sin((idx + 3) / 12 + phase)
+        series[day] = {'MACD': f'{value:.4f}', 'MACD_Hist': f'{value - signal:.4f}', 'MACD_Signal': f'{signal:.4f}'}
+    return {'Meta Data': {'1: Symbol': symbol}, 'Technical Analysis: MACD': series}
+
+
+def news(tickers):
+    feed = []
+    for ticker in tickers.split(','):
+        rng = symbol_random(ticker, 'NEWS')
+        for idx in range(NEWS_ARTICLES // len(tickers.split(','))):
+            feed.append({'title': f'{ticker} article {idx}', 'url': f'https://news.example.com/{ticker}/{idx}',
+                         'time_published': '20240404T120000', 'summary': 'Synthetic article.',
+                         'source': 'Benchmark', 'overall_sentiment_score': round(rng.uniform(-1, 1), 3),
+                         'ticker_sentiment': [{'ticker': ticker, 'relevance_score': str(round(rng.uniform(0, 1), 3)),
+                                               'ticker_sentiment_score': str(round(rng.uniform(-1, 1), 3))}]})
+    return {'items': str(len(feed)), 'feed': feed}
+
+
+def alpha_vantage_payload(params, config):
+    function_type = params.get('function')
+    symbol = params.get('symbol')
+    if function_type in ('CASH_FLOW', 'INCOME_STATEMENT', 'BALANCE_SHEET'):
+        return annual_reports(symbol, function_type)
+    if function_type == 'OVERVIEW':
+        return overview(symbol)
+    if function_type == 'TIME_SERIES_DAILY_ADJUSTED':
+        return daily_prices(symbol)
+    if function_type == 'TIME_SERIES_DAILY':
+        return daily_prices(symbol, days=config.history_days if params.get('outputsize') == 'full' else 100)
+    if function_type == 'GLOBAL_QUOTE':
+        return global_quote(symbol)
+    if function_type == 'REALTIME_BULK_QUOTES':
+        return bulk_quotes(symbol) if config.bulk_quotes else {'Information': PREMIUM_MESSAGE}
+    if function_type == 'TREASURY_YIELD':
+        return {'name': '10-Year Treasury Constant Maturity Rate', 'data': [{'date': '2024-04-01', 'value': '4.33'}]}
+    if function_type == 'MACD':
+        return macd(symbol, config.history_days)
+    if function_type == 'NEWS_SENTIMENT':
+        return news(params.get('tickers', ''))
+    return {'Error Message': f'Invalid API call for function {function_type}'}
+
+
+def yahoo_page(symbols, attribute):
+    links = ''.join(f'<a data-test="{attribute}" href="/quote/{symbol}">{symbol}</a>' for symbol in symbols)
+    return f'<html><body>{links}</body></html>'
+
+
+class StubServer:
+    def __init__(self, config, host='127.0.0.1', port=0):
+        self.config = config
+        self.calls = Counter()
+        self.symbol_calls = Counter()
+        self.lock = threading.Lock()
+        self.rng = random.Random(config.seed)
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name='stub-server', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def stats(self):
+        with self.lock:
+            return {'calls': dict(self.calls), 'symbol_calls': dict(self.symbol_calls)}
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.symbol_calls.clear()
+
+    def _outcome(self):
+        with self.lock:
+            roll = self.rng.random()
+        if roll < self.config.error_rate:
+            return 'error'
+        if roll < self.config.error_rate + self.config.throttle_rate:
+            return 'throttle'
+        return 'ok'
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type='application/json'):
+                body = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if url.path == '/__stats':
+                    return self._send(200, json.dumps(server.stats()))
+                if server.config.latency:
+                    time.sleep(server.config.latency)
+                symbols = server.config.symbols
+                if url.path == MOVERS_PATH:
+                    return self._send(200, yahoo_page(symbols[:len(symbols) // 2], 'symbol-link'), 'text/html')
+                if url.path == LOSERS_PATH:
+                    return self._send(200, yahoo_page(symbols[len(symbols) // 2:], 'quoteLink'), 'text/html')
+                if url.path != '/query':
+                    return self._send(404, json.dumps({'error': 'not found'}))
+
+                function_type = params.get('function')
+                with server.lock:
+                    server.calls[function_type] += 1
+                    server.symbol_calls[params.get('symbol') or params.get('tickers') or ''] += 1
+                outcome = server._outcome()
+                if outcome == 'error':
+                    return self._send(503, json.dumps({'error': 'stub error'}))
+                if outcome == 'throttle':
+                    return self._send(200, json.dumps({'Information': THROTTLE_MESSAGE}))
+                return self._send(200, json.dumps(alpha_vantage_payload(params, server.config)))
+
+            def do_POST(self):
+                if urlparse(self.path).path == '/__reset':
+                    server.reset()
+                    return self._send(200, '{}')
+                return self._send(404, json.dumps({'error': 'not found'}))
+
+        return Handler
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Local Alpha Vantage and Yahoo Finance stand-in')
+    parser.add_argument('--symbols', type=int, default=100, help='number of symbols listed on the Yahoo pages')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of Alpha Vantage calls answered 503')
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='share of Alpha Vantage calls answered with a throttle note')
+    parser.add_argument('--history-days', type=int, default=2500, help='days in a full daily series')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-bulk-quotes', action='store_true', help='answer bulk quotes like a free API key')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    config = StubConfig(make_universe(args.symbols), args.latency, args.error_rate, args.throttle_rate,
+                        args.history_days, args.seed, not args.no_bulk_quotes)
+    server = StubServer(config, port=args.port)
+    print(f'stub server listening on {server.url}, set ALPHA_VANTAGE_URL={server.url}/query and '
+          f'YAHOO_FINANCE_URL={server.url}')
+    server.httpd.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,27 @@
-import requests
+import os
+
 from bs4 import BeautifulSoup
 
+from functions.http_client import http_client
+
+YAHOO_FINANCE_URL = os.getenv('YAHOO_FINANCE_URL', 'https://finance.yahoo.com')
+
 
 async def get_tech_stock_market_movers():
-    URL = "https://finance.yahoo.com/u/yahoo-finance/watchlists/tech-stocks-that-move-the-market/"
+    URL = YAHOO_FINANCE_URL + "/u/yahoo-finance/watchlists/tech-stocks-that-move-the-market/"
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36'}
-    page = requests.get(URL, headers=headers)
+    page = await http_client.get(URL, headers=headers)
     soup = BeautifulSoup(page.content, "html.parser")
     tickers_container = soup.findAll('a', attrs={'data-test': 'symbol-link'})
     return [ticker.get_text() for ticker in tickers_container]
 
 async def get_biggest_losers():
     try:
-        URL = "https://finance.yahoo.com/losers/"
+        URL = YAHOO_FINANCE_URL + "/losers/"
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36'}
-        page = requests.get(URL, headers=headers)
+        page = await http_client.get(URL, headers=headers)
         soup = BeautifulSoup(page.content, "html.parser")
         tickers_container = soup.findAll('a', attrs={'data-test': 'quoteLink'})
 
@@ -0,0 +1,288 @@
+import logging
+import math
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from functions.statements import STATEMENT_LINE_ITEMS, NET_INCOME, TOTAL_REVENUE, INCOME_BEFORE_TAX, \
+    INCOME_TAX_EXPENSE, INTEREST_EXPENSE, OPERATING_CASHFLOW, CAPITAL_EXPENDITURES, SHORT_TERM_DEBT, LONG_TERM_DEBT
+
+logger = logging.getLogger(__name__)
+
+# Number of years the free cash flow is projected for before the terminal value
+PROJECTION_PERIODS = 4
+
+# Rejection reasons, one per check of the valuation that can drop a symbol
+REJECT_INVALID_DATA = 'INVALID_DATA'
+REJECT_ZERO_DIVISION = 'ZERO_DIVISION'
+REJECT_FCFE_RATIO = 'FCFE_RATIO_NON_POSITIVE'
+REJECT_WACC_BELOW_GROWTH = 'WACC_BELOW_GROWTH'
+REJECT_TERMINAL_BASE = 'TERMINAL_BASE_NON_POSITIVE'
+REJECT_SAFETY_MARGIN = 'BELOW_SAFETY_MARGIN'
+# Only given by screen_statements before the cash flows are known, it dooms the terminal value base
+REJECT_NET_INCOME = 'PROJECTED_NET_INCOME_NON_POSITIVE'
+
+# Index in this list is the reason code stored in the rejection arrays, 0 means accepted
+REASONS = [None, REJECT_INVALID_DATA, REJECT_ZERO_DIVISION, REJECT_FCFE_RATIO, REJECT_WACC_BELOW_GROWTH,
+           REJECT_TERMINAL_BASE, REJECT_SAFETY_MARGIN, REJECT_NET_INCOME]
+
+# Fields of the symbol model the valuation reads besides the statements
+VALUATION_FIELDS = ['beta', 'market_capitalization', 'latest_price']
+
+# libm pow, numpy's SIMD power differs from Python's float ** int in the last bit
+vectorized_pow = np.frompyfunc(math.pow, 2, 1)
+
+
+@dataclass
+class PackedFinancials:
+    ''' The financial data aggregate as arrays, one row per symbol and one column per year (latest first) '''
+    symbols: list
+    years: int
+    net_income: np.ndarray
+    revenue: np.ndarray
+    operating_cashflow: np.ndarray
+    capital_expenditures: np.ndarray
+    income_before_tax: np.ndarray
+    income_tax_expense: np.ndarray
+    interest_expense: np.ndarray
+    total_debt: np.ndarray
+    beta: np.ndarray
+    market_cap: np.ndarray
+    latest_price: np.ndarray
+    valid: np.ndarray
+
+
+@dataclass
+class BatchValuation:
+    symbols: list
+    fcfe_net_income_ratio: np.ndarray
+    net_income_margin: np.ndarray
+    earnings_growth_rate: np.ndarray
+    projected_free_cash_flows: np.ndarray
+    wacc: np.ndarray
+    terminal_value: np.ndarray
+    dcf: np.ndarray
+    market_cap: np.ndarray
+    latest_price: np.ndarray
+    percentage_diff: np.ndarray
+    accepted: np.ndarray
+    rejections: dict = field(default_factory=dict)
+
+    def get_signal(self, idx):
+        ''' Builds the signal dict for one symbol with the same keys, order and rounding as the scalar path '''
+        latest_price = round(float(self.latest_price[idx]), 2)
+        dcf = float(self.dcf[idx])
+        market_cap = float(self.market_cap[idx])
+        percentage_diff = float(self.percentage_diff[idx])
+        return {
+            'LATEST_PRICE': latest_price,
+            'FCFE_NET_INCOME_RATIO': float(self.fcfe_net_income_ratio[idx]),
+            'NET_INCOME_MARGIN': float(self.net_income_margin[idx]),
+            'EARNINGS_GROWTH_RATE': float(self.earnings_growth_rate[idx]),
+            'PROJECTED_FREE_CASH_FLOWS': self.projected_free_cash_flows[idx].tolist(),
+            'WACC': float(self.wacc[idx]),
+            'TERMINAL_VALUE': float(self.terminal_value[idx]),
+            'DCF': round(dcf / 1E9, 2),
+            'DCF_PRICE_PER_SHARE': round(latest_price * (1 + percentage_diff), 2),
+            'DIFF': round((dcf - market_cap) / 1E9, 2),
+            'MARKET_CAP': round(market_cap / 1E9, 2),
+            'PERCENTAGE_DIFF': round(percentage_diff * 100, 2),
+        }
+
+    def get_signals(self):
+        return {symbol: self.get_signal(idx) for idx, symbol in enumerate(self.symbols) if self.accepted[idx]}
+
+
+def safe_divide(x, y):
+    ''' Element-wise division, 0 wherever the divisor is 0 '''
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+    out = np.zeros(x.shape)
+    np.divide(x, y, out=out, where=y != 0)
+    return out
+
+
+def sequential_sum(columns, start=0.0):
+    ''' Sums column by column so the floating point result matches Python's sum() over a list '''
+    total = start
+    for column in columns:
+        total = total + column
+    return total
+
+
+def reported_years(symbols, data):
+    ''' Most years of income statements reported by any of the symbols, symbols with fewer years are invalid '''
+    return max((data[symbol].income_statement.shape[1] for symbol in symbols
+                if symbol in data and data[symbol].income_statement is not None), default=1)
+
+
+def pack_financial_data(symbols, data, years=None, statements=tuple(STATEMENT_LINE_ITEMS), fields=VALUATION_FIELDS):
+    '''
+    Stacks the parsed statement arrays of the symbols. Symbols missing one of the statements or fields are invalid,
+    statements and fields that are not asked for are packed as zeros.
+    '''
+    count = len(symbols)
+    if years is None:
+        years = reported_years(symbols, data)
+    valid = np.array([symbol in data and data[symbol].is_complete(years, statements, fields) for symbol in symbols],
+                     dtype=bool)
+    valid_financials = [data[symbol] for symbol, is_valid in zip(symbols, valid) if is_valid]
+    for symbol, is_valid in zip(symbols, valid):
+        if not is_valid:
+            logger.debug('invalid data for symbol %s', symbol)
+
+    def stack(statement, line_items):
+        stacked = np.zeros((len(line_items), count, years))
+        if valid_financials and statement in statements:
+            stacked[:, valid] = np.stack([financials.get_statement(statement) for financials in valid_financials],
+                                         axis=1)[line_items]
+        return stacked
+
+    def gather(attribute):
+        gathered = np.zeros(count)
+        if attribute in fields:
+            gathered[valid] = [getattr(financials, attribute) for financials in valid_financials]
+        return gathered
+
+    net_income, revenue, income_before_tax, income_tax_expense, interest_expense = stack(
+        'INCOME_STATEMENT', [NET_INCOME, TOTAL_REVENUE, INCOME_BEFORE_TAX, INCOME_TAX_EXPENSE, INTEREST_EXPENSE])
+    operating_cashflow, capital_expenditures = stack('CASH_FLOW', [OPERATING_CASHFLOW, CAPITAL_EXPENDITURES])
+    short_term_debt, long_term_debt = stack('BALANCE_SHEET', [SHORT_TERM_DEBT, LONG_TERM_DEBT])
+
+    return PackedFinancials(symbols=list(symbols), years=years, valid=valid, net_income=net_income, revenue=revenue,
+                            operating_cashflow=operating_cashflow, capital_expenditures=capital_expenditures,
+                            income_before_tax=income_before_tax[:, 0], income_tax_expense=income_tax_expense[:, 0],
+                            interest_expense=interest_expense[:, 0],
+                            total_debt=short_term_debt[:, 0] + long_term_debt[:, 0], beta=gather('beta'),
+                            market_cap=gather('market_capitalization'), latest_price=gather('latest_price'))
+
+
+def projection_arrays(packed, growth_haircut=0.0, exact=True):
+    ''' The FCFE ratio, margin and growth of every packed symbol and the net income and free cash flow they project '''
+    years = packed.years
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        # FCFE / net income ratio
+        free_cash_flow = packed.operating_cashflow - packed.capital_expenditures
+        fcfe_ratios = safe_divide(free_cash_flow, packed.net_income)
+        fcfe_net_income_ratio = sequential_sum(fcfe_ratios[:, year] for year in range(years)) / years
+
+        net_income_margin = safe_divide(packed.net_income, packed.revenue).min(axis=1, initial=np.inf)
+
+        # Average revenue growth between consecutive years
+        revenue = packed.revenue
+        growth_rates = [safe_divide(revenue[:, year + 1] - revenue[:, year], revenue[:, year])
+                        for year in range(years - 1)]
+        earnings_growth_rate = safe_divide(sequential_sum(growth_rates, np.zeros(len(packed.symbols))), years - 1)
+        earnings_growth_rate = earnings_growth_rate * (1 - np.asarray(growth_haircut))
+
+        periods = np.arange(1, PROJECTION_PERIODS + 1)
+        growth_base = (1 + earnings_growth_rate)[..., np.newaxis]
+        if exact:
+            growth_factors = vectorized_pow(growth_base, periods).astype(np.float64)
+        else:
+            growth_factors = np.power(growth_base, periods)
+        projected_revenue = revenue[..., :1] * growth_factors
+        projected_net_income = net_income_margin[..., np.newaxis] * projected_revenue
+        projected_free_cash_flows = fcfe_net_income_ratio[..., np.newaxis] * projected_net_income
+    return {
+        'fcfe_net_income_ratio': fcfe_net_income_ratio,
+        'net_income_margin': net_income_margin,
+        'earnings_growth_rate': earnings_growth_rate,
+        'projected_net_income': projected_net_income,
+        'projected_free_cash_flows': projected_free_cash_flows,
+    }
+
+
+def screen_statements(packed, cash_flows=True):
+    '''
+    Rejections that follow from the income statements, and the cash flows when they are packed, before anything
+    else of a symbol is fetched. dcf_arrays rejects every one of these symbols too, perhaps for an earlier reason.
+    Before the cash flows are known a projected net income that is not positive is rejected, whatever the FCFE
+    ratio the terminal value base cannot be positive then.
+    '''
+    projection = projection_arrays(packed)
+    reason_codes = np.where(packed.valid, 0, REASONS.index(REJECT_INVALID_DATA)).astype(np.int8)
+    checks = [(projection['projected_net_income'][:, -1] <= 0, REJECT_NET_INCOME)]
+    if cash_flows:
+        checks = [(projection['fcfe_net_income_ratio'] <= 0, REJECT_FCFE_RATIO),
+                  (projection['projected_free_cash_flows'][:, -1] <= 0, REJECT_TERMINAL_BASE)]
+    for mask, reason in checks:
+        reason_codes = np.where(mask & (reason_codes == 0), np.int8(REASONS.index(reason)), reason_codes)
+    return {symbol: REASONS[code] for symbol, code in zip(packed.symbols, reason_codes.tolist()) if code}
+
+
+def dcf_arrays(packed, treasury_yield, market_return_rate, perpetual_growth_estimate, safety_margin,
+               beta_shock=0.0, growth_haircut=0.0, exact=True):
+    '''
+    Values every packed symbol at once: FCFE ratio, net income margin, growth, projected free cash flow, WACC,
+    terminal value and DCF.
+    The rate parameters, beta_shock and growth_haircut may be arrays shaped (scenarios, 1), in which case
+    every result gets a leading scenario axis. exact=False trades bit-identical powers for numpy's faster ones.
+    '''
+    years = packed.years
+    reason_codes = np.where(packed.valid, 0, REASONS.index(REJECT_INVALID_DATA)).astype(np.int8)
+
+    def reject(mask, reason):
+        nonlocal reason_codes
+        reason_codes = np.where(mask & (reason_codes == 0), np.int8(REASONS.index(reason)), reason_codes)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        projection = projection_arrays(packed, growth_haircut, exact)
+        fcfe_net_income_ratio = projection['fcfe_net_income_ratio']
+        projected_free_cash_flows = projection['projected_free_cash_flows']
+        reject(fcfe_net_income_ratio <= 0, REJECT_FCFE_RATIO)
+
+        # WACC
+        tax_rate = np.where(packed.income_tax_expense <= 0, 0.0,
+                            np.abs(packed.income_tax_expense / packed.income_before_tax))
+        reject((packed.income_tax_expense > 0) & (packed.income_before_tax == 0), REJECT_ZERO_DIVISION)
+        total = packed.total_debt + packed.market_cap
+        reject(total == 0, REJECT_ZERO_DIVISION)
+        debt_weight = packed.total_debt / total
+        equity_weight = packed.market_cap / total
+        treasury_rate = float(treasury_yield) * 0.01
+        beta = packed.beta * (1 + np.asarray(beta_shock))
+        equity_cost = treasury_rate + beta * (market_return_rate - treasury_rate)
+        debt_cost = safe_divide(packed.interest_expense, packed.total_debt)
+        wacc = debt_weight * debt_cost * (1 - tax_rate) + equity_weight * equity_cost
+        reject(wacc < perpetual_growth_estimate, REJECT_WACC_BELOW_GROWTH)
+
+        # Terminal value
+        base_value = projected_free_cash_flows[..., -1]
+        reject(base_value <= 0, REJECT_TERMINAL_BASE)
+        reject(wacc == perpetual_growth_estimate, REJECT_ZERO_DIVISION)
+        terminal_value = base_value * (1 + perpetual_growth_estimate) / (wacc - perpetual_growth_estimate)
+        terminal_value = np.where(terminal_value < 0, 0.0, terminal_value)
+
+        # Discounted cash flow, the last projected year and the terminal value share a discount rate
+        return_multiplier = wacc + 1
+        discount_rates = [return_multiplier]
+        for _ in range(1, years):
+            discount_rates.append(discount_rates[-1] * return_multiplier)
+        discount_rates.append(discount_rates[-1])
+        values_to_discount = [projected_free_cash_flows[..., period] for period in range(PROJECTION_PERIODS)]
+        values_to_discount.append(terminal_value)
+        dcf = sequential_sum(value / rate for rate, value in zip(discount_rates, values_to_discount))
+
+        reject(packed.market_cap == 0, REJECT_ZERO_DIVISION)
+        percentage_diff = dcf / packed.market_cap - 1
+        reject(~(percentage_diff > safety_margin), REJECT_SAFETY_MARGIN)
+
+    return {
+        'fcfe_net_income_ratio': fcfe_net_income_ratio,
+        'net_income_margin': projection['net_income_margin'],
+        'earnings_growth_rate': projection['earnings_growth_rate'],
+        'projected_free_cash_flows': projected_free_cash_flows,
+        'wacc': wacc,
+        'terminal_value': terminal_value,
+        'dcf': dcf,
+        'percentage_diff': percentage_diff,
+        'reason_codes': reason_codes,
+    }
+
+
+def batch_dcf(packed, treasury_yield, market_return_rate, perpetual_growth_estimate, safety_margin):
+    arrays = dcf_arrays(packed, treasury_yield, market_return_rate, perpetual_growth_estimate, safety_margin)
+    reason_codes = arrays.pop('reason_codes')
+    rejections = {symbol: REASONS[code] for symbol, code in zip(packed.symbols, reason_codes.tolist()) if code}
+    return BatchValuation(symbols=packed.symbols, market_cap=packed.market_cap, latest_price=packed.latest_price,
+                          accepted=reason_codes == 0, rejections=rejections, **arrays)
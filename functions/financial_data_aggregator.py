@@ -1,9 +1,15 @@
+import asyncio
+import logging
+import os
+
 from flask import jsonify
-import requests
 from dotenv import load_dotenv
-import os
 
-from functions.check_limit import check_limit
+from functions.http_client import http_client
+from functions.metrics import span
+from functions.statements import STATEMENT_ATTRIBUTES, SymbolFinancials, parse_annual_reports
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 
@@ -19,59 +25,43 @@ ADDITIONAL_OVERVIEW_DATA = [
     ('PriceToBookRatio', 'Price to book ratio')
 ]
 
-
-def create_empty_dict(keys_array):
-    return {key: [] for key in keys_array}
-
-
-def add_years_data(sub_category_dict, current_year_data):
-    for key in sub_category_dict.keys():
-        if current_year_data[key] == 'None':
-            sub_category_dict[key].append(0)
-        else:
-            sub_category_dict[key].append(int(current_year_data[key]))
+# REALTIME_BULK_QUOTES takes up to 100 comma separated symbols, it needs a premium key
+BULK_QUOTE_BATCH_SIZE = 100
+BULK_QUOTES_ENABLED = os.getenv('ALPHA_VANTAGE_BULK_QUOTES', 'true').lower() == 'true'
 
 
 class FinancialDataTypeSwitch:
-    def __init__(self):
+    ''' Fetches and collects the financial data of one run, see RunContext '''
+    # Turned off for the rest of the process once the API key turns out not to include bulk quotes
+    bulk_quotes_available = BULK_QUOTES_ENABLED
+
+    def __init__(self, alpha_vantage=None):
         self.financial_data_aggregate = {}
-        self.symbols_to_remove = []
+        self.symbols_to_remove = set()
         self.global_data = {}
-        # For 4 years data
-        self.year_range = range(4)
-        self.current_company = None
-        self.api_key = os.getenv("ALPHA_VANTAGE_API_KEY")
-
-    def get_sub_category_data(self, *, data, year_range, keys):
-        sub_category_dict = create_empty_dict(keys)
-        for idx in year_range:
-            try:
-                current_year_data = data['annualReports'][idx]
-                add_years_data(sub_category_dict, current_year_data)
-            except:
-                print("removing symbol because of error in getting sub-category", )
-                self.add_symbols_to_remove(self.current_company)
-                continue
-        return sub_category_dict
+        self.alpha_vantage = alpha_vantage or http_client.alpha_vantage
 
-    def add_symbols_to_remove(self, current_company):
-        self.symbols_to_remove.append(current_company)
+    def get_symbol_financials(self, symbol):
+        if symbol not in self.financial_data_aggregate:
+            self.financial_data_aggregate[symbol] = SymbolFinancials()
+        return self.financial_data_aggregate[symbol]
 
-    def set_current_company(self, company):
-        self.current_company = company
-
-    def add_to_financial_data_aggregate(self, key, value):
+    def add_statement(self, symbol, statement, data):
+        ''' Parses the line items of the annual reports once, symbols missing a year or an item are removed '''
         try:
-            if self.current_company not in self.financial_data_aggregate:
-                self.financial_data_aggregate[self.current_company] = {}
-            if value != 'None' or value != '':
-                self.financial_data_aggregate[self.current_company][key] = value
-            else:
-                print('company', self.current_company,
-                      'removed from queried companies in add_to_financial_data_aggregate')
-                self.add_symbols_to_remove(self.current_company)
-        except:
-            print("error in adding data to financial", key, value)
+            values = parse_annual_reports(data['annualReports'], statement)
+        except (KeyError, IndexError, TypeError, ValueError):
+            logger.warning('removing symbol because of error in getting sub-category %s', symbol)
+            self.add_symbols_to_remove(symbol)
+            return
+        self.get_symbol_financials(symbol).set_statement(statement, values)
+
+    def add_symbols_to_remove(self, symbol):
+        self.symbols_to_remove.add(symbol)
+
+    def add_to_financial_data_aggregate(self, symbol, key, value):
+        ''' Numeric fields that cannot be parsed are kept as None and reject the symbol in the valuation '''
+        self.get_symbol_financials(symbol).set(key, value)
 
     def get_financial_data_aggregate(self):
         return self.financial_data_aggregate
@@ -80,95 +70,98 @@ class FinancialDataTypeSwitch:
         return self.global_data
 
     async def get_data(self, function_type, symbol):
-        check_limit()
-        api_url = f'https://www.alphavantage.co/query?function={function_type}&symbol={symbol}&apikey={self.api_key}'
-        response = requests.get(api_url)
-        self.set_current_company(symbol)
-        if response.status_code == 200:
-            data = response.json()
+        result = await self.alpha_vantage(function_type, symbol)
+        if result.ok:
+            data = result.data
             if len(data) == 0:
-                print('data in financial aggregator is empty for', symbol)
+                logger.warning('Stock %s returned an empty dictionary response, removing it', symbol)
                 self.add_symbols_to_remove(symbol)
-                print(f"Stock {symbol} returned an empty dictionary response", symbol)
             else:
-                self.process_data(function_type, data)
+                self.process_data(function_type, symbol, data)
         else:
-            error = jsonify({'error': f'Failed to fetch {function_type} data for {symbol}'})
-            print(error)
+            logger.warning('removing %s: %s', symbol, result.error)
             self.add_symbols_to_remove(symbol)
 
     async def get_overview_data(self, symbol):
-        check_limit()
-        api_url = f'https://www.alphavantage.co/query?function=OVERVIEW&symbol={symbol}&apikey={self.api_key}'
-        response = requests.get(api_url)
-        self.current_company = symbol
-        print('getting overview data')
-        if response.status_code == 200:
-            data = response.json()
-            self.add_to_financial_data_aggregate('BETA', data['Beta'])
-            self.add_to_financial_data_aggregate('MARKET_CAPITALIZATION', data['MarketCapitalization'])
-            self.add_to_financial_data_aggregate('SHARES_OUTSTANDING', data['SharesOutstanding'])
+        result = await self.alpha_vantage('OVERVIEW', symbol)
+        logger.debug('getting overview data')
+        if result.ok:
+            data = result.data
+            self.add_to_financial_data_aggregate(symbol, 'BETA', data['Beta'])
+            self.add_to_financial_data_aggregate(symbol, 'MARKET_CAPITALIZATION', data['MarketCapitalization'])
+            self.add_to_financial_data_aggregate(symbol, 'SHARES_OUTSTANDING', data['SharesOutstanding'])
             for key, value in ADDITIONAL_OVERVIEW_DATA:
-                self.add_to_financial_data_aggregate(key, data[key])
+                self.add_to_financial_data_aggregate(symbol, key, data[key])
 
         else:
             self.add_symbols_to_remove(symbol)
 
+    async def get_bulk_price_data(self, symbols):
+        ''' Latest prices of up to BULK_QUOTE_BATCH_SIZE symbols in one call, returns the symbols left without one '''
+        if not self.bulk_quotes_available:
+            return list(symbols)
+        result = await self.alpha_vantage('REALTIME_BULK_QUOTES', ','.join(symbols))
+        if not result.ok:
+            if result.premium_only:
+                logger.info('bulk quotes are not included in the API key, pricing one symbol per call')
+                FinancialDataTypeSwitch.bulk_quotes_available = False
+            return list(symbols)
+        priced = set()
+        for quote in result.data.get('data', []):
+            try:
+                symbol = quote['symbol']
+                if symbol not in symbols or float(quote['close']) <= 0:
+                    continue
+                self.add_to_financial_data_aggregate(symbol, 'LATEST_PRICE', quote['close'])
+                self.add_to_financial_data_aggregate(symbol, 'LATEST_PRICE_DATE', quote['timestamp'][:10])
+                priced.add(symbol)
+            except (KeyError, TypeError, ValueError):
+                logger.warning('skipping malformed bulk quote %s', quote)
+        return [symbol for symbol in symbols if symbol not in priced]
+
+    async def get_batch_price_data(self, symbols):
+        ''' Prices a batch with one bulk call, symbols the bulk quotes miss fall back to a quote each '''
+        missing_symbols = await self.get_bulk_price_data(symbols)
+        await asyncio.gather(*[self.get_price_data(symbol) for symbol in missing_symbols])
+
     async def get_price_data(self, symbol):
-        check_limit()
         try:
-            api_url = f'https://www.alphavantage.co/query?function=TIME_SERIES_DAILY_ADJUSTED&symbol={symbol}&apikey={self.api_key}'
-            response = requests.get(api_url)
-            self.current_company = symbol
-            if response.status_code == 200:
-                data = response.json()
-                latest_daily_price_date, latest_daily_price = next(iter(data["Time Series (Daily)"].items()))
-                self.add_to_financial_data_aggregate('LATEST_PRICE', latest_daily_price["4. close"])
-                self.add_to_financial_data_aggregate('LATEST_PRICE_DATE', latest_daily_price_date)
+            result = await self.alpha_vantage('GLOBAL_QUOTE', symbol)
+            if result.ok:
+                quote = result.data['Global Quote']
+                self.add_to_financial_data_aggregate(symbol, 'LATEST_PRICE', quote['05. price'])
+                self.add_to_financial_data_aggregate(symbol, 'LATEST_PRICE_DATE', quote['07. latest trading day'])
             else:
-                print('removing symbol due to failing to get price data')
+                logger.warning('removing %s due to failing to get price data', symbol)
                 self.add_symbols_to_remove(symbol)
-        except:
-            print('removing symbol due to failing to get price data')
+        except (KeyError, ValueError, TypeError) as e:
+            logger.warning('removing %s due to failing to get price data: %r', symbol, e)
             self.add_symbols_to_remove(symbol)
 
     async def get_treasury_data(self):
-        check_limit()
-        api_url = f'https://www.alphavantage.co/query?function=TREASURY_YIELD&apikey={self.api_key}'
-        response = requests.get(api_url)
-        if response.status_code == 200:
-            data = response.json()
+        result = await self.alpha_vantage('TREASURY_YIELD')
+        if result.ok:
+            data = result.data
             self.global_data['TREASURY_YIELD'] = data['data'][0]['value']
         else:
             error = jsonify({'error': f'Failed to fetch treasury data'})
             raise Exception(error)
 
-    def process_data(self, function_type, data):
+    def process_data(self, function_type, symbol, data):
         default = "Incorrect data"
         try:
-            return getattr(self, str(function_type).lower(), lambda: default)(data)
-        except:
-            raise Exception(f"{function_type} processing had an error (process_data)")
-
-    def cash_flow(self, data):
-        keys = ['operatingCashflow', 'capitalExpenditures']
-
-        self.add_to_financial_data_aggregate('CASH_FLOW',
-                                             self.get_sub_category_data(data=data, year_range=self.year_range,
-                                                                        keys=keys))
+            with span('parse_statement'):
+                return getattr(self, STATEMENT_ATTRIBUTES.get(function_type, ''), lambda *args: default)(symbol, data)
+        except (KeyError, ValueError, TypeError) as e:
+            logger.warning('%s processing of %s had an error: %r', function_type, symbol, e)
+            raise Exception(f"{function_type} processing had an error (process_data)") from e
 
-    def income_statement(self, data):
-        keys = ['totalRevenue', 'netIncome', 'incomeBeforeTax', 'interestAndDebtExpense', 'incomeTaxExpense',
-                'interestExpense']
-        self.add_to_financial_data_aggregate('INCOME_STATEMENT',
-                                             self.get_sub_category_data(data=data, year_range=self.year_range,
-                                                                        keys=keys))
+    def cash_flow(self, symbol, data):
+        self.add_statement(symbol, 'CASH_FLOW', data)
 
-    def balance_sheet(self, data):
-        keys = ['commonStockSharesOutstanding', 'shortTermDebt', 'longTermDebt']
-        self.add_to_financial_data_aggregate('BALANCE_SHEET',
-                                             self.get_sub_category_data(data=data, year_range=self.year_range,
-                                                                        keys=keys))
+    def income_statement(self, symbol, data):
+        self.add_statement(symbol, 'INCOME_STATEMENT', data)
 
+    def balance_sheet(self, symbol, data):
+        self.add_statement(symbol, 'BALANCE_SHEET', data)
 
-financial_data_aggregator = FinancialDataTypeSwitch()
@@ -0,0 +1,69 @@
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+MARKET_TIME_ZONE = ZoneInfo('America/New_York')
+MARKET_CLOSE = time(16, 0)
+# Alpha Vantage has the day's closes a few minutes after the market closes
+CLOSE_PUBLISH_DELAY = timedelta(minutes=15)
+
+STATEMENT_FUNCTION_TYPES = ['CASH_FLOW', 'INCOME_STATEMENT', 'BALANCE_SHEET']
+
+# Data that changes once per trading day, it is due again after the next close. Holidays are not known, a refresh
+# on a holiday finds the same data.
+CLOSING_FUNCTION_TYPES = ['TIME_SERIES_DAILY', 'TIME_SERIES_DAILY_ADJUSTED', 'REALTIME_BULK_QUOTES', 'GLOBAL_QUOTE',
+                          'TREASURY_YIELD', 'NEWS_SENTIMENT']
+
+# The earliest an annual report is filed after the fiscal year ends, large filers have 60 days for their 10-K
+ANNUAL_REPORT_FILING_DAYS = 30
+# Statements due for a new annual report are checked this often until it is out
+STATEMENT_RECHECK = timedelta(days=7)
+
+
+def trading_day_close(day):
+    return datetime.combine(day, MARKET_CLOSE, MARKET_TIME_ZONE) + CLOSE_PUBLISH_DELAY
+
+
+def next_close(timestamp):
+    ''' The first time after timestamp at which a trading day's closes are out '''
+    moment = datetime.fromtimestamp(timestamp, MARKET_TIME_ZONE)
+    day = moment.date()
+    if np.is_busday(day) and moment < trading_day_close(day):
+        return trading_day_close(day).timestamp()
+    return trading_day_close(np.busday_offset(day, 1 if np.is_busday(day) else 0, roll='forward').item()).timestamp()
+
+
+def previous_close(timestamp):
+    ''' The last time at or before timestamp at which a trading day's closes came out '''
+    moment = datetime.fromtimestamp(timestamp, MARKET_TIME_ZONE)
+    day = moment.date()
+    if np.is_busday(day) and trading_day_close(day) <= moment:
+        return trading_day_close(day).timestamp()
+    return trading_day_close(np.busday_offset(day, -1 if np.is_busday(day) else 0, roll='backward').item()).timestamp()
+
+
+def next_annual_report(data):
+    ''' When the annual report after the latest one in a statement response can first be out, None if unknown '''
+    try:
+        fiscal_year_end = date.fromisoformat(data['annualReports'][0]['fiscalDateEnding'])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+    next_fiscal_year_end = fiscal_year_end + timedelta(days=365)
+    return datetime.combine(next_fiscal_year_end + timedelta(days=ANNUAL_REPORT_FILING_DAYS), time(0),
+                            MARKET_TIME_ZONE).timestamp()
+
+
+def due_at(function_type, data, fetched_at, ttl):
+    '''
+    When a response fetched at fetched_at is expected to have changed. Daily data is due after the next close and
+    statements once their next annual report can be out, checked weekly from then on. Anything else, and statements
+    without a fiscal date, lasts ttl seconds.
+    '''
+    if function_type in CLOSING_FUNCTION_TYPES:
+        return next_close(fetched_at)
+    if function_type in STATEMENT_FUNCTION_TYPES:
+        expected = next_annual_report(data)
+        if expected is not None:
+            return next_close(max(expected, fetched_at + STATEMENT_RECHECK.total_seconds()))
+    return fetched_at + ttl
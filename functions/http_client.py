@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+from functions.metrics import api_calls, api_call_seconds, cache_hits, span
+from functions.payloads import PAYLOAD_EXTRACTORS, extract_payload
+from functions.rate_limiter import rate_limiter, DailyQuotaExceeded
+from functions.response_cache import response_cache
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ALPHA_VANTAGE_URL = os.getenv('ALPHA_VANTAGE_URL', 'https://www.alphavantage.co/query')
+
+# Maximum number of requests that can be waiting on the network at the same time
+MAX_IN_FLIGHT_REQUESTS = int(os.getenv('MAX_IN_FLIGHT_REQUESTS', 8))
+
+REQUEST_TIMEOUT_SECONDS = 30
+
+# Alpha Vantage answers throttled or rejected calls with status 200 and one of these keys instead of data
+THROTTLE_KEYS = ('Note', 'Information')
+
+# Premium-only functions are refused with the same keys, but that is no reason to pause every other call
+PREMIUM_ENDPOINT_MARKER = 'premium endpoint'
+
+
+@dataclass
+class FetchResult:
+    ''' Outcome of a single API call, owned by the caller instead of shared state on the aggregator '''
+    function_type: str
+    symbol: Optional[str]
+    status_code: Optional[int]
+    data: Optional[dict] = None
+    error: Optional[str] = None
+    from_cache: bool = False
+
+    @property
+    def ok(self):
+        return self.status_code == 200 and self.error is None
+
+    @property
+    def premium_only(self):
+        return self.error is not None and PREMIUM_ENDPOINT_MARKER in self.error
+
+
+def get_throttle_message(data):
+    if not isinstance(data, dict):
+        return None
+    for key in THROTTLE_KEYS:
+        if key in data and len(data) == 1:
+            return data[key]
+    return None
+
+
+class HttpClient:
+    '''
+    Keep-alive connection pool shared by every fetch. The blocking requests calls run on a dedicated
+    thread pool so coroutines gathered with asyncio.gather really overlap on the network.
+    '''
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT_REQUESTS):
+        self.max_in_flight = max_in_flight
+        self.api_key = os.getenv("ALPHA_VANTAGE_API_KEY")
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_in_flight)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='http')
+        # Flask runs every async view in a fresh event loop, so the semaphore is created per loop
+        self._semaphores = weakref.WeakKeyDictionary()
+        # Stale cache entries are refreshed on a loop of their own so they outlive the request that served them
+        self._revalidation_loop = None
+        self._revalidating = set()
+        self._revalidation_lock = threading.Lock()
+
+    def _get_semaphore(self):
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_in_flight)
+            self._semaphores[loop] = semaphore
+        return semaphore
+
+    async def _run_in_pool(self, func, *args):
+        async with self._get_semaphore():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+
+    def _get(self, url, params=None, headers=None, stream=False):
+        return self.session.get(url, params=params, headers=headers, timeout=REQUEST_TIMEOUT_SECONDS, stream=stream)
+
+    async def get(self, url, headers=None):
+        return await self._run_in_pool(self._get, url, None, headers)
+
+    def _get_alpha_vantage(self, query, extractor, params):
+        '''
+        Makes the call and reads a streamed body in the same pool task, so its connection is released before the task
+        ends and the next call can start. The connection is kept for reuse unless the rest of the body was too large
+        to drain. Returns the response and the extracted payload, if streamed.
+        '''
+        response = self._get(ALPHA_VANTAGE_URL, query, None, extractor is not None)
+        if extractor is None:
+            return response, None
+        if response.status_code != 200:
+            response.close()
+            return response, None
+        with span('parse_json'):
+            return response, extract_payload(response, extractor, params)
+
+    def _get_revalidation_loop(self):
+        with self._revalidation_lock:
+            if self._revalidation_loop is None:
+                self._revalidation_loop = asyncio.new_event_loop()
+                threading.Thread(target=self._revalidation_loop.run_forever, name='cache-revalidation',
+                                 daemon=True).start()
+            return self._revalidation_loop
+
+    def _revalidate(self, function_type, symbol, params):
+        key = (function_type, symbol, tuple(sorted(params.items())))
+        with self._revalidation_lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        async def refresh():
+            try:
+                await self.fetch_alpha_vantage(function_type, symbol, **params)
+            finally:
+                with self._revalidation_lock:
+                    self._revalidating.discard(key)
+
+        asyncio.run_coroutine_threadsafe(refresh(), self._get_revalidation_loop())
+
+    async def alpha_vantage(self, function_type, symbol=None, **params):
+        cached = response_cache.get(function_type, symbol, params)
+        if cached is not None:
+            cache_hits.inc(function_type)
+            if cached.revalidate:
+                self._revalidate(function_type, symbol, params)
+            return FetchResult(function_type, symbol, 200, data=cached.data, from_cache=True)
+        return await self.fetch_alpha_vantage(function_type, symbol, **params)
+
+    async def planned_alpha_vantage(self, plan, function_type, symbol=None, **params):
+        ''' Like alpha_vantage, but serves stale entries the refresh plan defers however old they are '''
+        if plan.defers(function_type, symbol if symbol is not None else params.get('tickers')):
+            cached = response_cache.get(function_type, symbol, params, ignore_ttl=True)
+            if cached is not None:
+                cache_hits.inc(function_type)
+                return FetchResult(function_type, symbol, 200, data=cached.data, from_cache=True)
+        return await self.alpha_vantage(function_type, symbol, **params)
+
+    async def cached_alpha_vantage(self, function_type, symbol=None, **params):
+        ''' Offline lookup, returns the last stored response however old it is and never calls the API '''
+        cached = response_cache.get(function_type, symbol, params, ignore_ttl=True)
+        if cached is None:
+            return FetchResult(function_type, symbol, None, error=f'No stored {function_type} data for {symbol}')
+        cache_hits.inc(function_type)
+        return FetchResult(function_type, symbol, 200, data=cached.data, from_cache=True)
+
+    async def fetch_alpha_vantage(self, function_type, symbol=None, **params):
+        query = {'function': function_type, **params, 'apikey': self.api_key}
+        if symbol is not None:
+            query['symbol'] = symbol
+        try:
+            await rate_limiter.acquire()
+        except DailyQuotaExceeded as e:
+            api_calls.inc(function_type, 'quota_exceeded')
+            return FetchResult(function_type, symbol, None, error=str(e))
+        # Large payloads are streamed and only the part their consumer reads is kept
+        extractor = PAYLOAD_EXTRACTORS.get(function_type)
+        started = time.perf_counter()
+        try:
+            response, data = await self._run_in_pool(self._get_alpha_vantage, query, extractor, params)
+        except requests.RequestException as e:
+            api_calls.inc(function_type, 'request_error')
+            logger.warning('%s request for %s failed: %s', function_type, symbol, e)
+            return FetchResult(function_type, symbol, None, error=str(e))
+        except (ValueError, KeyError, TypeError) as e:
+            # Only a streamed body with status 200 is read in the pool
+            api_calls.inc(function_type, 'invalid_json')
+            return FetchResult(function_type, symbol, 200, error=str(e))
+        finally:
+            api_call_seconds.observe(time.perf_counter() - started, function_type)
+
+        if response.status_code != 200:
+            response.close()
+            api_calls.inc(function_type, f'http_{response.status_code}')
+            logger.warning('%s request for %s returned status %s', function_type, symbol, response.status_code)
+            return FetchResult(function_type, symbol, response.status_code,
+                               error=f'Failed to fetch {function_type} data for {symbol}')
+        if extractor is None:
+            try:
+                with span('parse_json'):
+                    data = response.json()
+            except (ValueError, KeyError, TypeError) as e:
+                api_calls.inc(function_type, 'invalid_json')
+                return FetchResult(function_type, symbol, response.status_code, error=str(e))
+        throttle_message = get_throttle_message(data)
+        if throttle_message is not None and PREMIUM_ENDPOINT_MARKER in throttle_message:
+            api_calls.inc(function_type, 'premium_only')
+            return FetchResult(function_type, symbol, response.status_code, error=throttle_message)
+        if throttle_message is not None:
+            api_calls.inc(function_type, 'throttled')
+            logger.warning('%s request for %s was throttled: %s', function_type, symbol, throttle_message)
+            await asyncio.get_running_loop().run_in_executor(None, rate_limiter.drain)
+            return FetchResult(function_type, symbol, response.status_code, error=throttle_message)
+        api_calls.inc(function_type, 'ok')
+        if len(data) > 0:
+            response_cache.put(function_type, symbol, params, data)
+        return FetchResult(function_type, symbol, response.status_code, data=data)
+
+
+http_client = HttpClient()
@@ -0,0 +1,212 @@
+import asyncio
+import logging
+from datetime import date
+
+import numpy as np
+
+from functions.static_build import CHART_WINDOW
+from sql.indicators import indicator_store, STATE_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+MACD_FAST = 12
+MACD_SLOW = 26
+MACD_SIGNAL = 9
+RSI_PERIOD = 14
+SMA_WINDOWS = [50, 200]
+
+# MACD values before this many closes are still dominated by the seed and are not shown
+WARMUP_CLOSES = MACD_SLOW + MACD_SIGNAL
+
+# Closes a new symbol is seeded with, enough for the EMAs to settle before the charted window starts
+SEED_CLOSES = CHART_WINDOW + 4 * WARMUP_CLOSES
+
+# The compact daily series covers the last 100 trading days
+COMPACT_SERIES_TRADING_DAYS = 100
+
+# Signal keys filled from the indicator store
+INDICATOR_KEYS = ['MACD', 'RSI'] + [f'SMA_{window}' for window in SMA_WINDOWS]
+
+
+def ema_alpha(span):
+    return 2 / (span + 1)
+
+
+def empty_state(count):
+    return {column: np.zeros(count) for column in STATE_COLUMNS}
+
+
+def advance(state, closes):
+    '''
+    Steps the indicator state of every symbol through its new closes at once, one trading day per iteration.
+    state holds one array per STATE_COLUMNS entry, closes is shaped (symbols, days) and NaN after a symbol's last
+    new close. Returns the new state and (symbols, days) arrays of MACD, signal, histogram and RSI, NaN wherever
+    there was no close or the indicator is still warming up.
+    '''
+    state = {column: values.copy() for column, values in state.items()}
+    count, days = closes.shape
+    values = {column: np.full((count, days), np.nan) for column in ['macd', 'macd_signal', 'macd_hist', 'rsi']}
+    fast, slow, signal = ema_alpha(MACD_FAST), ema_alpha(MACD_SLOW), ema_alpha(MACD_SIGNAL)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for day in range(days):
+            close = closes[:, day]
+            has_close = ~np.isnan(close)
+            first = state['close_count'] == 0
+            ema_fast = np.where(first, close, state['ema_fast'] + fast * (close - state['ema_fast']))
+            ema_slow = np.where(first, close, state['ema_slow'] + slow * (close - state['ema_slow']))
+            macd = ema_fast - ema_slow
+            macd_signal = np.where(first, macd, state['macd_signal'] + signal * (macd - state['macd_signal']))
+
+            # Wilder's smoothing, a plain running mean over the first RSI_PERIOD changes
+            change = np.where(first, 0.0, close - state['last_close'])
+            changes = np.maximum(state['close_count'], 1)
+            divisor = np.minimum(changes, RSI_PERIOD)
+            avg_gain = np.where(first, 0.0, state['avg_gain'] + (np.maximum(change, 0) - state['avg_gain']) / divisor)
+            avg_loss = np.where(first, 0.0, state['avg_loss'] + (np.maximum(-change, 0) - state['avg_loss']) / divisor)
+            rsi = np.where(avg_loss == 0, 100.0, 100 - 100 / (1 + avg_gain / avg_loss))
+
+            close_count = state['close_count'] + 1
+            for column, new_values in [('ema_fast', ema_fast), ('ema_slow', ema_slow), ('macd_signal', macd_signal),
+                                       ('avg_gain', avg_gain), ('avg_loss', avg_loss), ('last_close', close),
+                                       ('close_count', close_count)]:
+                state[column] = np.where(has_close, new_values, state[column])
+
+            shown = has_close & (close_count >= WARMUP_CLOSES)
+            values['macd'][:, day] = np.where(shown, macd, np.nan)
+            values['macd_signal'][:, day] = np.where(shown, macd_signal, np.nan)
+            values['macd_hist'][:, day] = np.where(shown, macd - macd_signal, np.nan)
+            values['rsi'][:, day] = np.where(has_close & (close_count > RSI_PERIOD), rsi, np.nan)
+    return state, values
+
+
+def latest_moving_averages(closes_by_symbol, symbols):
+    ''' Simple moving averages ending at each symbol's last stored close, None without enough closes '''
+    window = max(SMA_WINDOWS)
+    closes = np.full((len(symbols), window), np.nan)
+    for idx, symbol in enumerate(symbols):
+        symbol_closes = [row['close'] for row in closes_by_symbol[symbol]][-window:]
+        if symbol_closes:
+            closes[idx, window - len(symbol_closes):] = symbol_closes
+    averages = {}
+    for sma_window in SMA_WINDOWS:
+        recent = closes[:, -sma_window:]
+        complete = ~np.isnan(recent).any(axis=1)
+        means = np.where(complete, np.nan_to_num(recent).mean(axis=1), np.nan)
+        averages[f'SMA_{sma_window}'] = means
+    return {symbol: {key: None if np.isnan(means[idx]) else round(float(means[idx]), 2)
+                     for key, means in averages.items()}
+            for idx, symbol in enumerate(symbols)}
+
+
+def series_to_fetch(state, latest_date):
+    '''
+    Which daily series a symbol needs before its latest close can be appended: none when the close follows the
+    stored one, compact to fill a gap of missed trading days and full to seed a new or long unseen symbol
+    '''
+    if state is None:
+        return 'full'
+    missed_days = np.busday_count(date.fromisoformat(state['price_date']), date.fromisoformat(latest_date)) - 1
+    if missed_days <= 0:
+        return None
+    if missed_days < COMPACT_SERIES_TRADING_DAYS:
+        return 'compact'
+    return 'full'
+
+
+async def fetch_daily_closes(alpha_vantage, symbol, outputsize):
+    ''' Closes by date from TIME_SERIES_DAILY, None when it could not be fetched '''
+    result = await alpha_vantage('TIME_SERIES_DAILY', symbol, outputsize=outputsize)
+    if not result.ok and result.premium_only and outputsize == 'full':
+        result = await alpha_vantage('TIME_SERIES_DAILY', symbol, outputsize='compact')
+    if not result.ok:
+        logger.warning('no daily series for %s: %s', symbol, result.error)
+        return None
+    try:
+        return {price_date: float(day['4. close']) for price_date, day in result.data['Time Series (Daily)'].items()}
+    except (KeyError, TypeError, ValueError) as e:
+        logger.warning('invalid daily series for %s: %s', symbol, e)
+        return None
+
+
+async def update_indicators(symbols, data, alpha_vantage):
+    '''
+    Appends each symbol's latest close from the aggregate to the indicator store and steps its indicators forward.
+    Symbols that are new or missed trading days are caught up with one daily series call, the others need none.
+    '''
+    states = indicator_store.get_states(symbols)
+    latest_closes = {}
+    fetches = {}
+    for symbol in symbols:
+        financials = data.get(symbol)
+        if financials is None or financials.latest_price is None or financials.latest_price_date is None:
+            continue
+        latest_closes[symbol] = (financials.latest_price_date, financials.latest_price)
+        outputsize = series_to_fetch(states.get(symbol), latest_closes[symbol][0])
+        if outputsize is not None:
+            fetches[symbol] = outputsize
+    fetched = await asyncio.gather(*[fetch_daily_closes(alpha_vantage, symbol, outputsize)
+                                     for symbol, outputsize in fetches.items()])
+    fetched_closes = dict(zip(fetches, fetched))
+
+    new_closes = {}
+    reseeded_symbols = []
+    for symbol, (latest_date, latest_close) in latest_closes.items():
+        closes = fetched_closes.get(symbol, {})
+        if closes is None:
+            # Appending to a gap would skew every average, the symbol is caught up on the next run instead
+            continue
+        closes[latest_date] = latest_close
+        state = states.get(symbol)
+        if fetches.get(symbol) == 'full':
+            reseeded_symbols.append(symbol)
+            new_closes[symbol] = sorted(closes.items())[-SEED_CLOSES:]
+        else:
+            new_closes[symbol] = sorted(item for item in closes.items() if item[0] > state['price_date'])
+    new_closes = {symbol: closes for symbol, closes in new_closes.items() if closes}
+    if new_closes:
+        save_new_closes(new_closes, states, reseeded_symbols)
+
+
+def save_new_closes(new_closes, states, reseeded_symbols):
+    symbols = list(new_closes)
+    state = empty_state(len(symbols))
+    for idx, symbol in enumerate(symbols):
+        if symbol in states and symbol not in reseeded_symbols:
+            for column in STATE_COLUMNS:
+                state[column][idx] = states[symbol][column]
+    days = max(len(closes) for closes in new_closes.values())
+    close_matrix = np.full((len(symbols), days), np.nan)
+    for idx, symbol in enumerate(symbols):
+        close_matrix[idx, :len(new_closes[symbol])] = [close for _, close in new_closes[symbol]]
+
+    state, values = advance(state, close_matrix)
+
+    new_states = {symbol: {'price_date': new_closes[symbol][-1][0],
+                           **{column: float(state[column][idx]) for column in STATE_COLUMNS}}
+                  for idx, symbol in enumerate(symbols)}
+    close_rows = [(symbol, price_date, close) for symbol in symbols for price_date, close in new_closes[symbol]]
+    value_rows = []
+    for idx, symbol in enumerate(symbols):
+        for day, (price_date, _) in enumerate(new_closes[symbol]):
+            if not np.isnan(values['macd'][idx, day]):
+                value_rows.append((symbol, price_date, *[None if np.isnan(values[column][idx, day])
+                                                         else round(float(values[column][idx, day]), 4)
+                                                         for column in ['macd', 'macd_signal', 'macd_hist', 'rsi']]))
+    indicator_store.save(new_states, close_rows, value_rows, reseeded_symbols, max(SMA_WINDOWS), CHART_WINDOW)
+
+
+def get_indicator_signals(symbols):
+    ''' The charted MACD window, the latest RSI and the moving averages of each symbol from the indicator store '''
+    values_by_symbol = indicator_store.get_values(symbols, CHART_WINDOW)
+    moving_averages = latest_moving_averages(indicator_store.get_closes(symbols, max(SMA_WINDOWS)), symbols)
+    signals = {}
+    for symbol in symbols:
+        rows = values_by_symbol[symbol]
+        signals[symbol] = {
+            'MACD': {row['price_date']: {'MACD': row['macd'], 'MACD_Hist': row['macd_hist'],
+                                         'MACD_Signal': row['macd_signal']} for row in rows},
+            'RSI': round(rows[-1]['rsi'], 2) if rows and rows[-1]['rsi'] is not None else None,
+            **moving_averages[symbol],
+        }
+    return signals
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sql.helpers import database_path
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_FINISHED = 'finished'
+JOB_FAILED = 'failed'
+
+# Jobs left in these states by a crashed or restarted process are picked up again on startup
+UNFINISHED_STATES = (JOB_QUEUED, JOB_RUNNING)
+
+CREATE_TABLES = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    progress TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS job_checkpoints (
+    job_id TEXT NOT NULL REFERENCES jobs (id),
+    stage TEXT NOT NULL,
+    item TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (job_id, stage, item)
+);
+'''
+
+
+class JobStore:
+    def __init__(self, path=database_path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        # One connection shared by the job thread and the request threads polling it, always used under the lock.
+        # A run saves a checkpoint per item, a connection opened and closed for each cost more than the write.
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.executescript(CREATE_TABLES)
+        return self._conn
+
+    def create(self, name, params):
+        job_id = uuid.uuid4().hex
+        now = datetime.now().isoformat()
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute('INSERT INTO jobs (id, name, params, status, progress, created_at, updated_at) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (job_id, name, json.dumps(params), JOB_QUEUED, '{}', now, now))
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        for key in ('params', 'progress', 'result'):
+            job[key] = json.loads(job[key]) if job[key] is not None else None
+        return job
+
+    def get_unfinished(self, name):
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute(f'SELECT id FROM jobs WHERE name = ? AND status IN '
+                                f'({", ".join("?" * len(UNFINISHED_STATES))}) ORDER BY created_at',
+                                (name, *UNFINISHED_STATES)).fetchall()
+        return [row['id'] for row in rows]
+
+    def update(self, job_id, **fields):
+        for key in ('progress', 'result'):
+            if key in fields:
+                fields[key] = json.dumps(fields[key])
+        fields['updated_at'] = datetime.now().isoformat()
+        assignments = ', '.join(f'{key} = ?' for key in fields)
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+
+    def get_checkpoints(self, job_id):
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute('SELECT stage, item, payload FROM job_checkpoints WHERE job_id = ?',
+                                (job_id,)).fetchall()
+        return {(row['stage'], row['item']): json.loads(row['payload']) for row in rows}
+
+    def save_checkpoint(self, job_id, stage, item, payload, progress):
+        ''' Stores the checkpoint and the progress that includes it in the same transaction '''
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO job_checkpoints (job_id, stage, item, payload) '
+                             'VALUES (?, ?, ?, ?)', (job_id, stage, item, json.dumps(payload)))
+                conn.execute('UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ?',
+                             (json.dumps(progress), datetime.now().isoformat(), job_id))
+
+    def delete_checkpoints(self, job_id):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute('DELETE FROM job_checkpoints WHERE job_id = ?', (job_id,))
+
+
+class Job:
+    ''' Handle the pipeline uses to report progress and to save or look up checkpoints '''
+
+    def __init__(self, store, job_id, params):
+        self.store = store
+        self.id = job_id
+        self.params = params
+        self.checkpoints = store.get_checkpoints(job_id)
+        self.progress = {}
+
+    def start_stage(self, stage, total):
+        # Items restored from checkpoints of an earlier attempt count as done
+        done = sum(1 for checkpoint_stage, _ in self.checkpoints if checkpoint_stage == stage)
+        self.progress[stage] = {'done': done, 'total': total, 'started_at': datetime.now().isoformat()}
+        self.store.update(self.id, stage=stage, progress=self.progress)
+
+    def advance(self, stage):
+        self.progress[stage]['done'] += 1
+        self.store.update(self.id, progress=self.progress)
+
+    def get_checkpoint(self, stage, item):
+        return self.checkpoints.get((stage, item))
+
+    def save_checkpoint(self, stage, item, payload):
+        self.checkpoints[(stage, item)] = payload
+        self.progress[stage]['done'] += 1
+        self.store.save_checkpoint(self.id, stage, item, payload, self.progress)
+
+
+class JobRunner:
+    '''
+    Runs jobs one at a time on a background thread so the request that started a job returns immediately.
+    target is an async function taking the Job, its return value is stored as the job result.
+    '''
+
+    def __init__(self, name, target, store=None):
+        self.name = name
+        self.target = target
+        self.store = store or JobStore()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'job-{name}')
+        self._active = set()
+        self._lock = threading.Lock()
+
+    def submit(self, params):
+        ''' Starts a new job unless one is already queued or running, returns the job id either way '''
+        with self._lock:
+            if self._active:
+                return next(iter(self._active))
+            job_id = self.store.create(self.name, params)
+            self._active.add(job_id)
+        self.executor.submit(self._run, job_id)
+        return job_id
+
+    def resume(self, job_id):
+        with self._lock:
+            if job_id in self._active:
+                return job_id
+            self._active.add(job_id)
+        self.store.update(job_id, status=JOB_QUEUED, error=None)
+        self.executor.submit(self._run, job_id)
+        return job_id
+
+    def resume_unfinished(self):
+        for job_id in self.store.get_unfinished(self.name):
+            logger.info('resuming unfinished job %s', job_id)
+            self.resume(job_id)
+
+    def _run(self, job_id):
+        job_record = self.store.get(job_id)
+        job = Job(self.store, job_id, job_record['params'])
+        self.store.update(job_id, status=JOB_RUNNING)
+        try:
+            result = asyncio.run(self.target(job))
+            self.store.update(job_id, status=JOB_FINISHED, stage=None, result=result)
+            self.store.delete_checkpoints(job_id)
+        except Exception as e:
+            logger.error('job %s failed: %s', job_id, e)
+            self.store.update(job_id, status=JOB_FAILED, error=str(e))
+        finally:
+            with self._lock:
+                self._active.discard(job_id)
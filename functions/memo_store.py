@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from functions.metrics import memo_lookups
+from sql.helpers import database_path
+
+memo_path = os.getenv('MEMO_STORE_PATH', os.path.join(os.path.dirname(database_path), 'memo.db'))
+
+MAX_MEMO_BYTES = int(os.getenv('MAX_MEMO_BYTES', 100 * 1024 * 1024))
+
+# Kinds of memoized results
+VALUATIONS = 'valuation'
+SENSITIVITY_BANDS = 'sensitivity_bands'
+SIGNAL_CARDS = 'signal_card'
+
+# Comma separated kinds that are memoized. Only the sensitivity bands are by default: a Monte Carlo band costs a few
+# milliseconds per symbol, while hashing the inputs of a symbol and looking it up costs about as much as its batch
+# DCF valuation or rendering its card.
+MEMO_KINDS = {kind.strip() for kind in os.getenv('MEMO_KINDS', SENSITIVITY_BANDS).split(',') if kind.strip()}
+
+# SQLite caps the number of ? placeholders in one statement
+MAX_QUERY_KEYS = 500
+
+CREATE_TABLE = '''
+CREATE TABLE IF NOT EXISTS memos (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used_at FLOAT NOT NULL,
+    PRIMARY KEY (kind, key)
+)'''
+
+
+def input_hash(*parts):
+    '''
+    A digest of the exact inputs, built-in values and numpy arrays. The parts are hashed by their repr, which keeps
+    floats exact and NaN apart from None, with every array replaced by its dtype and shape and its bytes appended.
+    '''
+    arrays = [part for part in parts if isinstance(part, np.ndarray)]
+    header = [(part.dtype.str, part.shape) if isinstance(part, np.ndarray) else part for part in parts]
+    digest = hashlib.sha256(repr(header).encode('utf-8'))
+    for array in arrays:
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def key_chunks(keys):
+    keys = list(keys)
+    for start in range(0, len(keys), MAX_QUERY_KEYS):
+        yield keys[start:start + MAX_QUERY_KEYS]
+
+
+class MemoStore:
+    '''
+    Results keyed by a hash of everything they are derived from, so a result is reused as long as its inputs are
+    unchanged, across runs and restarts. Entries never go stale, the least recently used are dropped once the store
+    outgrows max_bytes.
+    '''
+
+    def __init__(self, path=memo_path, max_bytes=MAX_MEMO_BYTES, kinds=MEMO_KINDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.kinds = kinds
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        # One connection shared by every thread and always used under the lock, like the response cache
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(CREATE_TABLE)
+            conn.execute('CREATE INDEX IF NOT EXISTS memos_last_used ON memos (last_used_at)')
+            self._conn = conn
+        return self._conn
+
+    def enabled(self, kind):
+        return kind in self.kinds
+
+    def get_many(self, kind, keys):
+        ''' The stored result of every key that has one '''
+        keys = set(keys)
+        results = {}
+        with self._lock:
+            conn = self._connection()
+            for chunk in key_chunks(keys):
+                rows = conn.execute(f'SELECT key, payload FROM memos WHERE kind = ? AND '
+                                    f'key IN ({", ".join("?" * len(chunk))})', (kind, *chunk))
+                results.update((key, json.loads(payload)) for key, payload in rows)
+            if results:
+                now = time.time()
+                with conn:
+                    for chunk in key_chunks(results):
+                        conn.execute(f'UPDATE memos SET last_used_at = ? WHERE kind = ? AND '
+                                     f'key IN ({", ".join("?" * len(chunk))})', (now, kind, *chunk))
+        memo_lookups.inc(kind, 'hit', amount=len(results))
+        memo_lookups.inc(kind, 'miss', amount=len(keys) - len(results))
+        return results
+
+    def put_many(self, kind, results):
+        if not results:
+            return
+        now = time.time()
+        rows = []
+        for key, result in results.items():
+            payload = json.dumps(result)
+            rows.append((kind, key, payload, len(payload), now))
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO memos (kind, key, payload, size, last_used_at) '
+                                 'VALUES (?, ?, ?, ?, ?)', rows)
+                self._evict(conn)
+
+    def _evict(self, conn):
+        ''' Drops the least recently used entries until the store fits in max_bytes '''
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM memos').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        keys_to_delete = []
+        for kind, key, size in conn.execute('SELECT kind, key, size FROM memos ORDER BY last_used_at'):
+            if total <= self.max_bytes:
+                break
+            keys_to_delete.append((kind, key))
+            total -= size
+        conn.executemany('DELETE FROM memos WHERE kind = ? AND key = ?', keys_to_delete)
+
+
+memo_store = MemoStore()
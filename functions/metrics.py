@@ -0,0 +1,132 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+# Upper bounds in seconds, shared by every latency histogram so they can be compared side by side
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+
+def configure_logging(level=LOG_LEVEL):
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{format_labels(self.label_names, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket (+Inf last), sum]
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self.values.get(label_values)
+            if series is None:
+                series = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label_values, (bucket_counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for upper_bound, count in zip(self.buckets + ('+Inf',), bucket_counts):
+                    cumulative += count
+                    labels = format_labels(self.label_names + ('le',), label_values + (upper_bound,))
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = format_labels(self.label_names, label_values)
+                lines.append(f'{self.name}_sum{labels} {total}')
+                lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+
+    def counter(self, name, documentation, label_names=()):
+        return self.metrics.setdefault(name, Counter(name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self.metrics.setdefault(name, Histogram(name, documentation, label_names, buckets))
+
+    def render(self):
+        ''' All metrics in the Prometheus text exposition format '''
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+api_calls = registry.counter('alpha_vantage_calls_total', 'Alpha Vantage calls by function and outcome',
+                             ['function', 'status'])
+api_call_seconds = registry.histogram('alpha_vantage_call_duration_seconds',
+                                      'Alpha Vantage request latency, excluding the rate limiter wait', ['function'])
+cache_hits = registry.counter('response_cache_hits_total', 'Alpha Vantage responses served from the cache',
+                              ['function'])
+rate_limiter_wait_seconds = registry.histogram('rate_limiter_wait_seconds',
+                                               'Time spent waiting for an Alpha Vantage rate limit token')
+symbols_rejected = registry.counter('symbols_rejected_total', 'Symbols dropped from a run by reason', ['reason'])
+runs = registry.counter('runs_total', 'Valuation runs by final status', ['status'])
+run_seconds = registry.histogram('run_duration_seconds', 'Duration of a whole valuation run')
+span_seconds = registry.histogram('span_duration_seconds', 'Duration of instrumented pipeline steps', ['span'])
+page_cache_lookups = registry.counter('page_cache_lookups_total', 'Rendered page cache lookups by result', ['result'])
+memo_lookups = registry.counter('memo_lookups_total', 'Input-hash memo lookups by kind and result', ['kind', 'result'])
+refresh_items = registry.counter('refresh_items_total', 'Stale items found by the refresh planner by outcome',
+                                ['function', 'outcome'])
+
+
+@contextmanager
+def span(name):
+    ''' Times the block into span_duration_seconds, and logs it when debug logging is on '''
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        span_seconds.observe(elapsed, name)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('%s took %.4fs', name, elapsed)
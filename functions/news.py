@@ -0,0 +1,82 @@
+import hashlib
+import logging
+from collections import defaultdict
+
+from functions.payloads import NEWS_RELEVANCE_THRESHOLD, NEWS_ARTICLE_FIELDS
+
+logger = logging.getLogger(__name__)
+
+
+def get_article_id(url):
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+
+
+def is_reference_list(news):
+    ''' Signals stored before articles were deduplicated hold whole articles instead of references '''
+    return isinstance(news, list) and all(isinstance(entry, dict) and 'id' in entry for entry in news)
+
+
+class NewsIndex:
+    '''
+    The news of a run. Every fetched feed is fanned out to all tracked symbols its articles mention, each article is
+    stored once and symbols refer to it with their own sentiment score.
+    '''
+
+    def __init__(self):
+        self.articles = {}
+        # symbol -> {article id: (ticker sentiment score, relevance score)}
+        self.mentions = defaultdict(dict)
+        self.fetched_symbols = set()
+
+    def add_feed(self, symbol, feed, tracked_symbols):
+        ''' Adds the feed fetched for symbol, None when the fetch failed '''
+        if feed is None:
+            return
+        self.fetched_symbols.add(symbol)
+        for article in feed:
+            try:
+                article_id = get_article_id(article['url'])
+                ticker_sentiments = article['ticker_sentiment']
+            except (KeyError, TypeError, AttributeError):
+                logger.warning('skipping news article without url or ticker sentiment')
+                continue
+            for ticker_sentiment in ticker_sentiments:
+                try:
+                    ticker = ticker_sentiment['ticker']
+                    if ticker not in tracked_symbols:
+                        continue
+                    score = float(ticker_sentiment['ticker_sentiment_score'])
+                    relevance = float(ticker_sentiment['relevance_score'])
+                except (KeyError, TypeError, ValueError):
+                    logger.warning('error in getting news sentiment')
+                    continue
+                self.mentions[ticker][article_id] = (score, relevance)
+                if relevance >= NEWS_RELEVANCE_THRESHOLD and article_id not in self.articles:
+                    self.articles[article_id] = {field: article.get(field) for field in NEWS_ARTICLE_FIELDS}
+
+    def get_news_signals(self, symbols):
+        '''
+        NEWS references, newest first, and SENTIMENT_AVG for every symbol in one pass over the mentions.
+        Symbols without any feed and without mentions in other feeds keep the empty values of a failed fetch.
+        '''
+        news_signals = {}
+        for symbol in symbols:
+            mentions = self.mentions.get(symbol, {})
+            if not mentions and symbol not in self.fetched_symbols:
+                news_signals[symbol] = {'NEWS': [], 'SENTIMENT_AVG': {}}
+                continue
+            references = [{'id': article_id, 'sentiment': score}
+                          for article_id, (score, relevance) in mentions.items()
+                          if relevance >= NEWS_RELEVANCE_THRESHOLD]
+            references.sort(key=lambda reference: self.articles[reference['id']].get('time_published') or '',
+                            reverse=True)
+            sentiment_average = round(sum(score for score, _ in mentions.values()) / len(mentions), 2) \
+                if mentions else 0
+            news_signals[symbol] = {'NEWS': references, 'SENTIMENT_AVG': sentiment_average}
+        return news_signals
+
+    def get_referenced_articles(self, signals):
+        ''' The articles the signals refer to, keyed by id '''
+        return {reference['id']: self.articles[reference['id']]
+                for signal in signals.values() for reference in signal.get('NEWS') or []
+                if reference['id'] in self.articles}
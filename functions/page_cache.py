@@ -0,0 +1,82 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from functions.metrics import page_cache_lookups
+
+# Pages and data derived from one published run, sort variants of the signal page are cached on demand
+MAX_CACHED_ENTRIES = 64
+
+
+@dataclass(frozen=True)
+class CachedPage:
+    body: bytes
+    etag: str
+    last_modified: datetime
+
+
+def published_version(path):
+    ''' Modification time of the file a publish writes last, None before anything was published '''
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def version_time(version):
+    if version is None:
+        return datetime.fromtimestamp(0, timezone.utc)
+    return datetime.fromtimestamp(version // 10 ** 9, timezone.utc)
+
+
+def is_older(version, other):
+    return other is not None and (version is None or version < other)
+
+
+def make_page(body, version):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return CachedPage(body=body, etag=hashlib.sha1(body).hexdigest(), last_modified=version_time(version))
+
+
+class PageCache:
+    '''
+    Rendered pages and the data they are built from, for the published version only. Every entry is dropped at
+    once when a newer version is looked up, at most max_entries are kept with the least recently used going first.
+    '''
+
+    def __init__(self, max_entries=MAX_CACHED_ENTRIES):
+        self.max_entries = max_entries
+        self.version = None
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, version, key, build):
+        ''' The entry of key for version, build() makes it on a miss outside the lock '''
+        with self.lock:
+            if version == self.version and key in self.entries:
+                self.entries.move_to_end(key)
+                page_cache_lookups.inc('hit')
+                return self.entries[key]
+        page_cache_lookups.inc('miss')
+        value = build()
+        self.put(version, key, value)
+        return value
+
+    def put(self, version, key, value):
+        with self.lock:
+            if version != self.version:
+                if is_older(version, self.version):
+                    # A newer version was published while this one was being built
+                    return
+                self.entries.clear()
+                self.version = version
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+page_cache = PageCache()
@@ -0,0 +1,155 @@
+import json
+import os
+from dataclasses import dataclass
+from itertools import islice
+from typing import Callable
+
+from functions.indicators import SEED_CLOSES
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Bodies up to this size, which covers throttle notes and error messages, are parsed whole
+PREFIX_BYTES = 16 * 1024
+STREAM_CHUNK_BYTES = 64 * 1024
+# The rest of a body the extractor stopped early on is read up to this size so its connection can be reused,
+# past it the connection is dropped as reading on costs more than opening a new one
+MAX_DRAIN_BYTES = int(os.getenv('MAX_DRAIN_BYTES', 1024 * 1024))
+
+# Annual reports read by the financial data aggregator, latest first
+STATEMENT_YEARS = 4
+
+# Articles at least this relevant to a symbol are shown with it
+NEWS_RELEVANCE_THRESHOLD = 0.25
+NEWS_ARTICLE_FIELDS = ['title', 'url', 'time_published', 'source', 'overall_sentiment_score']
+TICKER_SENTIMENT_FIELDS = ['ticker', 'relevance_score', 'ticker_sentiment_score']
+
+
+@dataclass(frozen=True)
+class PayloadExtractor:
+    '''
+    The single member of a response its consumer reads. kept(entries, params) receives the member's entries
+    lazily, newest first, and returns the part worth keeping; reading stops as soon as it returns.
+    '''
+    key: str
+    object_entries: bool
+    kept: Callable
+
+    def reduce(self, data, params):
+        ''' The same reduction applied to an already parsed document '''
+        if self.key not in data:
+            return data
+        member = data[self.key]
+        entries = iter(member.items()) if self.object_entries else iter(member)
+        return {self.key: self.kept(entries, params)}
+
+    def stream(self, stream, params):
+        seen_keys = set()
+        events = watch_top_level_keys(ijson.parse(stream, use_float=True), seen_keys)
+        if self.object_entries:
+            entries = ijson.kvitems(events, self.key)
+        else:
+            entries = ijson.items(events, self.key + '.item')
+        kept = self.kept(entries, params)
+        return {self.key: kept} if self.key in seen_keys else {}
+
+
+def watch_top_level_keys(events, seen_keys):
+    for prefix, event, value in events:
+        if prefix == '' and event == 'map_key':
+            seen_keys.add(value)
+        yield prefix, event, value
+
+
+def latest_closes(entries, params):
+    return {price_date: {'4. close': day['4. close']} for price_date, day in islice(entries, SEED_CLOSES)}
+
+
+def latest_annual_reports(entries, params):
+    return list(islice(entries, STATEMENT_YEARS))
+
+
+def trimmed_news(entries, params):
+    '''
+    Every article with the fields the signal page shows and only the scores of each ticker mention. Articles are
+    kept whichever ticker they mention, they are fanned out to every symbol of the run.
+    '''
+    feed = []
+    for article in entries:
+        if not isinstance(article, dict):
+            continue
+        trimmed = {field: article[field] for field in NEWS_ARTICLE_FIELDS if field in article}
+        trimmed['ticker_sentiment'] = [
+            {key: ticker_sentiment[key] for key in TICKER_SENTIMENT_FIELDS if key in ticker_sentiment}
+            for ticker_sentiment in article.get('ticker_sentiment') or [] if isinstance(ticker_sentiment, dict)]
+        feed.append(trimmed)
+    return feed
+
+
+PAYLOAD_EXTRACTORS = {
+    'TIME_SERIES_DAILY': PayloadExtractor('Time Series (Daily)', True, latest_closes),
+    'CASH_FLOW': PayloadExtractor('annualReports', False, latest_annual_reports),
+    'INCOME_STATEMENT': PayloadExtractor('annualReports', False, latest_annual_reports),
+    'BALANCE_SHEET': PayloadExtractor('annualReports', False, latest_annual_reports),
+    'NEWS_SENTIMENT': PayloadExtractor('feed', False, trimmed_news),
+}
+
+
+class ChunkReader:
+    ''' File-like view over the buffered prefix followed by the rest of a streamed body '''
+
+    def __init__(self, prefix, chunks):
+        self.buffer = prefix
+        self.chunks = chunks
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def extract_payload(response, extractor, params):
+    '''
+    Parses a streamed response into the reduced payload its consumer reads. Small bodies, including throttle notes,
+    are parsed whole and returned as they are when they lack the member. Without ijson the whole document is parsed
+    and then reduced, so the result is the same either way. The response is closed on return, with the rest of the
+    body drained first when it is small enough to keep the connection. Raises ValueError on invalid JSON.
+    '''
+    with response:
+        chunks = response.iter_content(STREAM_CHUNK_BYTES)
+        prefix = b''
+        complete = True
+        for chunk in chunks:
+            prefix += chunk
+            if len(prefix) >= PREFIX_BYTES:
+                complete = False
+                break
+        if complete or ijson is None:
+            data = json.loads(prefix + b''.join(chunks))
+            return extractor.reduce(data, params) if isinstance(data, dict) else data
+        try:
+            payload = extractor.stream(ChunkReader(prefix, chunks), params)
+        except ijson.JSONError as e:
+            raise ValueError(f'Invalid JSON: {e}')
+        drain(chunks)
+        return payload
+
+
+def drain(chunks, max_bytes=MAX_DRAIN_BYTES):
+    '''
+    Reads what is left of a streamed body. A response closed with unread data takes its connection down with it,
+    one read to the end returns the connection to the pool. Bodies with more than max_bytes left are dropped unread.
+    '''
+    drained = 0
+    for chunk in chunks:
+        drained += len(chunk)
+        if drained > max_bytes:
+            return
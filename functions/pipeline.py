@@ -0,0 +1,310 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+
+from functions.additional_tickers import get_tech_stock_market_movers, get_biggest_losers
+from functions.indicators import INDICATOR_KEYS
+from functions.financial_data_aggregator import ADDITIONAL_OVERVIEW_DATA, BULK_QUOTE_BATCH_SIZE
+from functions.metrics import runs, run_seconds, span, symbols_rejected
+from functions.refresh_planner import RefreshPlan, get_current_symbols, plan_refresh
+from functions.run_context import RunContext
+from functions.settings import Settings, settings_service
+from scheduler.github import add_all_in_static_and_commit
+from scheduler.notifications import notify_slack_channel
+from sql.history import history_store
+
+logger = logging.getLogger(__name__)
+
+BASE_SYMBOLS = ['MTCH', 'PYPL']
+
+STATEMENT_FUNCTION_TYPES = ['CASH_FLOW', 'INCOME_STATEMENT', 'BALANCE_SHEET']
+
+# Statements fetched one stage after the other, each only for the symbols no earlier stage rejected. A loss in any
+# year of the income statement already dooms a symbol, the cash flows reject most of the rest. The balance sheet and
+# overview are only fetched for the symbols left, and only those passing the valuation are priced.
+SCREENING_STAGES = [('income_statements', ['INCOME_STATEMENT']), ('cash_flows', ['CASH_FLOW'])]
+
+STAGES = ['symbols', 'plan'] + [stage for stage, _ in SCREENING_STAGES] + [
+    'market_data', 'screening', 'prices', 'valuation', 'signal_details', 'output', 'pages']
+
+# Reason recorded for symbols whose data could not be fetched
+REJECT_FETCH_FAILED = 'FETCH_FAILED'
+
+# Aggregate keys written by each per-symbol fetch, these are what a checkpoint stores
+AGGREGATE_KEYS = {function_type: [function_type] for function_type in STATEMENT_FUNCTION_TYPES}
+AGGREGATE_KEYS['OVERVIEW'] = ['BETA', 'MARKET_CAPITALIZATION', 'SHARES_OUTSTANDING'] + [
+    key for key, _ in ADDITIONAL_OVERVIEW_DATA]
+AGGREGATE_KEYS['PRICE'] = ['LATEST_PRICE', 'LATEST_PRICE_DATE']
+
+SIGNAL_DETAIL_KEYS = INDICATOR_KEYS + ['NEWS', 'SENTIMENT_AVG']
+
+# Every data type a symbol can be fetched for in a run: the checkpointed fetches above, then the daily closes that
+# seed its indicators and its news once it is accepted
+SYMBOL_FUNCTION_TYPES = list(AGGREGATE_KEYS) + ['TIME_SERIES_DAILY', 'NEWS_SENTIMENT']
+
+
+def restore_symbol_checkpoint(run, symbol, checkpoint):
+    for key, value in checkpoint['data'].items():
+        run.aggregator.add_to_financial_data_aggregate(symbol, key, value)
+    if checkpoint['removed']:
+        run.aggregator.add_symbols_to_remove(symbol)
+
+
+def symbol_checkpoint(run, symbol, keys):
+    financials = run.data.get(symbol)
+    return {'data': financials.to_dict(keys) if financials is not None else {},
+            'removed': symbol in run.aggregator.symbols_to_remove}
+
+
+async def fetch_with_checkpoint(run, job, stage, name, symbol, fetch):
+    ''' Runs a per-symbol fetch unless an earlier attempt of the job already stored its result '''
+    item = f'{name}:{symbol}'
+    checkpoint = job.get_checkpoint(stage, item)
+    if checkpoint is not None:
+        restore_symbol_checkpoint(run, symbol, checkpoint)
+        return
+    await fetch()
+    job.save_checkpoint(stage, item, symbol_checkpoint(run, symbol, AGGREGATE_KEYS[name]))
+
+
+def is_planned(job):
+    return job.params.get('planned') == 'true'
+
+
+async def get_symbols(job):
+    '''
+    The symbols of the run, and whether it is a close run: a full run or the first planned run after a close. Only a
+    close run publishes to git and Slack, the planned runs in between just refresh what is due.
+    '''
+    job.start_stage('symbols', 1)
+    checkpoint = job.get_checkpoint('symbols', 'symbols')
+    if checkpoint is not None:
+        return checkpoint['symbols'], checkpoint['close_run']
+    # The market movers only change with a close, planned runs in between keep the symbols of the latest run
+    symbols = get_current_symbols() if is_planned(job) else None
+    close_run = symbols is None
+    if close_run:
+        with span('scrape_yahoo'):
+            market_movers, biggest_losers = await asyncio.gather(get_tech_stock_market_movers(), get_biggest_losers())
+        symbols = list(set(BASE_SYMBOLS + market_movers + biggest_losers))
+    job.save_checkpoint('symbols', 'symbols', {'symbols': symbols, 'close_run': close_run})
+    return symbols, close_run
+
+
+def get_refresh_plan(job, symbols):
+    ''' The refresh plan of a planned run, None for a full run '''
+    if not is_planned(job):
+        return None
+    job.start_stage('plan', 1)
+    checkpoint = job.get_checkpoint('plan', 'plan')
+    if checkpoint is not None:
+        return RefreshPlan(**checkpoint)
+    plan = plan_refresh(symbols, SYMBOL_FUNCTION_TYPES)
+    job.save_checkpoint('plan', 'plan', plan.as_dict())
+    return plan
+
+
+def fetch_statement(run, job, stage, function_type, symbol):
+    return fetch_with_checkpoint(run, job, stage, function_type, symbol,
+                                 lambda: run.aggregator.get_data(function_type, symbol))
+
+
+async def get_statements(run, job, stage, function_types, symbols):
+    job.start_stage(stage, len(function_types) * len(symbols))
+    await asyncio.gather(*[fetch_statement(run, job, stage, function_type, symbol)
+                           for function_type in function_types for symbol in symbols])
+
+
+def get_fetch_failures(run, symbols):
+    return {symbol: REJECT_FETCH_FAILED for symbol in symbols if symbol in run.aggregator.symbols_to_remove}
+
+
+def reject_symbols(stage, symbols, stage_rejections, rejections):
+    ''' Records the rejections of a stage and returns the symbols still in the running, in their order '''
+    rejections.update(stage_rejections)
+    for reason in stage_rejections.values():
+        symbols_rejected.inc(reason)
+    symbols = [symbol for symbol in symbols if symbol not in stage_rejections]
+    logger.info('%s: %d symbols rejected, %d left', stage, len(stage_rejections), len(symbols))
+    logger.debug('%s rejections %s', stage, stage_rejections)
+    return symbols
+
+
+async def get_treasury_data(run, job):
+    checkpoint = job.get_checkpoint('market_data', 'TREASURY_YIELD')
+    if checkpoint is not None:
+        run.global_data['TREASURY_YIELD'] = checkpoint
+        return
+    await run.aggregator.get_treasury_data()
+    job.save_checkpoint('market_data', 'TREASURY_YIELD', run.global_data['TREASURY_YIELD'])
+
+
+async def get_price_batch(run, job, batch):
+    ''' Prices a batch of symbols under one checkpoint, so price refresh scales with the number of batches '''
+    item = 'PRICES:' + ','.join(batch)
+    checkpoint = job.get_checkpoint('prices', item)
+    if checkpoint is not None:
+        for symbol, symbol_checkpoint_data in checkpoint.items():
+            restore_symbol_checkpoint(run, symbol, symbol_checkpoint_data)
+        return
+    await run.aggregator.get_batch_price_data(batch)
+    job.save_checkpoint('prices', item,
+                        {symbol: symbol_checkpoint(run, symbol, AGGREGATE_KEYS['PRICE']) for symbol in batch})
+
+
+async def get_market_data(run, job, symbols):
+    ''' The balance sheet and overview of the symbols left after screening their statements, and the treasury yield '''
+    job.start_stage('market_data', 2 * len(symbols) + 1)
+    await asyncio.gather(
+        *[fetch_statement(run, job, 'market_data', 'BALANCE_SHEET', symbol) for symbol in symbols],
+        *[fetch_with_checkpoint(run, job, 'market_data', 'OVERVIEW', symbol,
+                                lambda symbol=symbol: run.aggregator.get_overview_data(symbol))
+          for symbol in symbols],
+        get_treasury_data(run, job))
+
+
+async def get_prices(run, job, symbols):
+    batches = [symbols[start:start + BULK_QUOTE_BATCH_SIZE] for start in range(0, len(symbols), BULK_QUOTE_BATCH_SIZE)]
+    job.start_stage('prices', len(batches))
+    await asyncio.gather(*[get_price_batch(run, job, batch) for batch in batches])
+
+
+async def add_news_feed(run, job, symbol, tracked_symbols):
+    item = f'NEWS:{symbol}'
+    checkpoint = job.get_checkpoint('signal_details', item)
+    if checkpoint is None:
+        checkpoint = {'feed': await run.calculator.fetch_news_feed(symbol)}
+        job.save_checkpoint('signal_details', item, checkpoint)
+    run.calculator.news.add_feed(symbol, checkpoint['feed'], tracked_symbols)
+
+
+def write_signal_files(signals, financial_data_aggregate, news_articles):
+    signals_json = json.dumps(signals)
+    try:
+        with span('write_signals_json'), open('static/signals.json', 'w') as f:
+            f.write(signals_json)
+        logger.info('Signals saved to signals.json')
+    except IOError as e:
+        logger.error('Error saving signals to file: %s', e)
+
+    try:
+        with span('write_news_json'), open('static/news_articles.json', 'w') as f:
+            f.write(json.dumps(news_articles))
+        logger.info('News articles saved to news_articles.json')
+    except IOError as e:
+        logger.error('Error saving news articles to file: %s', e)
+
+    financial_data_aggregate_json = json.dumps({symbol: financials.to_dict()
+                                                for symbol, financials in financial_data_aggregate.items()})
+    try:
+        with span('write_aggregate_json'), open('static/financial_data_aggregate.json', 'w') as f:
+            f.write(financial_data_aggregate_json)
+        logger.info('Data aggregate saved to financial_data_aggregate.json')
+    except IOError as e:
+        logger.error('Error saving signals to file: %s', e)
+
+
+def write_output(run, job, started_at, signals, news_articles):
+    job.start_stage('output', 1)
+    checkpoint = job.get_checkpoint('output', 'run')
+    if checkpoint is not None:
+        return checkpoint['run_id']
+    write_signal_files(signals, run.data, news_articles)
+
+    with span('save_history'):
+        run_id = history_store.save_run(started_at, run.data, run.global_data, signals,
+                                        run.calculator.settings.as_dict(), news_articles, run.rejections)
+    logger.info('run saved to the history store with id %s', run_id)
+    job.save_checkpoint('output', 'run', {'run_id': run_id})
+    return run_id
+
+
+async def run_pipeline(job, build_pages):
+    '''
+    Fetches, values and publishes the signals as a resumable job. Symbols are screened after every fetch stage, so
+    later endpoints are only called for symbols that can still pass. Every symbol fetch and every stage saves a
+    checkpoint, so running the same job again after a crash only repeats the work that was not finished. A planned
+    job first asks the refresh planner what is due and stops there when nothing is.
+    build_pages(signals, financial_data_aggregate, news_articles) renders and writes the static pages.
+    '''
+    started = time.perf_counter()
+    try:
+        result = await value_and_publish(job, build_pages)
+    except Exception:
+        runs.inc('failed')
+        raise
+    finally:
+        run_seconds.observe(time.perf_counter() - started)
+    runs.inc('finished')
+    return result
+
+
+async def value_and_publish(job, build_pages):
+    started_at = datetime.fromisoformat(job.params['started_at'])
+    # The settings are captured when the job is submitted, so a resumed job values with the same version
+    settings = Settings(**job.params['settings']) if 'settings' in job.params else settings_service.get()
+
+    symbols, close_run = await get_symbols(job)
+    plan = get_refresh_plan(job, symbols)
+    if plan is not None and plan.is_empty():
+        logger.info('nothing is due for a refresh, the published signals stay as they are')
+        return {'run_id': None, 'signal_count': None, 'refresh': plan.summary()}
+    run = RunContext(settings, plan)
+    calculator = run.calculator
+    rejections = run.rejections
+    fetched_statements = []
+    for stage, function_types in SCREENING_STAGES:
+        await get_statements(run, job, stage, function_types, symbols)
+        symbols = reject_symbols(stage, symbols, get_fetch_failures(run, symbols), rejections)
+        fetched_statements += function_types
+        symbols = reject_symbols(stage, symbols, calculator.screen_statements(symbols, run.data, fetched_statements),
+                                 rejections)
+
+    await get_market_data(run, job, symbols)
+    symbols = reject_symbols('market_data', symbols, get_fetch_failures(run, symbols), rejections)
+    if len(symbols) == 0 and all(reason == REJECT_FETCH_FAILED for reason in rejections.values()):
+        raise Exception('No symbols to loop through')
+
+    job.start_stage('screening', 1)
+    symbols = reject_symbols('screening', symbols, calculator.screen_unpriced(symbols, run.data, run.global_data),
+                             rejections)
+    job.advance('screening')
+
+    await get_prices(run, job, symbols)
+    symbols = reject_symbols('prices', symbols, get_fetch_failures(run, symbols), rejections)
+
+    job.start_stage('valuation', 1)
+    accepted_symbols, valuation_rejections = calculator.value_batch(symbols, run.data, run.global_data)
+    reject_symbols('valuation', symbols, valuation_rejections, rejections)
+    job.advance('valuation')
+
+    job.start_stage('signal_details', len(accepted_symbols))
+    # Replaying the same closes leaves the indicator store unchanged, so this needs no checkpoint
+    await calculator.add_indicators(accepted_symbols, run.data)
+    tracked_symbols = set(accepted_symbols)
+    await asyncio.gather(*[add_news_feed(run, job, symbol, tracked_symbols) for symbol in accepted_symbols])
+    calculator.add_news(accepted_symbols)
+
+    sensitivity_mode = job.params.get('sensitivity')
+    if sensitivity_mode:
+        calculator.add_sensitivity_bands(run.data, run.global_data, sensitivity_mode)
+
+    signals = calculator.get_sorted_dict('MARKET_CAP')
+    news_articles = calculator.news.get_referenced_articles(signals)
+    run_id = write_output(run, job, started_at, signals, news_articles)
+
+    job.start_stage('pages', 1)
+    build_pages(signals, run.data, news_articles)
+    if job.params.get('scheduler') == 'true' and close_run and signals:
+        logger.info('The signal keys are: %s', list(signals))
+        with span('git_push'):
+            add_all_in_static_and_commit()
+        with span('slack_notification'):
+            notify_slack_channel(signals.keys())
+    job.advance('pages')
+    result = {'run_id': run_id, 'signal_count': len(signals), 'rejections': rejections}
+    if plan is not None:
+        result['refresh'] = plan.summary()
+    return result
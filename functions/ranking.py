@@ -0,0 +1,61 @@
+from bisect import bisect_left, insort
+from numbers import Number
+
+RANKING_KEYS = ['MARKET_CAP', 'PERCENTAGE_DIFF', 'SENTIMENT_AVG', 'WACC']
+
+
+class RankingIndex:
+    '''
+    Keeps one sorted list of (value, symbol) per ranking key. Inserting or removing a symbol touches each
+    list with a binary search instead of re-sorting all signals, and top-k is a slice.
+    '''
+
+    def __init__(self, keys=RANKING_KEYS):
+        self.keys = list(keys)
+        self.sorted_entries = {key: [] for key in self.keys}
+        self.values = {}
+
+    @classmethod
+    def from_signals(cls, signals, keys=RANKING_KEYS):
+        index = cls(keys)
+        for symbol, signal in signals.items():
+            index.insert(symbol, signal)
+        return index
+
+    def __contains__(self, symbol):
+        return symbol in self.values
+
+    def __len__(self):
+        return len(self.values)
+
+    def insert(self, symbol, signal):
+        if symbol in self.values:
+            self.remove(symbol)
+        entry_values = {}
+        for key in self.keys:
+            value = signal.get(key)
+            # Values like the empty SENTIMENT_AVG of a failed news call are left out of that key's ranking
+            if isinstance(value, Number) and not isinstance(value, bool):
+                insort(self.sorted_entries[key], (value, symbol))
+                entry_values[key] = value
+        self.values[symbol] = entry_values
+
+    def remove(self, symbol):
+        entry_values = self.values.pop(symbol, None)
+        if entry_values is None:
+            return
+        for key, value in entry_values.items():
+            entries = self.sorted_entries[key]
+            del entries[bisect_left(entries, (value, symbol))]
+
+    def ranked_symbols(self, key, descending=False):
+        entries = self.sorted_entries[key]
+        ordered = reversed(entries) if descending else iter(entries)
+        return [symbol for _, symbol in ordered]
+
+    def top_k(self, key, k, descending=True):
+        if k <= 0:
+            return []
+        entries = self.sorted_entries[key]
+        selected = entries[-k:][::-1] if descending else entries[:k]
+        return [symbol for _, symbol in selected]
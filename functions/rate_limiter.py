@@ -0,0 +1,134 @@
+import asyncio
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+from functions.metrics import rate_limiter_wait_seconds
+from sql.helpers import database_path
+
+# 30 calls per minute
+CALLS = int(os.getenv('ALPHA_VANTAGE_CALLS_PER_MINUTE', 30))
+RATE_LIMIT_SECONDS = 60
+
+# Alpha Vantage daily quota, resets at midnight UTC
+DAILY_CALLS = int(os.getenv('ALPHA_VANTAGE_DAILY_LIMIT', 500))
+
+BUCKET_NAME = 'alpha_vantage'
+
+CREATE_TABLE = '''
+CREATE TABLE IF NOT EXISTS rate_limit (
+    name TEXT PRIMARY KEY,
+    tokens FLOAT NOT NULL,
+    updated_at FLOAT NOT NULL,
+    day TEXT NOT NULL,
+    day_count INTEGER NOT NULL
+)'''
+
+
+class DailyQuotaExceeded(Exception):
+    pass
+
+
+def current_day():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+
+class RateLimiter:
+    '''
+    Token bucket for the per-minute limit plus a counter for the daily quota. The state lives in SQLite
+    so the web workers and the scheduler all spend from the same budget.
+    '''
+
+    def __init__(self, name=BUCKET_NAME, calls=CALLS, period=RATE_LIMIT_SECONDS, daily_calls=DAILY_CALLS,
+                 path=database_path):
+        self.name = name
+        self.capacity = calls
+        self.refill_rate = calls / period
+        self.daily_calls = daily_calls
+        self.path = path
+        self._table_created = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if not self._table_created:
+            conn.execute(CREATE_TABLE)
+            self._table_created = True
+        return conn
+
+    def _load_state(self, conn, now):
+        row = conn.execute('SELECT tokens, updated_at, day, day_count FROM rate_limit WHERE name = ?',
+                           (self.name,)).fetchone()
+        if row is None:
+            return self.capacity, current_day(), 0
+        tokens, updated_at, day, day_count = row
+        tokens = min(self.capacity, tokens + (now - updated_at) * self.refill_rate)
+        if day != current_day():
+            day, day_count = current_day(), 0
+        return tokens, day, day_count
+
+    def _save_state(self, conn, now, tokens, day, day_count):
+        conn.execute('INSERT OR REPLACE INTO rate_limit (name, tokens, updated_at, day, day_count) '
+                     'VALUES (?, ?, ?, ?, ?)', (self.name, tokens, now, day, day_count))
+
+    def try_acquire(self):
+        ''' Takes a token if one is available, otherwise returns the number of seconds to wait for the next one '''
+        conn = self._connect()
+        try:
+            # IMMEDIATE takes the write lock up front so two processes can't spend the same token
+            conn.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            tokens, day, day_count = self._load_state(conn, now)
+            if day_count >= self.daily_calls:
+                conn.execute('ROLLBACK')
+                raise DailyQuotaExceeded(f'Daily quota of {self.daily_calls} calls has been used up')
+            if tokens >= 1:
+                self._save_state(conn, now, tokens - 1, day, day_count + 1)
+                conn.execute('COMMIT')
+                return 0
+            conn.execute('ROLLBACK')
+            return (1 - tokens) / self.refill_rate
+        finally:
+            conn.close()
+
+    async def acquire(self):
+        '''
+        Waits for a token. The transaction runs in a worker thread, waiting for another process's write lock would
+        otherwise block the event loop for up to the connect timeout.
+        '''
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        while True:
+            wait = await loop.run_in_executor(None, self.try_acquire)
+            if wait == 0:
+                rate_limiter_wait_seconds.observe(time.perf_counter() - started)
+                return
+            await asyncio.sleep(wait)
+
+    def drain(self):
+        ''' Empties the per-minute bucket, used when the API tells us we are being throttled anyway '''
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            _, day, day_count = self._load_state(conn, now)
+            self._save_state(conn, now, 0, day, day_count)
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def remaining(self):
+        conn = self._connect()
+        try:
+            tokens, _, day_count = self._load_state(conn, time.time())
+        finally:
+            conn.close()
+        remaining_day = max(0, self.daily_calls - day_count)
+        return {
+            'minute': min(int(tokens), remaining_day),
+            'day': remaining_day,
+            'seconds_until_next_call': 0 if tokens >= 1 else round((1 - tokens) / self.refill_rate, 2),
+        }
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,184 @@
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from functions.batch_valuation import REJECT_SAFETY_MARGIN
+from functions.financial_data_aggregator import BULK_QUOTE_BATCH_SIZE, FinancialDataTypeSwitch
+from functions.freshness import previous_close
+from functions.metrics import refresh_items
+from functions.rate_limiter import rate_limiter
+from functions.response_cache import response_cache
+from sql.history import history_store
+
+logger = logging.getLogger(__name__)
+
+# Prices come from bulk quotes or a quote per symbol, the planner tracks them per symbol either way
+PRICE = 'PRICE'
+PRICE_FUNCTION_TYPES = ['REALTIME_BULK_QUOTES', 'GLOBAL_QUOTE']
+
+# How far a refresh of each data type can move a signal. The treasury yield goes into every WACC, a new annual
+# report changes growth and margins, a close moves the margin of safety, the overview only beta and shares and the
+# news only the sentiment shown.
+TYPE_WEIGHTS = {
+    'TREASURY_YIELD': 10,
+    'INCOME_STATEMENT': 4,
+    'CASH_FLOW': 4,
+    'BALANCE_SHEET': 3,
+    PRICE: 3,
+    'OVERVIEW': 1,
+    'NEWS_SENTIMENT': 1,
+}
+
+# How likely a change reaches the published signals, by the symbol's outcome in the latest run
+SIGNAL_WEIGHT = 3
+BELOW_SAFETY_MARGIN_WEIGHT = 2
+REJECTED_WEIGHT = 1
+
+
+@dataclass(frozen=True)
+class RefreshItem:
+    function_type: str
+    symbol: str
+    due_at: float
+    priority: float
+    cost: float
+
+
+@dataclass
+class RefreshPlan:
+    '''
+    The stale items a run refreshes and the ones it defers to a later tick because the quota does not cover them.
+    Symbols without cached data are fetched in any case. A deferred item is served from the cache however old.
+    '''
+    planned: list = field(default_factory=list)
+    deferred: list = field(default_factory=list)
+    new_symbols: list = field(default_factory=list)
+    calls: float = 0
+
+    def __post_init__(self):
+        self.planned_keys = {tuple(key) for key in self.planned}
+        self.deferred_keys = {tuple(key) for key in self.deferred}
+
+    def is_empty(self):
+        return not self.planned and not self.new_symbols
+
+    def defers(self, function_type, symbol):
+        if function_type == 'REALTIME_BULK_QUOTES':
+            # A bulk quote is only made when a symbol it prices is planned
+            return not any((PRICE, batch_symbol) in self.planned_keys for batch_symbol in (symbol or '').split(','))
+        if function_type == 'GLOBAL_QUOTE':
+            return (function_type, symbol) in self.deferred_keys or (PRICE, symbol) in self.deferred_keys
+        return (function_type, symbol) in self.deferred_keys
+
+    def as_dict(self):
+        return {'planned': self.planned, 'deferred': self.deferred, 'new_symbols': self.new_symbols,
+                'calls': self.calls}
+
+    def summary(self):
+        return {'planned': len(self.planned), 'deferred': len(self.deferred), 'new_symbols': len(self.new_symbols),
+                'calls': round(self.calls, 2)}
+
+
+def get_symbol_weight(symbol, outcomes):
+    if symbol not in outcomes:
+        return REJECTED_WEIGHT
+    if outcomes[symbol] is None:
+        return SIGNAL_WEIGHT
+    if outcomes[symbol] == REJECT_SAFETY_MARGIN:
+        return BELOW_SAFETY_MARGIN_WEIGHT
+    return REJECTED_WEIGHT
+
+
+def get_latest_outcomes():
+    run_id = history_store.get_latest_run_id()
+    return history_store.get_run_outcomes(run_id) if run_id is not None else {}
+
+
+def get_current_symbols(now=None):
+    '''
+    The symbols of the latest run when it started after the last close, None when the market movers have to be
+    scraped again. Ticks between two closes reuse the same symbols, so only a close brings in new ones.
+    '''
+    run_id = history_store.get_latest_run_id()
+    if run_id is None:
+        return None
+    run = history_store.get_run(run_id)
+    started_at = datetime.fromisoformat(run['started_at']).timestamp()
+    if started_at < previous_close(now if now is not None else time.time()):
+        return None
+    return list(history_store.get_run_outcomes(run_id))
+
+
+def get_new_symbol_calls(function_types, bulk_price_cost):
+    ''' Calls a symbol without cached data costs if it passes every stage, its price may share a bulk quote '''
+    return sum(bulk_price_cost if function_type == PRICE else 1 for function_type in function_types)
+
+
+def get_due_times():
+    '''
+    The due time of the latest cached response of every tracked (data type, symbol). Symbols the bulk quotes leave
+    out are also kept under GLOBAL_QUOTE, their price is planned as a call of its own.
+    '''
+    due_times = {}
+    for function_type, symbol, due_at in response_cache.get_due_times(list(TYPE_WEIGHTS) + PRICE_FUNCTION_TYPES):
+        if function_type == 'REALTIME_BULK_QUOTES':
+            keys = [(PRICE, price_symbol) for price_symbol in (symbol or '').split(',')]
+        elif function_type == 'GLOBAL_QUOTE':
+            keys = [(PRICE, symbol), (function_type, symbol)]
+        else:
+            keys = [(function_type, symbol)]
+        for key in keys:
+            due_times[key] = max(due_at, due_times.get(key, due_at))
+    return due_times
+
+
+def plan_refresh(symbols, symbol_function_types, now=None, budget=None):
+    '''
+    Finds the cached data of the symbols that is due, and plans the items most likely to change a signal within
+    budget, by default the calls left of today's quota after those the new symbols need. symbol_function_types are
+    the data types the run fetches per symbol, every one of them is reserved for a new symbol.
+    '''
+    now = now if now is not None else time.time()
+    due_times = get_due_times()
+    outcomes = get_latest_outcomes()
+    new_symbols = [symbol for symbol in symbols if ('INCOME_STATEMENT', symbol) not in due_times]
+    bulk_price_cost = 1 / BULK_QUOTE_BATCH_SIZE if FinancialDataTypeSwitch.bulk_quotes_available else 1
+    if budget is None:
+        budget = (rate_limiter.remaining()['day'] -
+                  get_new_symbol_calls(symbol_function_types, bulk_price_cost) * len(new_symbols))
+
+    items = []
+    treasury_due_at = due_times.get(('TREASURY_YIELD', None))
+    if treasury_due_at is not None and treasury_due_at <= now:
+        items.append(RefreshItem('TREASURY_YIELD', None, treasury_due_at,
+                                 TYPE_WEIGHTS['TREASURY_YIELD'] * SIGNAL_WEIGHT, 1))
+    for symbol in symbols:
+        symbol_weight = get_symbol_weight(symbol, outcomes)
+        for function_type, type_weight in TYPE_WEIGHTS.items():
+            due_at = due_times.get((function_type, symbol))
+            if due_at is None or due_at > now:
+                continue
+            cost = 1
+            if function_type == PRICE:
+                if ('GLOBAL_QUOTE', symbol) in due_times:
+                    function_type = 'GLOBAL_QUOTE'
+                else:
+                    cost = bulk_price_cost
+            items.append(RefreshItem(function_type, symbol, due_at, type_weight * symbol_weight, cost))
+
+    # Longest overdue first among items of the same priority
+    items.sort(key=lambda item: (-item.priority, item.due_at))
+    planned, deferred, calls = [], [], 0
+    for item in items:
+        key = [item.function_type, item.symbol]
+        if calls + item.cost <= budget:
+            planned.append(key)
+            calls += item.cost
+            refresh_items.inc(item.function_type, 'planned')
+        else:
+            deferred.append(key)
+            refresh_items.inc(item.function_type, 'deferred')
+    plan = RefreshPlan(planned, deferred, new_symbols, calls)
+    logger.info('refresh plan: %s', plan.summary())
+    return plan
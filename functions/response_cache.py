@@ -0,0 +1,162 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+from functions.freshness import due_at
+from sql.helpers import database_path
+
+cache_path = os.getenv('RESPONSE_CACHE_PATH', os.path.join(os.path.dirname(database_path), 'cache.db'))
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+# Daily data is refreshed a bit before 24 hours so the scheduled run each afternoon never sees yesterday's entry
+DAILY = 20 * HOUR
+
+# Seconds an Alpha Vantage response stays fresh, functions not listed here are never cached. Daily data and
+# statements with a fiscal date are instead fresh until freshness.due_at expects them to change.
+FUNCTION_TTLS = {
+    'CASH_FLOW': 14 * DAY,
+    'INCOME_STATEMENT': 14 * DAY,
+    'BALANCE_SHEET': 14 * DAY,
+    'OVERVIEW': 7 * DAY,
+    'TIME_SERIES_DAILY_ADJUSTED': DAILY,
+    'TIME_SERIES_DAILY': DAILY,
+    'REALTIME_BULK_QUOTES': DAILY,
+    'GLOBAL_QUOTE': DAILY,
+    'TREASURY_YIELD': DAILY,
+    'NEWS_SENTIMENT': DAILY,
+}
+
+# How long past its TTL an entry may still be served while a fresh copy is fetched in the background
+STALE_WHILE_REVALIDATE_SECONDS = int(os.getenv('STALE_WHILE_REVALIDATE_SECONDS', 0))
+
+MAX_CACHE_BYTES = int(os.getenv('MAX_RESPONSE_CACHE_BYTES', 200 * 1024 * 1024))
+
+CREATE_TABLE = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    function_type TEXT NOT NULL,
+    symbol TEXT,
+    payload TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    fetched_at FLOAT NOT NULL,
+    last_used_at FLOAT NOT NULL,
+    due_at FLOAT
+)'''
+
+# Columns added after the table was first created, (column, type)
+COLUMN_MIGRATIONS = [('due_at', 'FLOAT')]
+
+
+def make_key(function_type, symbol, params):
+    return json.dumps([function_type, symbol, sorted(params.items())])
+
+
+@dataclass
+class CachedResponse:
+    data: dict
+    fetched_at: float
+    fresh: bool
+    revalidate: bool
+
+
+class ResponseCache:
+    def __init__(self, path=cache_path, ttls=FUNCTION_TTLS, stale_while_revalidate=STALE_WHILE_REVALIDATE_SECONDS,
+                 max_bytes=MAX_CACHE_BYTES):
+        self.path = path
+        self.ttls = ttls
+        self.stale_while_revalidate = stale_while_revalidate
+        self.max_bytes = max_bytes
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        # One connection shared by every thread and always used under the lock, a run reads the cache once per
+        # symbol and data type and opening and closing a connection for each costs more than the read itself
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(CREATE_TABLE)
+            existing_columns = {row[1] for row in conn.execute('PRAGMA table_info(responses)')}
+            for column, column_type in COLUMN_MIGRATIONS:
+                if column not in existing_columns:
+                    conn.execute(f'ALTER TABLE responses ADD COLUMN {column} {column_type}')
+            conn.execute('CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used_at)')
+            self._conn = conn
+        return self._conn
+
+    def get_due_at(self, function_type, fetched_at, stored_due_at):
+        ''' Entries cached before due times were stored last their TTL '''
+        return stored_due_at if stored_due_at is not None else fetched_at + self.ttls[function_type]
+
+    def is_cacheable(self, function_type):
+        return self.ttls.get(function_type, 0) > 0
+
+    def get(self, function_type, symbol, params, ignore_ttl=False):
+        '''
+        Returns the cached response or None. Entries past their due time are only returned inside the
+        stale-while-revalidate window (with revalidate set), or always when ignore_ttl is set.
+        '''
+        if not self.is_cacheable(function_type):
+            return None
+        key = make_key(function_type, symbol, params)
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute('SELECT payload, fetched_at, due_at FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            payload, fetched_at, stored_due_at = row
+            now = time.time()
+            due = self.get_due_at(function_type, fetched_at, stored_due_at)
+            fresh = now < due
+            revalidate = not fresh and now < due + self.stale_while_revalidate
+            if not (fresh or revalidate or ignore_ttl):
+                return None
+            with conn:
+                conn.execute('UPDATE responses SET last_used_at = ? WHERE key = ?', (now, key))
+        return CachedResponse(json.loads(payload), fetched_at, fresh, revalidate)
+
+    def put(self, function_type, symbol, params, data):
+        if not self.is_cacheable(function_type):
+            return
+        payload = json.dumps(data)
+        now = time.time()
+        # News is asked for by tickers, the entry is still about that symbol
+        subject = symbol if symbol is not None else params.get('tickers')
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO responses '
+                             '(key, function_type, symbol, payload, size, fetched_at, last_used_at, due_at) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             (make_key(function_type, symbol, params), function_type, subject, payload, len(payload),
+                              now, now, due_at(function_type, data, now, self.ttls[function_type])))
+                self._evict(conn)
+
+    def get_due_times(self, function_types):
+        ''' (function type, symbol, due time) of every cached response of the function types '''
+        with self._lock:
+            rows = self._connection().execute(f'SELECT function_type, symbol, fetched_at, due_at FROM responses '
+                                              f'WHERE function_type IN ({", ".join("?" * len(function_types))})',
+                                              list(function_types)).fetchall()
+        return [(function_type, symbol, self.get_due_at(function_type, fetched_at, stored_due_at))
+                for function_type, symbol, fetched_at, stored_due_at in rows]
+
+    def _evict(self, conn):
+        ''' Drops the least recently used entries until the cache fits in max_bytes '''
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        keys_to_delete = []
+        for key, size in conn.execute('SELECT key, size FROM responses ORDER BY last_used_at'):
+            if total <= self.max_bytes:
+                break
+            keys_to_delete.append((key,))
+            total -= size
+        conn.executemany('DELETE FROM responses WHERE key = ?', keys_to_delete)
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,69 @@
+from functions.news import is_reference_list
+from functions.pipeline import SIGNAL_DETAIL_KEYS, SCREENING_STAGES, REJECT_FETCH_FAILED, write_signal_files
+from functions.signal_calculator import CalculateSignal
+from sql.history import history_store
+
+# Reason given to symbols that pass with the new settings, but were rejected before the run priced them
+REJECT_NOT_PRICED = 'NOT_PRICED'
+
+
+async def revalue_run(run_id=None, settings=None, sensitivity_mode=''):
+    '''
+    Values the fundamentals and prices of a stored run again, by default the latest one with the current settings.
+    Indicators and news come from the run's signals, the indicator store or the response cache, so this never
+    calls the API.
+    Returns the calculator holding the new signals, the run's financial data aggregate and the rejections.
+    '''
+    if run_id is None:
+        run_id = history_store.get_latest_run_id()
+    run = history_store.get_run(run_id) if run_id is not None else None
+    if run is None:
+        raise ValueError('No stored run to revalue, run /check_stocks first')
+    financial_data_aggregate = history_store.get_run_financial_data(run_id)
+    stored_signals = history_store.get_run_signals(run_id)
+    global_data = {'TREASURY_YIELD': run['treasury_yield']}
+
+    calculator = CalculateSignal(settings, offline=True)
+    calculator.news.articles.update(history_store.get_run_news_articles(run_id))
+    rejections = {symbol: reason for symbol, reason in history_store.get_run_rejections(run_id).items()
+                  if reason == REJECT_FETCH_FAILED}
+    priced_symbols = []
+    unpriced_symbols = []
+    for symbol, financials in financial_data_aggregate.items():
+        if financials.latest_price is not None:
+            priced_symbols.append(symbol)
+        elif symbol not in rejections:
+            unpriced_symbols.append(symbol)
+    # The run stopped fetching symbols at the stage that rejected them, they are screened again stage by stage
+    screening_rejections = calculator.screen(unpriced_symbols, financial_data_aggregate, global_data,
+                                             [statements for _, statements in SCREENING_STAGES])
+    rejections.update({symbol: screening_rejections.get(symbol, REJECT_NOT_PRICED) for symbol in unpriced_symbols})
+    accepted_symbols, valuation_rejections = calculator.value_batch(priced_symbols, financial_data_aggregate,
+                                                                    global_data)
+    rejections.update(valuation_rejections)
+    missing_symbols = []
+    for symbol in accepted_symbols:
+        stored_signal = stored_signals.get(symbol, {})
+        if all(key in stored_signal for key in SIGNAL_DETAIL_KEYS) and is_reference_list(stored_signal['NEWS']):
+            calculator.restore_signal_details(symbol, {key: stored_signal[key] for key in SIGNAL_DETAIL_KEYS})
+        else:
+            missing_symbols.append(symbol)
+    # Symbols that only pass with the new settings were never shown, their details may still be stored or cached
+    await calculator.add_indicators(missing_symbols, financial_data_aggregate)
+    await calculator.add_signal_details(missing_symbols)
+    if sensitivity_mode:
+        calculator.add_sensitivity_bands(financial_data_aggregate, global_data, sensitivity_mode)
+    return calculator, financial_data_aggregate, rejections
+
+
+async def revalue_and_publish(build_pages, run_id=None, sensitivity_mode=''):
+    ''' Revalues a stored run and rewrites signals.json, the aggregate and the static pages '''
+    if run_id is None:
+        run_id = history_store.get_latest_run_id()
+    calculator, financial_data_aggregate, rejections = await revalue_run(run_id, sensitivity_mode=sensitivity_mode)
+    signals = calculator.get_sorted_dict('MARKET_CAP')
+    news_articles = calculator.news.get_referenced_articles(signals)
+    write_signal_files(signals, financial_data_aggregate, news_articles)
+    build_pages(signals, financial_data_aggregate, news_articles)
+    return {'run_id': run_id, 'settings_version': calculator.settings.version,
+            'signal_count': len(signals), 'rejections': rejections}
@@ -0,0 +1,29 @@
+from functools import partial
+
+from functions.financial_data_aggregator import FinancialDataTypeSwitch
+from functions.http_client import http_client
+from functions.signal_calculator import CalculateSignal
+
+
+class RunContext:
+    '''
+    Everything one pipeline run builds up: the fetched financial data, the signals and the rejected symbols. Every
+    job gets its own and drops it once the run is published, the history store keeps the record of the run.
+    '''
+
+    def __init__(self, settings, plan=None):
+        # A planned run leaves the stale data its refresh plan defers as it is
+        alpha_vantage = partial(http_client.planned_alpha_vantage, plan) if plan is not None else None
+        self.aggregator = FinancialDataTypeSwitch(alpha_vantage)
+        self.calculator = CalculateSignal(settings, alpha_vantage=alpha_vantage)
+        self.plan = plan
+        # symbol -> reason of every symbol that dropped out of the run
+        self.rejections = {}
+
+    @property
+    def data(self):
+        return self.aggregator.financial_data_aggregate
+
+    @property
+    def global_data(self):
+        return self.aggregator.global_data
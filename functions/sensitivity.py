@@ -0,0 +1,97 @@
+import itertools
+import os
+import warnings
+from dataclasses import dataclass
+
+import numpy as np
+
+from functions.batch_valuation import dcf_arrays
+
+SCENARIO_COUNT = int(os.getenv('SENSITIVITY_SCENARIOS', 10000))
+
+# Seeds the Monte Carlo sample, so the bands of unchanged symbols repeat and can be memoized. Unset, every run
+# draws a new sample.
+SENSITIVITY_SEED = int(os.environ['SENSITIVITY_SEED']) if os.getenv('SENSITIVITY_SEED') else None
+
+# Scenarios valued per numpy pass, bounds memory to a few hundred MB for a few hundred symbols
+SCENARIO_CHUNK_SIZE = 2000
+
+PERCENTILES = [10, 50, 90]
+
+# Spread of the random sample around the configured point estimates
+MARKET_RETURN_STD = 0.02
+PERPETUAL_GROWTH_STD = 0.005
+BETA_SHOCK_STD = 0.15
+MAX_GROWTH_HAIRCUT = 0.5
+
+# Values tried for each parameter in grid mode, rates are offsets from the configured point estimates
+GRID_MARKET_RETURN_OFFSETS = [-0.02, -0.01, 0, 0.01, 0.02]
+GRID_PERPETUAL_GROWTH_OFFSETS = [-0.01, -0.005, 0, 0.005]
+GRID_BETA_SHOCKS = [-0.2, 0, 0.2]
+GRID_GROWTH_HAIRCUTS = [0, 0.25, 0.5]
+
+
+@dataclass
+class Scenarios:
+    market_return: np.ndarray
+    perpetual_growth: np.ndarray
+    beta_shock: np.ndarray
+    growth_haircut: np.ndarray
+
+    def __len__(self):
+        return len(self.market_return)
+
+    def chunk(self, start, stop):
+        return Scenarios(self.market_return[start:stop], self.perpetual_growth[start:stop],
+                         self.beta_shock[start:stop], self.growth_haircut[start:stop])
+
+
+def grid_scenarios(market_return_rate, perpetual_growth_estimate):
+    combinations = np.array(list(itertools.product(GRID_MARKET_RETURN_OFFSETS, GRID_PERPETUAL_GROWTH_OFFSETS,
+                                                   GRID_BETA_SHOCKS, GRID_GROWTH_HAIRCUTS)))
+    return Scenarios(market_return=market_return_rate + combinations[:, 0],
+                     perpetual_growth=perpetual_growth_estimate + combinations[:, 1],
+                     beta_shock=combinations[:, 2], growth_haircut=combinations[:, 3])
+
+
+def random_scenarios(market_return_rate, perpetual_growth_estimate, count=SCENARIO_COUNT, seed=None):
+    rng = np.random.default_rng(seed)
+    return Scenarios(market_return=rng.normal(market_return_rate, MARKET_RETURN_STD, count),
+                     perpetual_growth=rng.normal(perpetual_growth_estimate, PERPETUAL_GROWTH_STD, count),
+                     beta_shock=rng.normal(0, BETA_SHOCK_STD, count),
+                     growth_haircut=rng.uniform(0, MAX_GROWTH_HAIRCUT, count))
+
+
+def scenario_prices_per_share(packed, treasury_yield, scenarios, chunk_size=SCENARIO_CHUNK_SIZE):
+    '''
+    DCF price per share for every (scenario, symbol) pair, NaN where the scenario makes the valuation invalid.
+    Falling short of the safety margin still counts as a valuation, it only decides whether a signal is shown.
+    '''
+    prices = np.full((len(scenarios), len(packed.symbols)), np.nan)
+    for start in range(0, len(scenarios), chunk_size):
+        chunk = scenarios.chunk(start, start + chunk_size)
+        arrays = dcf_arrays(packed, treasury_yield, chunk.market_return[:, np.newaxis],
+                            chunk.perpetual_growth[:, np.newaxis], -np.inf,
+                            beta_shock=chunk.beta_shock[:, np.newaxis],
+                            growth_haircut=chunk.growth_haircut[:, np.newaxis], exact=False)
+        valid = arrays['reason_codes'] == 0
+        with np.errstate(invalid='ignore', over='ignore'):
+            chunk_prices = packed.latest_price * (1 + arrays['percentage_diff'])
+        prices[start:start + len(chunk)] = np.where(valid, chunk_prices, np.nan)
+    return prices
+
+
+def percentile_bands(packed, treasury_yield, scenarios):
+    ''' P10/P50/P90 DCF price per share for each packed symbol, None where no scenario gave a valid valuation '''
+    prices = scenario_prices_per_share(packed, treasury_yield, scenarios)
+    valid_share = np.mean(~np.isnan(prices), axis=0)
+    with warnings.catch_warnings():
+        # Symbols without a single valid scenario are reported as None below
+        warnings.simplefilter('ignore', RuntimeWarning)
+        percentiles = np.nanpercentile(prices, PERCENTILES, axis=0)
+    bands = {}
+    for idx, symbol in enumerate(packed.symbols):
+        bands[symbol] = {f'DCF_PRICE_PER_SHARE_P{percentile}': None if np.isnan(value) else round(float(value), 2)
+                         for percentile, value in zip(PERCENTILES, percentiles[:, idx])}
+        bands[symbol]['VALID_SCENARIO_SHARE'] = round(float(valid_share[idx]), 4)
+    return bands
@@ -1,18 +1,117 @@
+import math
+import os
 import sqlite3
+import threading
+import time
+from dataclasses import dataclass, asdict
+from datetime import datetime
 
-from sql.helpers import database_path
+from sql.helpers import database_path, FinancialVars
+
+SETTINGS_COLUMNS = [variable.value for variable in FinancialVars]
+
+# How often a read checks whether another worker process has written newer settings
+SETTINGS_CHECK_SECONDS = float(os.getenv('SETTINGS_CHECK_SECONDS', 5))
+
+CREATE_VERSIONS_TABLE = '''
+CREATE TABLE IF NOT EXISTS finvars_versions (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    perpetual_growth_rate FLOAT NOT NULL,
+    market_return FLOAT NOT NULL,
+    safety_margin FLOAT NOT NULL,
+    changed_at TEXT NOT NULL
+);
+'''
+
+
+@dataclass(frozen=True)
+class Settings:
+    perpetual_growth_rate: float
+    market_return: float
+    safety_margin: float
+    version: int
+
+    def as_dict(self):
+        return asdict(self)
+
+
+class SettingsService:
+    '''
+    Valuation settings from the finvars table. Reads are served from an in-memory snapshot, every write goes through
+    update() which bumps the version in finvars_versions and swaps the snapshot in the same step. A write by another
+    worker process is picked up by the first read after the next version check, at most check_seconds later.
+    '''
+
+    def __init__(self, path=database_path, check_seconds=SETTINGS_CHECK_SECONDS):
+        self.path = path
+        self.check_seconds = check_seconds
+        self._conn = None
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked_at = None
+
+    def _connection(self):
+        # One connection shared by the request threads and the job thread, always used under the lock
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.executescript(CREATE_VERSIONS_TABLE)
+        return self._conn
+
+    def _latest_version(self):
+        return self._connection().execute('SELECT MAX(version) AS version FROM finvars_versions').fetchone()['version']
+
+    def _load(self):
+        conn = self._connection()
+        # The version is read first, values written after it only make the next read load them again
+        version = self._latest_version()
+        values = conn.execute(f'SELECT {", ".join(SETTINGS_COLUMNS)} FROM finvars LIMIT 1').fetchone()
+        if version is None:
+            # First start on this database, the values in finvars become version 1
+            with conn:
+                version = self._insert_version(conn, dict(values))
+        return Settings(**{column: values[column] for column in SETTINGS_COLUMNS}, version=version)
+
+    def _insert_version(self, conn, values):
+        cursor = conn.execute(f'INSERT INTO finvars_versions ({", ".join(SETTINGS_COLUMNS)}, changed_at) '
+                              f'VALUES ({", ".join("?" * (len(SETTINGS_COLUMNS) + 1))})',
+                              (*[values[column] for column in SETTINGS_COLUMNS], datetime.now().isoformat()))
+        return cursor.lastrowid
+
+    def get(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._snapshot is None or now - self._checked_at >= self.check_seconds:
+                if self._snapshot is None or self._snapshot.version != self._latest_version():
+                    self._snapshot = self._load()
+                self._checked_at = now
+            return self._snapshot
+
+    def update(self, variable_type, new_value):
+        ''' Validates and stores one setting, returns the new snapshot '''
+        if variable_type not in SETTINGS_COLUMNS:
+            raise ValueError(f'Unknown setting {variable_type}, expected one of {SETTINGS_COLUMNS}')
+        try:
+            new_value = float(new_value)
+        except (TypeError, ValueError):
+            raise ValueError(f'{variable_type} must be a number, got {new_value!r}')
+        if not math.isfinite(new_value):
+            raise ValueError(f'{variable_type} must be a finite number, got {new_value!r}')
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(f'UPDATE finvars SET {variable_type} = ?', (new_value,))
+                values = dict(conn.execute(f'SELECT {", ".join(SETTINGS_COLUMNS)} FROM finvars LIMIT 1').fetchone())
+                version = self._insert_version(conn, values)
+            self._snapshot = Settings(**values, version=version)
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+
+settings_service = SettingsService()
 
 
 def get_variables_from_db():
-    # Connect to the SQLite database
-    conn = sqlite3.connect(database_path)
-    cursor = conn.cursor()
-
-    cursor.execute("PRAGMA table_info(finvars)")
-    # All variables from the database
-    columns = [row[1] for row in cursor.fetchall()]
-    # Fetch the first row of data from the table
-    cursor.execute(f"SELECT * FROM finvars LIMIT 1")
-    values = cursor.fetchone()
-
-    return columns, values
+    settings = settings_service.get()
+    values = [getattr(settings, column) for column in SETTINGS_COLUMNS]
+    return SETTINGS_COLUMNS, values
@@ -0,0 +1,192 @@
+import base64
+import json
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from numbers import Number
+from operator import itemgetter
+from typing import Optional
+
+import numpy as np
+
+from functions.ranking import RANKING_KEYS
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+# Pages with more records are streamed in chunks of this many instead of encoded as one body
+STREAM_CHUNK_RECORDS = 100
+
+# Listed when no fields are asked for, the chart series and news references are only sent on request
+SUMMARY_EXCLUDED_FIELDS = ['MACD', 'NEWS']
+
+# Query argument -> (signal key, bound), a bound is inclusive
+SIGNAL_FILTERS = {
+    'min_percentage_diff': ('PERCENTAGE_DIFF', 'min'),
+    'min_sentiment': ('SENTIMENT_AVG', 'min'),
+    'max_sentiment': ('SENTIMENT_AVG', 'max'),
+    'min_market_cap': ('MARKET_CAP', 'min'),
+    'max_market_cap': ('MARKET_CAP', 'max'),
+}
+
+
+def to_builtin(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def dumps(value):
+    ''' Compact JSON bytes, with orjson when it is installed '''
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY, default=to_builtin)
+    return json.dumps(value, default=to_builtin, separators=(',', ':')).encode('utf-8')
+
+
+def is_number(value):
+    return isinstance(value, Number) and not isinstance(value, bool)
+
+
+def encode_cursor(value, symbol):
+    return base64.urlsafe_b64encode(dumps([value, symbol])).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        value, symbol = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        raise ValueError(f'Invalid cursor {cursor}')
+    if not is_number(value) or not isinstance(symbol, str):
+        raise ValueError(f'Invalid cursor {cursor}')
+    return value, symbol
+
+
+def parse_float_arg(args, name):
+    value = args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f'{name} must be a number, got {value}')
+
+
+def parse_fields(args):
+    fields = args.get('fields')
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(',') if field.strip()]
+
+
+def project(record, fields, excluded=()):
+    ''' The requested fields of a signal or an aggregate entry, every field but the excluded ones by default '''
+    if fields is None:
+        return {key: record[key] for key in record.keys() if key not in excluded}
+    return {field: record[field] for field in fields if field in record}
+
+
+@dataclass(frozen=True)
+class SignalQuery:
+    '''
+    A page of signals ordered by one ranking key. Signals without a numeric value for the sort key are not listed,
+    and a bound on a key also leaves out the signals without a numeric value for it. The cursor holds the
+    (value, symbol) of the last listed signal, so pages stay consistent while a new run is published.
+    '''
+    sort_key: str = 'MARKET_CAP'
+    descending: bool = True
+    limit: int = DEFAULT_PAGE_SIZE
+    after: Optional[tuple] = None
+    bounds: tuple = ()
+    fields: Optional[tuple] = None
+
+    @classmethod
+    def from_args(cls, args):
+        ''' Raises ValueError on an unknown sort key, an invalid number or cursor, or a limit out of range '''
+        sort_key = args.get('sort', 'MARKET_CAP')
+        if sort_key not in RANKING_KEYS:
+            raise ValueError(f'Signals can only be sorted by one of {RANKING_KEYS}')
+        limit = args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+        bounds = {}
+        for name, (key, bound) in SIGNAL_FILTERS.items():
+            value = parse_float_arg(args, name)
+            if value is not None:
+                bounds.setdefault(key, {'min': None, 'max': None})[bound] = value
+        cursor = args.get('cursor')
+        fields = parse_fields(args)
+        return cls(sort_key=sort_key, descending=args.get('order', 'desc') == 'desc', limit=limit,
+                   after=decode_cursor(cursor) if cursor else None,
+                   bounds=tuple((key, bound['min'], bound['max']) for key, bound in bounds.items()),
+                   fields=tuple(fields) if fields is not None else None)
+
+    def matches(self, signal):
+        for key, low, high in self.bounds:
+            value = signal.get(key)
+            if not is_number(value) or (low is not None and value < low) or (high is not None and value > high):
+                return False
+        return True
+
+    def candidate_entries(self, ranking):
+        '''
+        The (value, symbol) entries of the sort key after the cursor, in page order. A bound on the sort key itself
+        narrows the entries by binary search instead of being checked per signal.
+        '''
+        entries = ranking.sorted_entries[self.sort_key]
+        start, end = 0, len(entries)
+        for key, low, high in self.bounds:
+            if key == self.sort_key:
+                if low is not None:
+                    start = max(start, bisect_left(entries, low, key=itemgetter(0)))
+                if high is not None:
+                    end = min(end, bisect_right(entries, high, key=itemgetter(0)))
+        if self.descending:
+            if self.after is not None:
+                end = min(end, bisect_left(entries, self.after))
+            return (entries[idx] for idx in range(end - 1, start - 1, -1))
+        if self.after is not None:
+            start = max(start, bisect_right(entries, self.after))
+        return (entries[idx] for idx in range(start, end))
+
+    def run(self, signals, ranking):
+        ''' The symbols of the page and the cursor of the next one, None on the last page '''
+        symbols = []
+        for value, symbol in self.candidate_entries(ranking):
+            if not self.matches(signals[symbol]):
+                continue
+            if len(symbols) == self.limit:
+                last_symbol = symbols[-1]
+                return symbols, encode_cursor(signals[last_symbol][self.sort_key], last_symbol)
+            symbols.append(symbol)
+        return symbols, None
+
+
+def signal_records(signals, symbols, fields):
+    for symbol in symbols:
+        yield {'symbol': symbol, **project(signals[symbol], fields, SUMMARY_EXCLUDED_FIELDS)}
+
+
+def encode_page(records, next_cursor):
+    return dumps({'signals': list(records), 'next_cursor': next_cursor})
+
+
+def stream_page(records, next_cursor):
+    ''' The same bytes as encode_page, yielded in chunks of STREAM_CHUNK_RECORDS records '''
+    yield b'{"signals":['
+    chunk = []
+    first = True
+    for record in records:
+        chunk.append(dumps(record))
+        if len(chunk) == STREAM_CHUNK_RECORDS:
+            yield (b'' if first else b',') + b','.join(chunk)
+            first = False
+            chunk = []
+    if chunk:
+        yield (b'' if first else b',') + b','.join(chunk)
+    yield b'],"next_cursor":' + dumps(next_cursor) + b'}'
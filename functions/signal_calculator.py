@@ -1,254 +1,208 @@
-import os
+import asyncio
+import logging
 from collections import defaultdict, OrderedDict
-from operator import getitem
 
-import requests
+from functions.batch_valuation import pack_financial_data, batch_dcf, screen_statements, reported_years, \
+    VALUATION_FIELDS
+from functions.http_client import http_client
+from functions.indicators import update_indicators, get_indicator_signals
+from functions.memo_store import memo_store, input_hash, VALUATIONS, SENSITIVITY_BANDS
+from functions.metrics import span
+from functions.news import NewsIndex
+from functions.ranking import RankingIndex
+from functions.sensitivity import grid_scenarios, random_scenarios, percentile_bands, SENSITIVITY_SEED
+from functions.settings import settings_service
+from functions.statements import STATEMENT_LINE_ITEMS
 
-from sql.helpers import database_access
+logger = logging.getLogger(__name__)
 
-# Percentage of market return rate estimate
-MARKET_RETURN_RATE = database_access.get_market_rate()
+# Part of every valuation memo key, bump it when the valuation gives another result for the same inputs
+VALUATION_MEMO_VERSION = 1
 
-# Perpetual growth estimate
-PERPETUAL_GROWTH_ESTIMATE = database_access.get_perpetual_growth()
 
-SAFETY_MARGIN = database_access.get_safety_margin()
-
-
-def safe_division(x, y, default=0):
-    try:
-        result = x / y
-    except ZeroDivisionError:
-        result = default
-    return result
-
-
-# Return percentage differences, if the value would be negative we just take the maximum value
-def calculate_percentage_difference(array):
-    percentage_differences = []
-    for i in range(len(array) - 1):
-        current_element = array[i]
-        next_element = array[i + 1]
-        percentage_difference = (safe_division((next_element - current_element), current_element))
-        percentage_differences.append(percentage_difference)
-    print('percentage_differences:', percentage_differences)
-    average = safe_division(sum(percentage_differences), len(percentage_differences))
-    print('average:', average)
-    return average
-
-
-def calculate_growth(initial_value, growth_rate, periods):
-    return [initial_value * (1 + growth_rate) ** n for n in range(1, periods + 1)]
-
-
-def generate_interest_rates(return_multiplier, total_periods):
-    rates = [return_multiplier]
-    for _ in range(1, total_periods):
-        next_rate = rates[-1] * return_multiplier
-        rates.append(next_rate)
-    rates.append(rates[-1])
-    print('rates', rates)
-    return rates
+def valuation_key(financials, years, treasury_yield, settings, *extra):
+    ''' Hash of everything the valuation of one symbol reads, the year count of its batch included '''
+    return input_hash(VALUATION_MEMO_VERSION, years, float(treasury_yield),
+                      settings.market_return, settings.perpetual_growth_rate, settings.safety_margin, settings.version,
+                      *[getattr(financials, field) for field in VALUATION_FIELDS], *extra,
+                      *[financials.get_statement(statement) for statement in STATEMENT_LINE_ITEMS])
 
 
 class CalculateSignal:
-    def __init__(self):
-        self.sortedSignals = {}
+    def __init__(self, settings=None, offline=False, alpha_vantage=None):
         self.signals = defaultdict(lambda: defaultdict(dict))
-        self.api_key = os.getenv("ALPHA_VANTAGE_API_KEY")
+        self.ranking = RankingIndex()
+        self.news = NewsIndex()
+        # Market return, perpetual growth and safety margin stay fixed for the whole run
+        self.settings = settings or settings_service.get()
+        # Offline calculators only read news from the response cache and indicators from the indicator store
+        self.offline = offline
+        if offline:
+            self.alpha_vantage = http_client.cached_alpha_vantage
+        else:
+            self.alpha_vantage = alpha_vantage or http_client.alpha_vantage
 
     def get_signal(self):
         return self.signals
 
-    def get_sorted_dict(self):
-        return self.sortedSignals['MARKET_CAP']
-
-    def add_sorted_dict_by_category(self, category):
-        self.sortedSignals[category] = OrderedDict(
-            sorted(self.signals.items(), key=lambda x: getitem(x[1], 'MARKET_CAP')))
-
-    async def do_calculations(self, symbol, data, global_data):
-        self.signals[symbol]['LATEST_PRICE'] = round(float(data[symbol]['LATEST_PRICE']),2)
-        total_net_income_periods = list(map(int, data[symbol]['INCOME_STATEMENT']['netIncome']))
-        total_revenue_periods = list(map(int, data[symbol]['INCOME_STATEMENT']['totalRevenue']))
-        period_number = len(total_net_income_periods)
-        total_debt = int(data[symbol]['BALANCE_SHEET']['shortTermDebt'][0]) + int(
-            data[symbol]['BALANCE_SHEET']['longTermDebt'][0])
-
-        try:
-            self.calc_fcfe_net_income_ratio(symbol, data, total_net_income_periods)
-            self.calc_net_income_margin(symbol, total_net_income_periods, total_revenue_periods)
-            self.calc_earnings_growth(symbol, total_revenue_periods)
-            self.calc_projected_free_cash_flow(symbol, total_revenue_periods, 4)
-            self.calc_wacc(data, symbol, global_data, total_debt)
-            self.calc_terminal_value(symbol)
-            await self.calc_dcf(symbol, period_number, data)
-            self.add_sorted_dict_by_category('MARKET_CAP')
-        except Exception as e:
-            print('Exception occurred during signal calculations: ' + str(e), 'for symbol:', symbol)
-            del self.signals[symbol]
-
-    # Calculate the average Free Cash Flow to Equity / Net Income ratio for the time period
-    def calc_fcfe_net_income_ratio(self, symbol, data, total_net_income_periods):
-        print("Calculating FCFE net income")
-        total_cash_flow_periods = list(map(int, data[symbol]['CASH_FLOW']['operatingCashflow']))
-        capex_periods = list(map(int, data[symbol]['CASH_FLOW']['capitalExpenditures']))
-        print('total net income period', total_net_income_periods)
-        print('total cash flow period', total_cash_flow_periods)
-        print('capex periods', capex_periods)
-        fcfe_net_income_ratio = [safe_division((total_cash_flow - capex), total_net_income) for
-                                 total_cash_flow, capex, total_net_income in
-                                 zip(total_cash_flow_periods, capex_periods, total_net_income_periods)]
-        print('fcfe net income array', fcfe_net_income_ratio)
-        net_income_ratio_num = sum(fcfe_net_income_ratio) / len(fcfe_net_income_ratio)
-        self.signals[symbol]['FCFE_NET_INCOME_RATIO'] = sum(fcfe_net_income_ratio) / len(fcfe_net_income_ratio)
-        if net_income_ratio_num <= 0:
-            raise Exception
-        print('FCFE net income ratio', self.signals[symbol]['FCFE_NET_INCOME_RATIO'])
-    # Calculate the net income margin and take the minimum for the most conservative estimate
-    def calc_net_income_margin(self, symbol, total_net_income_periods, total_revenue_periods):
-
-        net_income_margin = [safe_division(total_net_income_period, total_revenue_period) for
-                             total_net_income_period, total_revenue_period in
-                             zip(total_net_income_periods, total_revenue_periods)]
-        print('net_income_margin:', net_income_margin)
-        self.signals[symbol]['NET_INCOME_MARGIN'] = min(net_income_margin)
-
-    def calc_earnings_growth(self, symbol, total_revenue_periods):
-        self.signals[symbol]['EARNINGS_GROWTH_RATE'] = calculate_percentage_difference(total_revenue_periods)
-
-    def calc_projected_free_cash_flow(self, symbol, total_revenue_periods, period):
-        print('growth_rate', self.signals[symbol]['EARNINGS_GROWTH_RATE'])
-        print('revenue_basic', total_revenue_periods[0])
-        projected_revenue = calculate_growth(total_revenue_periods[0], self.signals[symbol]['EARNINGS_GROWTH_RATE'],
-                                             period)
-        print('projected_revenue', projected_revenue)
-        projected_net_income = [self.signals[symbol]['NET_INCOME_MARGIN'] * revenue for revenue in projected_revenue]
-        print('projected_net_income', projected_net_income)
-        projected_free_cash_flows = [self.signals[symbol]['FCFE_NET_INCOME_RATIO'] * net_income for net_income in
-                                     projected_net_income]
-        print('projected_fcf', projected_free_cash_flows)
-        self.signals[symbol]['PROJECTED_FREE_CASH_FLOWS'] = projected_free_cash_flows
-
-    def calc_effective_tax_rate(self, data, symbol):
-        income_before_tax_latest = int(data[symbol]['INCOME_STATEMENT']['incomeBeforeTax'][0])
-        income_tax_expense_latest = int(data[symbol]['INCOME_STATEMENT']['incomeTaxExpense'][0])
-        if income_tax_expense_latest <= 0:
-            return 0
-        else:
-            return abs(income_tax_expense_latest / income_before_tax_latest)
-
-    def calc_debt_cost_wacc(self, data, symbol, total_debt):
-        interest_expense = data[symbol]['INCOME_STATEMENT']['interestExpense'][0]
-        return safe_division(float(interest_expense), float(total_debt))
-
-    def calc_equity_cost(self, data, symbol, global_data):
-        treasury_yield = float(global_data['TREASURY_YIELD']) * 0.01
-        print('treasury yield:', treasury_yield)
-        beta = float(data[symbol]['BETA'])
-        print('beta', beta)
-
-        capm = treasury_yield + beta * (MARKET_RETURN_RATE - treasury_yield)
-        print('capm', capm)
-        return capm
-
-    def calc_debt_and_equity_weights(self, data, symbol, total_debt):
-        print('data', data[symbol])
-        market_cap = int(data[symbol]['MARKET_CAPITALIZATION'])
-        total = total_debt + market_cap
-        return (total_debt / total, market_cap / total)
-
-    def calc_wacc(self, data, symbol, global_data, total_debt):
-        tax_rate = self.calc_effective_tax_rate(data, symbol)
-        debt_weight, equity_weight = self.calc_debt_and_equity_weights(data, symbol, total_debt)
-        print('debt/equity weight', debt_weight, ':', equity_weight)
-        equity_cost = self.calc_equity_cost(data, symbol, global_data)
-        debt_cost = self.calc_debt_cost_wacc(data, symbol, total_debt)
-        print('debt/equity cost', debt_cost, ':', equity_cost)
-        wacc = debt_weight * debt_cost * (1 - tax_rate) + equity_weight * equity_cost
-        print('wacc', wacc)
-        if wacc < PERPETUAL_GROWTH_ESTIMATE:
-            raise Exception('WACC is less than perpetual growth rate estimate')
-        self.signals[symbol]['WACC'] = wacc
-
-    def calc_terminal_value(self, symbol):
-        base_value_last_year_estimate = self.signals[symbol]['PROJECTED_FREE_CASH_FLOWS'][-1]
-        if base_value_last_year_estimate <= 0:
-            raise Exception('base value to calculate terminal value is negative')
-        print('base_value_last_year_estimate', base_value_last_year_estimate)
-        terminal_value = base_value_last_year_estimate * (1 + PERPETUAL_GROWTH_ESTIMATE) / (
-                self.signals[symbol]['WACC'] - PERPETUAL_GROWTH_ESTIMATE)
-        print('terminal value is', terminal_value)
-        if terminal_value < 0:
-            self.signals[symbol]['TERMINAL_VALUE'] = 0
-        else:
-            self.signals[symbol]['TERMINAL_VALUE'] = terminal_value
-
-    async def calc_dcf(self, symbol, period_number, data):
-        return_multiplier = self.signals[symbol]['WACC'] + 1
-        discount_rates = generate_interest_rates(return_multiplier, period_number)
-        fcfe_values_to_discount = self.signals[symbol]['PROJECTED_FREE_CASH_FLOWS'] + [
-            self.signals[symbol]['TERMINAL_VALUE']]
-        print('fcfe_values_to_discount', fcfe_values_to_discount)
-        discounted_npv_for_cash_flows = [fcfe / dr for dr, fcfe in zip(discount_rates, fcfe_values_to_discount)]
-        print('discounted_npv_for_cash_flows', discounted_npv_for_cash_flows)
-        dcf = sum(discounted_npv_for_cash_flows)
-        print('dcf', dcf, symbol)
-        market_cap = int(data[symbol]['MARKET_CAPITALIZATION'])
-        print('market_cap', market_cap)
-        diff = dcf - market_cap
-        print(diff, 'difference is')
-        percentage_diff_dcf_market_cap = dcf / market_cap - 1
-        self.signals[symbol]['DCF'] = round(dcf / 1E9, 2)
-        self.signals[symbol]['DCF_PRICE_PER_SHARE'] = round(self.signals[symbol]['LATEST_PRICE'] * (1+percentage_diff_dcf_market_cap) , 2)
-        self.signals[symbol]['DIFF'] = round(diff / 1E9, 2)
-        self.signals[symbol]['MARKET_CAP'] = round(market_cap / 1E9, 2)
-        self.signals[symbol]['PERCENTAGE_DIFF'] = round(percentage_diff_dcf_market_cap * 100, 2)
-        is_over_safety_margin = percentage_diff_dcf_market_cap > SAFETY_MARGIN
-        if not is_over_safety_margin:
-            raise Exception
-        await self.get_MACD(symbol)
-        await self.get_news(symbol)
-
-    async def get_MACD(self, symbol):
-        api_url = f'https://www.alphavantage.co/query?function=MACD&symbol={symbol}&interval=daily&series_type=open&apikey={self.api_key}'
-        response = requests.get(api_url)
-        if response.status_code == 200:
-            data = response.json()
-            if len(data) == 0:
-                self.signals[symbol]['MACD'] = {}
-            else:
-                self.signals[symbol]['MACD'] = data["Technical Analysis: MACD"]
-        else:
-            self.signals[symbol]['MACD'] = {}
-
-    async def get_news(self, symbol):
-        api_url = f'https://www.alphavantage.co/query?function=NEWS_SENTIMENT&tickers={symbol}&apikey={self.api_key}'
-        response = requests.get(api_url)
-        if response.status_code == 200:
-            data = response.json()
-            if len(data) == 0:
-                self.signals[symbol]['NEWS'] = {}
-                self.signals[symbol]['SENTIMENT_AVG'] = {}
+    def get_sorted_dict(self, key='MARKET_CAP', descending=False):
+        ''' Plain dict copies of the signals, a lookup of a missing field in a defaultdict signal would add it '''
+        ranked_symbols = self.ranking.ranked_symbols(key, descending)
+        sorted_dict = OrderedDict((symbol, dict(self.signals[symbol])) for symbol in ranked_symbols)
+        # Signals without a numeric value for the key (e.g. no news sentiment) go last
+        for symbol, signal in self.signals.items():
+            if symbol not in sorted_dict:
+                sorted_dict[symbol] = dict(signal)
+        return sorted_dict
+
+    def value_batch(self, symbols, data, global_data):
+        '''
+        Values the symbols, reusing the memoized result of the ones valued before with the same inputs when
+        valuations are memoized. Returns the accepted symbols and the rejection reasons.
+        '''
+        treasury_yield = global_data['TREASURY_YIELD']
+        if not memo_store.enabled(VALUATIONS):
+            accepted_signals, rejections = self.value_symbols(symbols, data, treasury_yield)
+            for symbol, signal in accepted_signals.items():
+                self.signals[symbol].update(signal)
+            return list(accepted_signals), rejections
+
+        # Symbols with fewer years than the batch are invalid, so the missing ones are valued with the batch's count
+        years = reported_years(symbols, data)
+        with span('valuation_memo_lookup'):
+            keys = {symbol: valuation_key(data[symbol], years, treasury_yield, self.settings)
+                    for symbol in symbols if symbol in data}
+            memoized = memo_store.get_many(VALUATIONS, keys.values())
+        results = {symbol: memoized[key] for symbol, key in keys.items() if key in memoized}
+        missing_symbols = [symbol for symbol in symbols if symbol not in results]
+        accepted_signals, rejections = self.value_symbols(missing_symbols, data, treasury_yield, years)
+        computed = {symbol: {'signal': accepted_signals.get(symbol), 'rejection': rejections.get(symbol)}
+                    for symbol in missing_symbols}
+        memo_store.put_many(VALUATIONS, {keys[symbol]: result for symbol, result in computed.items() if symbol in keys})
+        results.update(computed)
+
+        accepted_symbols = []
+        rejections = {}
+        for symbol in symbols:
+            result = results[symbol]
+            if result['signal'] is not None:
+                self.signals[symbol].update(result['signal'])
+                accepted_symbols.append(symbol)
             else:
-                news_feed = data["feed"]
-                news_feed_to_add = []
-                symbol_sentiment = []
-                for news in news_feed:
-                    try:
-                        for ticker_sentiment in news["ticker_sentiment"]:
-                            current_symbol = ticker_sentiment["ticker"]
-                            if current_symbol == symbol:
-                                symbol_sentiment.append(float(ticker_sentiment["ticker_sentiment_score"]))
-                                if float(ticker_sentiment["relevance_score"]) >= 0.25:
-                                    news_feed_to_add.append(news)
-                    except:
-                        print('error in getting news sentiment')
-                        continue
-                sentiment_average = round(safe_division(sum(symbol_sentiment),len(symbol_sentiment)), 2)
-
-                self.signals[symbol]['NEWS'] = news_feed_to_add
-                self.signals[symbol]['SENTIMENT_AVG'] = sentiment_average
+                rejections[symbol] = result['rejection']
+        return accepted_symbols, rejections
+
+    def value_symbols(self, symbols, data, treasury_yield, years=None):
+        '''
+        Values all symbols in one vectorized pass, returns the accepted signals and the rejection reasons.
+        '''
+        if not symbols:
+            return {}, {}
+        with span('pack_financial_data'):
+            packed = pack_financial_data(symbols, data, years)
+        with span('batch_dcf'):
+            valuation = batch_dcf(packed, treasury_yield, self.settings.market_return,
+                                  self.settings.perpetual_growth_rate, self.settings.safety_margin)
+        return valuation.get_signals(), valuation.rejections
+
+    def screen_statements(self, symbols, data, statements):
+        ''' Rejections that follow from the statements fetched so far, before anything else of the symbols is fetched '''
+        with span('screen_statements'):
+            packed = pack_financial_data(symbols, data, statements=statements, fields=[])
+            return screen_statements(packed, cash_flows='CASH_FLOW' in statements)
+
+    def screen_unpriced(self, symbols, data, global_data):
+        ''' Rejections of the valuation before the symbols are priced, the price only scales the per share value '''
+        with span('screen_unpriced'):
+            packed = pack_financial_data(symbols, data,
+                                         fields=[field for field in VALUATION_FIELDS if field != 'latest_price'])
+            return batch_dcf(packed, global_data['TREASURY_YIELD'], self.settings.market_return,
+                             self.settings.perpetual_growth_rate, self.settings.safety_margin).rejections
+
+    def screen(self, symbols, data, global_data, screening_statements):
+        '''
+        Runs the checks of every screening stage in order over symbols whose fetching may have stopped early,
+        returns the first rejection of each. Symbols passing every check are left out.
+        '''
+        rejections = {}
+        fetched_statements = []
+        for statements in screening_statements:
+            fetched_statements += statements
+            remaining = [symbol for symbol in symbols if symbol not in rejections]
+            rejections.update(self.screen_statements(remaining, data, fetched_statements))
+        remaining = [symbol for symbol in symbols if symbol not in rejections]
+        rejections.update(self.screen_unpriced(remaining, data, global_data))
+        return rejections
+
+    async def add_indicators(self, symbols, data):
+        ''' Adds the MACD chart window, RSI and moving averages computed locally from the stored daily closes '''
+        if not self.offline:
+            with span('update_indicators'):
+                await update_indicators(symbols, data, self.alpha_vantage)
+        for symbol, indicator_signal in get_indicator_signals(symbols).items():
+            self.signals[symbol].update(indicator_signal)
+
+    async def fetch_news_feed(self, symbol):
+        ''' The trimmed news feed of one symbol, None when it could not be fetched '''
+        result = await self.alpha_vantage('NEWS_SENTIMENT', tickers=symbol)
+        if not result.ok or len(result.data) == 0:
+            return None
+        return result.data.get('feed', [])
+
+    def add_news(self, symbols):
+        ''' Sets NEWS and SENTIMENT_AVG of every symbol from the feeds added to the news index and ranks them '''
+        for symbol, news_signal in self.news.get_news_signals(symbols).items():
+            self.signals[symbol].update(news_signal)
+            self.ranking.insert(symbol, self.signals[symbol])
+
+    async def add_signal_details(self, symbols):
+        '''
+        Fetches the news of the accepted symbols and ranks them. The API only returns articles mentioning every
+        ticker of a request, so each symbol needs its own call, but every feed counts for all symbols it mentions.
+        '''
+        feeds = await asyncio.gather(*[self.fetch_news_feed(symbol) for symbol in symbols])
+        tracked_symbols = set(symbols)
+        for symbol, feed in zip(symbols, feeds):
+            self.news.add_feed(symbol, feed, tracked_symbols)
+        self.add_news(symbols)
+
+    def restore_signal_details(self, symbol, details):
+        self.signals[symbol].update(details)
+        self.ranking.insert(symbol, self.signals[symbol])
+
+    def add_sensitivity_bands(self, data, global_data, mode):
+        '''
+        Adds P10/P50/P90 DCF price per share over a grid or random sample of the valuation parameters. Bands of
+        symbols whose inputs and scenarios are unchanged come from the memo, an unseeded sample never repeats.
+        '''
+        if mode == 'grid':
+            scenarios = grid_scenarios(self.settings.market_return, self.settings.perpetual_growth_rate)
+        elif mode == 'monte_carlo':
+            scenarios = random_scenarios(self.settings.market_return, self.settings.perpetual_growth_rate,
+                                         seed=SENSITIVITY_SEED)
         else:
-            self.signals[symbol]['NEWS'] = {}
-            self.signals[symbol]['SENTIMENT_AVG'] = {}
+            raise ValueError(f'Unknown sensitivity mode {mode}')
+        symbols = list(self.signals.keys())
+        treasury_yield = global_data['TREASURY_YIELD']
+        years = reported_years(symbols, data)
+        keys = {}
+        memoized = {}
+        if memo_store.enabled(SENSITIVITY_BANDS):
+            with span('sensitivity_memo_lookup'):
+                scenarios_hash = input_hash(scenarios.market_return, scenarios.perpetual_growth,
+                                            scenarios.beta_shock, scenarios.growth_haircut)
+                keys = {symbol: valuation_key(data[symbol], years, treasury_yield, self.settings, scenarios_hash)
+                        for symbol in symbols if symbol in data}
+                memoized = memo_store.get_many(SENSITIVITY_BANDS, keys.values())
+        bands = {symbol: memoized[key] for symbol, key in keys.items() if key in memoized}
+        missing_symbols = [symbol for symbol in symbols if symbol not in bands]
+        if missing_symbols:
+            with span('sensitivity_bands'):
+                computed = percentile_bands(pack_financial_data(missing_symbols, data, years), treasury_yield,
+                                            scenarios)
+            if keys:
+                memo_store.put_many(SENSITIVITY_BANDS, {keys[symbol]: symbol_bands for symbol, symbol_bands
+                                                        in computed.items() if symbol in keys})
+            bands.update(computed)
+        for symbol, symbol_bands in bands.items():
+            self.signals[symbol].update(symbol_bands)
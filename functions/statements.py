@@ -0,0 +1,140 @@
+import numpy as np
+
+from functions.payloads import STATEMENT_YEARS
+
+# Line items kept of each statement, a statement array has one row per item in this order
+STATEMENT_LINE_ITEMS = {
+    'CASH_FLOW': ['operatingCashflow', 'capitalExpenditures'],
+    'INCOME_STATEMENT': ['totalRevenue', 'netIncome', 'incomeBeforeTax', 'interestAndDebtExpense', 'incomeTaxExpense',
+                         'interestExpense'],
+    'BALANCE_SHEET': ['commonStockSharesOutstanding', 'shortTermDebt', 'longTermDebt'],
+}
+
+OPERATING_CASHFLOW, CAPITAL_EXPENDITURES = range(2)
+TOTAL_REVENUE, NET_INCOME, INCOME_BEFORE_TAX, INTEREST_AND_DEBT_EXPENSE, INCOME_TAX_EXPENSE, INTEREST_EXPENSE = range(6)
+COMMON_STOCK_SHARES_OUTSTANDING, SHORT_TERM_DEBT, LONG_TERM_DEBT = range(3)
+
+STATEMENT_ATTRIBUTES = {statement: statement.lower() for statement in STATEMENT_LINE_ITEMS}
+
+# Aggregate key -> (attribute, parser) of the numeric overview and price fields
+NUMERIC_FIELDS = {
+    'BETA': ('beta', float),
+    'MARKET_CAPITALIZATION': ('market_capitalization', int),
+    'SHARES_OUTSTANDING': ('shares_outstanding', int),
+    'LATEST_PRICE': ('latest_price', float),
+}
+
+
+def parse_line_item(value):
+    ''' Alpha Vantage reports missing line items as 'None', they count as 0 '''
+    return 0 if value is None or value == 'None' else int(value)
+
+
+def parse_number(parser, value):
+    try:
+        return parser(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_annual_reports(reports, statement, years=STATEMENT_YEARS):
+    ''' The line items of the latest years of annual reports, raises when a year or an item is missing '''
+    items = STATEMENT_LINE_ITEMS[statement]
+    if len(reports) < years:
+        raise ValueError(f'{statement} has {len(reports)} annual reports instead of {years}')
+    return np.array([[parse_line_item(reports[year][item]) for year in range(years)] for item in items],
+                    dtype=np.int64)
+
+
+def parse_statement(statement_data, statement):
+    ''' A statement in the aggregate's {line item: [values, latest first]} shape '''
+    return np.array([[parse_line_item(value) for value in statement_data[item]]
+                     for item in STATEMENT_LINE_ITEMS[statement]], dtype=np.int64)
+
+
+class SymbolFinancials:
+    '''
+    What the valuation and the pages read of one symbol, parsed and validated once when it is fetched. Statements
+    are int64 arrays of one row per line item and one column per year, latest first. A field that was not fetched
+    or could not be parsed is None. Indexing with an aggregate key returns the field in the shape of
+    financial_data_aggregate.json.
+    '''
+    __slots__ = ['cash_flow', 'income_statement', 'balance_sheet', 'beta', 'market_capitalization',
+                 'shares_outstanding', 'latest_price', 'latest_price_date', 'overview']
+
+    def __init__(self):
+        for attribute in self.__slots__:
+            setattr(self, attribute, None)
+
+    @classmethod
+    def from_dict(cls, symbol_data):
+        financials = cls()
+        for key, value in symbol_data.items():
+            financials.set(key, value)
+        return financials
+
+    def set_statement(self, statement, values):
+        setattr(self, STATEMENT_ATTRIBUTES[statement], values)
+
+    def get_statement(self, statement):
+        return getattr(self, STATEMENT_ATTRIBUTES[statement])
+
+    def set(self, key, value):
+        ''' Sets a field from its aggregate key and value as fetched or as stored in a checkpoint '''
+        if key in STATEMENT_LINE_ITEMS:
+            try:
+                self.set_statement(key, parse_statement(value, key))
+            except (KeyError, TypeError, ValueError):
+                self.set_statement(key, None)
+        elif key in NUMERIC_FIELDS:
+            attribute, parser = NUMERIC_FIELDS[key]
+            setattr(self, attribute, parse_number(parser, value))
+            if key != 'LATEST_PRICE' and self.overview is None:
+                self.overview = {}
+        elif key == 'LATEST_PRICE_DATE':
+            self.latest_price_date = value
+        else:
+            if self.overview is None:
+                self.overview = {}
+            self.overview[key] = value
+
+    def keys(self):
+        keys = [statement for statement in STATEMENT_LINE_ITEMS if self.get_statement(statement) is not None]
+        keys += [key for key, (attribute, _) in NUMERIC_FIELDS.items() if getattr(self, attribute) is not None]
+        if self.latest_price_date is not None:
+            keys.append('LATEST_PRICE_DATE')
+        return keys + list(self.overview or {})
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __getitem__(self, key):
+        if key in STATEMENT_LINE_ITEMS:
+            values = self.get_statement(key)
+            if values is None:
+                raise KeyError(key)
+            return dict(zip(STATEMENT_LINE_ITEMS[key], values.tolist()))
+        if key in NUMERIC_FIELDS:
+            value = getattr(self, NUMERIC_FIELDS[key][0])
+        elif key == 'LATEST_PRICE_DATE':
+            value = self.latest_price_date
+        else:
+            value = (self.overview or {}).get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def to_dict(self, keys=None):
+        ''' The fields in the shape of financial_data_aggregate.json, only those in keys when given '''
+        return {key: self[key] for key in self.keys() if keys is None or key in keys}
+
+    def is_complete(self, years, statements, fields):
+        ''' Whether the statements, each with the given number of years, and the fields are all present '''
+        for statement in statements:
+            values = self.get_statement(statement)
+            if values is None or values.shape[1] != years:
+                return False
+        for field in fields:
+            if getattr(self, field) is None:
+                return False
+        return True
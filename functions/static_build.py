@@ -0,0 +1,84 @@
+import gzip
+import hashlib
+import json
+import os
+
+from functions.metrics import span
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+static_dir = os.path.abspath(os.path.join(__file__, '../../static'))
+chart_data_dir = os.path.join(static_dir, 'data')
+
+# Number of most recent trading days shown on the MACD charts
+CHART_WINDOW = 180
+
+PRECOMPRESS_EXTENSIONS = ('.html', '.json', '.css')
+
+
+def trim_macd_series(macd, window=CHART_WINDOW):
+    ''' Keeps the last window days of the MACD history in a compact column layout for the chart '''
+    dates = sorted(macd.keys())[-window:]
+    return {
+        'dates': dates,
+        'macd': [float(macd[date]['MACD']) for date in dates],
+        'signal': [float(macd[date]['MACD_Signal']) for date in dates],
+    }
+
+
+def precompress(path, content):
+    with open(path + '.gz', 'wb') as f:
+        # mtime=0 keeps the archive byte-identical when the content has not changed
+        f.write(gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(content))
+
+
+def write_if_changed(path, content):
+    ''' Writes the file and its compressed siblings only when the content differs, returns whether it wrote '''
+    with span('write_static_file'):
+        return _write_if_changed(path, content)
+
+
+def _write_if_changed(path, content):
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+    with open(path, 'wb') as f:
+        f.write(content)
+    if path.endswith(PRECOMPRESS_EXTENSIONS):
+        precompress(path, content)
+    return True
+
+
+def build_chart_data(signals, output_dir=chart_data_dir, write=True):
+    '''
+    Writes one content-hashed JSON file per symbol with its trimmed chart series. Unchanged series map to the
+    file already on disk, so consecutive daily pages share it. Returns the file name for every symbol with data.
+    With write=False only the names are computed, for pages of a run whose files were written when it was published.
+    '''
+    if write:
+        os.makedirs(output_dir, exist_ok=True)
+    chart_files = {}
+    with span('build_chart_data'):
+        for symbol, signal in signals.items():
+            macd = signal.get('MACD')
+            if not macd:
+                continue
+            content = json.dumps(trim_macd_series(macd), separators=(',', ':')).encode('utf-8')
+            content_hash = hashlib.sha256(content).hexdigest()[:12]
+            file_name = f'{symbol}-{content_hash}.json'
+            path = os.path.join(output_dir, file_name)
+            if write and not os.path.exists(path):
+                write_if_changed(path, content)
+            chart_files[symbol] = file_name
+    return chart_files
@@ -1,20 +1,24 @@
+import logging
 import os
 from datetime import datetime
 
 import sh
 
+logger = logging.getLogger(__name__)
+
 current_directory = os.path.dirname(os.path.abspath(__file__))
 # https://stackoverflow.com/questions/1456269/python-git-module-experiences
 def add_all_in_static_and_commit():
-    print('starting to commit files')
+    logger.info('starting to commit files')
     git = sh.git.bake(_cwd=current_directory)
-    print('current working dir', current_directory)
+    logger.debug('current working dir %s', current_directory)
     time_string = datetime.today().strftime('%Y-%m-%d')
 
-    print(git.status())
-    print(current_directory)
-    print(git.add('../static/'))
-    print(git.commit(m=f'{time_string} new html files have been generated after running scheduled checks'))
-    print(git.push())
-    print(git.status())
-    print('Successfully committed files to GitHub')
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('%s', git.status())
+    logger.info('%s', git.add('../static/'))
+    logger.info('%s', git.commit(m=f'{time_string} new html files have been generated after running scheduled checks'))
+    logger.info('%s', git.push())
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('%s', git.status())
+    logger.info('Successfully committed files to GitHub')
@@ -1,5 +1,9 @@
+import logging
+
 import requests
 
+logger = logging.getLogger(__name__)
+
 
 def notify_slack_channel(signal_keys):
     tickers = ', '.join(signal_keys)
@@ -17,6 +21,6 @@ def notify_slack_channel(signal_keys):
 
     # Check if the request was successful (status code 200)
     if response.status_code == 200:
-        print("Message sent successfully!")
+        logger.info('Message sent successfully!')
     else:
-        print("Failed to send message:", response.text)
+        logger.error('Failed to send message: %s', response.text)
@@ -1,21 +1,58 @@
+import logging
+import os
+import time
+
 import requests
 import schedule
-import time
 
-TIME_ZONE = 'America/New_York'
-AFTER_MARKET_CLOSING_TIME = '16:01'
+logger = logging.getLogger(__name__)
+
+# Every tick runs a planned job, which only refreshes the data that is due and returns at once when none is
+TICK_MINUTES = int(os.getenv('REFRESH_TICK_MINUTES', 30))
+
+BASE_URL = 'http://127.0.0.1:8080'
+JOB_POLL_SECONDS = 30
 
 
 def request_local_endpoint():
-    endpoint = 'http://127.0.0.1:8080/check_stocks?scheduler=true'
+    endpoint = BASE_URL + '/check_stocks?scheduler=true&planned=true'
     try:
-        print('scheduled task starting...')
-        requests.get(endpoint)
+        logger.info('scheduled task starting...')
+        response = requests.get(endpoint)
+        job = response.json()
+        logger.info('check_stocks job started: %s', job['job_id'])
+        return job
     except Exception as e:
-        print(f"Error occurred while requesting local endpoint: {e}")
+        logger.error('Error occurred while requesting local endpoint: %s', e)
+
+
+def wait_for_job(job):
+    ''' Polls the job status until it has finished or failed, committing and notifying is done by the job itself '''
+    while True:
+        time.sleep(JOB_POLL_SECONDS)
+        try:
+            status = requests.get(BASE_URL + job['status_url']).json()
+        except Exception as e:
+            logger.warning('Error occurred while polling job status: %s', e)
+            continue
+        logger.info('job %s %s stage: %s', status['id'], status['status'], status['stage'])
+        if status['status'] in ('finished', 'failed'):
+            return status
+
+
+def run_scheduled_check():
+    job = request_local_endpoint()
+    if job:
+        status = wait_for_job(job)
+        if status['status'] == 'failed':
+            logger.error('check_stocks job failed: %s', status['error'])
+        else:
+            logger.info('check_stocks job refreshed %s', (status['result'] or {}).get('refresh'))
 
 
-schedule.every().day.at(AFTER_MARKET_CLOSING_TIME, TIME_ZONE).do(request_local_endpoint)
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+schedule.every(TICK_MINUTES).minutes.do(run_scheduled_check)
 
 while True:
     schedule.run_pending()
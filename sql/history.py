@@ -0,0 +1,235 @@
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+from functions.statements import SymbolFinancials
+from sql.helpers import database_path
+
+current_directory = os.path.dirname(os.path.abspath(__file__))
+history_schema_path = os.path.join(current_directory, 'history_schema.sql')
+
+# (aggregate key, table, [(aggregate line item, column)])
+STATEMENT_TABLES = [
+    ('CASH_FLOW', 'cash_flow', [('operatingCashflow', 'operating_cashflow'),
+                                ('capitalExpenditures', 'capital_expenditures')]),
+    ('INCOME_STATEMENT', 'income_statement', [('totalRevenue', 'total_revenue'),
+                                              ('netIncome', 'net_income'),
+                                              ('incomeBeforeTax', 'income_before_tax'),
+                                              ('interestAndDebtExpense', 'interest_and_debt_expense'),
+                                              ('incomeTaxExpense', 'income_tax_expense'),
+                                              ('interestExpense', 'interest_expense')]),
+    ('BALANCE_SHEET', 'balance_sheet', [('commonStockSharesOutstanding', 'common_stock_shares_outstanding'),
+                                        ('shortTermDebt', 'short_term_debt'),
+                                        ('longTermDebt', 'long_term_debt')]),
+]
+
+OVERVIEW_COLUMNS = [('BETA', 'beta'), ('MARKET_CAPITALIZATION', 'market_capitalization'),
+                    ('SHARES_OUTSTANDING', 'shares_outstanding')]
+
+# Columns added after a table was first created, (table, column, type)
+COLUMN_MIGRATIONS = [('runs', 'settings_version', 'INTEGER')]
+
+SIGNAL_COLUMNS = [('LATEST_PRICE', 'latest_price'), ('DCF', 'dcf'), ('DCF_PRICE_PER_SHARE', 'dcf_price_per_share'),
+                  ('MARKET_CAP', 'market_cap'), ('DIFF', 'diff'), ('PERCENTAGE_DIFF', 'percentage_diff'),
+                  ('WACC', 'wacc'), ('SENTIMENT_AVG', 'sentiment_avg')]
+
+
+def numeric_or_none(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+class HistoryStore:
+    ''' Every run's fundamentals, prices and signals, normalized and indexed by symbol in sql/database.db '''
+
+    def __init__(self, path=database_path):
+        self.path = path
+        self._schema_created = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        if not self._schema_created:
+            with open(history_schema_path) as f:
+                conn.executescript(f.read())
+            self._migrate(conn)
+            self._schema_created = True
+        return conn
+
+    def _migrate(self, conn):
+        for table, column, column_type in COLUMN_MIGRATIONS:
+            existing_columns = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+            if column not in existing_columns:
+                with conn:
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+
+    def save_run(self, started_at, financial_data_aggregate, global_data, signals, valuation_parameters=None,
+                 news_articles=None, rejections=None):
+        ''' Writes a whole run in a single transaction and returns its id '''
+        valuation_parameters = valuation_parameters or {}
+        news_articles = news_articles or {}
+        rejections = rejections or {}
+        conn = self._connect()
+        try:
+            with conn:
+                cursor = conn.execute(
+                    'INSERT INTO runs (started_at, finished_at, treasury_yield, market_return, perpetual_growth_rate, '
+                    'safety_margin, settings_version, symbol_count, signal_count) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (started_at.isoformat(), datetime.now().isoformat(), global_data.get('TREASURY_YIELD'),
+                     valuation_parameters.get('market_return'), valuation_parameters.get('perpetual_growth_rate'),
+                     valuation_parameters.get('safety_margin'), valuation_parameters.get('version'),
+                     len(financial_data_aggregate), len(signals)))
+                run_id = cursor.lastrowid
+                self._insert_statements(conn, run_id, financial_data_aggregate)
+                self._insert_overview_and_prices(conn, run_id, financial_data_aggregate)
+                self._insert_signals(conn, run_id, signals)
+                conn.executemany('INSERT INTO news_articles (run_id, article_id, payload) VALUES (?, ?, ?)',
+                                 [(run_id, article_id, json.dumps(article))
+                                  for article_id, article in news_articles.items()])
+                conn.executemany('INSERT INTO rejections (run_id, symbol, reason) VALUES (?, ?, ?)',
+                                 [(run_id, symbol, reason) for symbol, reason in rejections.items()])
+        finally:
+            conn.close()
+        return run_id
+
+    def _insert_statements(self, conn, run_id, financial_data_aggregate):
+        for aggregate_key, table, columns in STATEMENT_TABLES:
+            rows = []
+            for symbol, financials in financial_data_aggregate.items():
+                statement = financials.get_statement(aggregate_key)
+                if statement is None:
+                    continue
+                rows.extend((run_id, symbol, year_index, *values)
+                            for year_index, values in enumerate(statement.T.tolist()))
+            column_names = ', '.join(column for _, column in columns)
+            placeholders = ', '.join('?' * (len(columns) + 3))
+            conn.executemany(f'INSERT INTO {table} (run_id, symbol, year_index, {column_names}) '
+                             f'VALUES ({placeholders})', rows)
+
+    def _insert_overview_and_prices(self, conn, run_id, financial_data_aggregate):
+        overview_rows = []
+        price_rows = []
+        for symbol, financials in financial_data_aggregate.items():
+            if financials.overview is not None:
+                overview_rows.append((run_id, symbol, financials.beta, financials.market_capitalization,
+                                      financials.shares_outstanding, json.dumps(financials.overview)))
+            if financials.latest_price is not None:
+                price_rows.append((run_id, symbol, financials.latest_price_date, financials.latest_price))
+        conn.executemany('INSERT INTO overview (run_id, symbol, beta, market_capitalization, shares_outstanding, '
+                         'details) VALUES (?, ?, ?, ?, ?, ?)', overview_rows)
+        conn.executemany('INSERT INTO prices (run_id, symbol, price_date, close) VALUES (?, ?, ?, ?)', price_rows)
+
+    def _insert_signals(self, conn, run_id, signals):
+        rows = [(run_id, symbol, *[numeric_or_none(signal.get(key)) for key, _ in SIGNAL_COLUMNS], json.dumps(signal))
+                for symbol, signal in signals.items()]
+        column_names = ', '.join(column for _, column in SIGNAL_COLUMNS)
+        placeholders = ', '.join('?' * (len(SIGNAL_COLUMNS) + 3))
+        conn.executemany(f'INSERT INTO signals (run_id, symbol, {column_names}, payload) VALUES ({placeholders})',
+                         rows)
+
+    def get_runs(self, limit=100):
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT * FROM runs ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+    def get_run(self, run_id):
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT * FROM runs WHERE id = ?', (run_id,)).fetchone()
+        finally:
+            conn.close()
+        return dict(row) if row is not None else None
+
+    def get_latest_run_id(self):
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT MAX(id) AS id FROM runs').fetchone()
+        finally:
+            conn.close()
+        return row['id']
+
+    def get_run_signals(self, run_id, order_by='market_cap'):
+        ''' Signals of a run in the same shape as signals.json '''
+        if order_by not in {column for _, column in SIGNAL_COLUMNS}:
+            raise ValueError(f'Cannot order signals by {order_by}')
+        conn = self._connect()
+        try:
+            rows = conn.execute(f'SELECT symbol, payload FROM signals WHERE run_id = ? ORDER BY {order_by}',
+                                (run_id,)).fetchall()
+        finally:
+            conn.close()
+        return {row['symbol']: json.loads(row['payload']) for row in rows}
+
+    def get_run_news_articles(self, run_id):
+        ''' The articles the signals of a run refer to, keyed by id '''
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT article_id, payload FROM news_articles WHERE run_id = ?', (run_id,)).fetchall()
+        finally:
+            conn.close()
+        return {row['article_id']: json.loads(row['payload']) for row in rows}
+
+    def get_run_rejections(self, run_id):
+        ''' The reason every symbol of a run was rejected for, keyed by symbol '''
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT symbol, reason FROM rejections WHERE run_id = ?', (run_id,)).fetchall()
+        finally:
+            conn.close()
+        return {row['symbol']: row['reason'] for row in rows}
+
+    def get_run_outcomes(self, run_id):
+        ''' Every symbol of a run with the reason it was rejected for, None for the symbols with a signal '''
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT symbol, NULL AS reason FROM signals WHERE run_id = ? '
+                                'UNION ALL SELECT symbol, reason FROM rejections WHERE run_id = ?',
+                                (run_id, run_id)).fetchall()
+        finally:
+            conn.close()
+        return {row['symbol']: row['reason'] for row in rows}
+
+    def get_run_financial_data(self, run_id):
+        ''' Rebuilds the financial data aggregate of a run, the model of every symbol as the pipeline built it '''
+        aggregate = {}
+        conn = self._connect()
+        try:
+            for aggregate_key, table, columns in STATEMENT_TABLES:
+                rows = conn.execute(f'SELECT * FROM {table} WHERE run_id = ? ORDER BY symbol, year_index',
+                                    (run_id,)).fetchall()
+                for row in rows:
+                    statement = aggregate.setdefault(row['symbol'], {}).setdefault(
+                        aggregate_key, {item: [] for item, _ in columns})
+                    for item, column in columns:
+                        if row[column] is not None:
+                            statement[item].append(row[column])
+            for row in conn.execute('SELECT * FROM overview WHERE run_id = ?', (run_id,)):
+                symbol_data = aggregate.setdefault(row['symbol'], {})
+                for key, column in OVERVIEW_COLUMNS:
+                    symbol_data[key] = row[column]
+                symbol_data.update(json.loads(row['details']))
+            for row in conn.execute('SELECT * FROM prices WHERE run_id = ?', (run_id,)):
+                symbol_data = aggregate.setdefault(row['symbol'], {})
+                symbol_data['LATEST_PRICE'] = row['close']
+                symbol_data['LATEST_PRICE_DATE'] = row['price_date']
+        finally:
+            conn.close()
+        return {symbol: SymbolFinancials.from_dict(symbol_data) for symbol, symbol_data in aggregate.items()}
+
+    def get_symbol_history(self, symbol):
+        ''' The valuation of one symbol in every run it produced a signal in, oldest first '''
+        column_names = ', '.join(f'signals.{column}' for _, column in SIGNAL_COLUMNS)
+        conn = self._connect()
+        try:
+            rows = conn.execute(f'SELECT runs.id AS run_id, runs.finished_at, {column_names} FROM signals '
+                                f'JOIN runs ON runs.id = signals.run_id WHERE signals.symbol = ? ORDER BY runs.id',
+                                (symbol,)).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+
+history_store = HistoryStore()
@@ -0,0 +1,98 @@
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at TEXT NOT NULL,
+    finished_at TEXT NOT NULL,
+    treasury_yield FLOAT,
+    market_return FLOAT,
+    perpetual_growth_rate FLOAT,
+    safety_margin FLOAT,
+    settings_version INTEGER,
+    symbol_count INTEGER NOT NULL,
+    signal_count INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS cash_flow (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    symbol TEXT NOT NULL,
+    year_index INTEGER NOT NULL,
+    operating_cashflow INTEGER,
+    capital_expenditures INTEGER,
+    PRIMARY KEY (run_id, symbol, year_index)
+);
+CREATE INDEX IF NOT EXISTS cash_flow_symbol ON cash_flow (symbol, run_id);
+
+CREATE TABLE IF NOT EXISTS income_statement (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    symbol TEXT NOT NULL,
+    year_index INTEGER NOT NULL,
+    total_revenue INTEGER,
+    net_income INTEGER,
+    income_before_tax INTEGER,
+    interest_and_debt_expense INTEGER,
+    income_tax_expense INTEGER,
+    interest_expense INTEGER,
+    PRIMARY KEY (run_id, symbol, year_index)
+);
+CREATE INDEX IF NOT EXISTS income_statement_symbol ON income_statement (symbol, run_id);
+
+CREATE TABLE IF NOT EXISTS balance_sheet (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    symbol TEXT NOT NULL,
+    year_index INTEGER NOT NULL,
+    common_stock_shares_outstanding INTEGER,
+    short_term_debt INTEGER,
+    long_term_debt INTEGER,
+    PRIMARY KEY (run_id, symbol, year_index)
+);
+CREATE INDEX IF NOT EXISTS balance_sheet_symbol ON balance_sheet (symbol, run_id);
+
+CREATE TABLE IF NOT EXISTS overview (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    symbol TEXT NOT NULL,
+    beta TEXT,
+    market_capitalization TEXT,
+    shares_outstanding TEXT,
+    details TEXT,
+    PRIMARY KEY (run_id, symbol)
+);
+CREATE INDEX IF NOT EXISTS overview_symbol ON overview (symbol, run_id);
+
+CREATE TABLE IF NOT EXISTS prices (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    symbol TEXT NOT NULL,
+    price_date TEXT,
+    close TEXT,
+    PRIMARY KEY (run_id, symbol)
+);
+CREATE INDEX IF NOT EXISTS prices_symbol ON prices (symbol, run_id);
+
+CREATE TABLE IF NOT EXISTS signals (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    symbol TEXT NOT NULL,
+    latest_price FLOAT,
+    dcf FLOAT,
+    dcf_price_per_share FLOAT,
+    market_cap FLOAT,
+    diff FLOAT,
+    percentage_diff FLOAT,
+    wacc FLOAT,
+    sentiment_avg FLOAT,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (run_id, symbol)
+);
+CREATE INDEX IF NOT EXISTS signals_symbol ON signals (symbol, run_id);
+
+CREATE TABLE IF NOT EXISTS news_articles (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    article_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (run_id, article_id)
+);
+
+CREATE TABLE IF NOT EXISTS rejections (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    symbol TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    PRIMARY KEY (run_id, symbol)
+);
+CREATE INDEX IF NOT EXISTS rejections_symbol ON rejections (symbol, run_id);
@@ -0,0 +1,28 @@
+CREATE TABLE IF NOT EXISTS daily_closes (
+    symbol TEXT NOT NULL,
+    price_date TEXT NOT NULL,
+    close FLOAT NOT NULL,
+    PRIMARY KEY (symbol, price_date)
+);
+
+CREATE TABLE IF NOT EXISTS indicator_state (
+    symbol TEXT PRIMARY KEY,
+    price_date TEXT NOT NULL,
+    close_count INTEGER NOT NULL,
+    last_close FLOAT NOT NULL,
+    ema_fast FLOAT NOT NULL,
+    ema_slow FLOAT NOT NULL,
+    macd_signal FLOAT NOT NULL,
+    avg_gain FLOAT NOT NULL,
+    avg_loss FLOAT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS indicator_values (
+    symbol TEXT NOT NULL,
+    price_date TEXT NOT NULL,
+    macd FLOAT,
+    macd_signal FLOAT,
+    macd_hist FLOAT,
+    rsi FLOAT,
+    PRIMARY KEY (symbol, price_date)
+);
@@ -0,0 +1,105 @@
+import os
+import sqlite3
+
+from sql.helpers import database_path
+
+current_directory = os.path.dirname(os.path.abspath(__file__))
+indicator_schema_path = os.path.join(current_directory, 'indicator_schema.sql')
+
+STATE_COLUMNS = ['close_count', 'last_close', 'ema_fast', 'ema_slow', 'macd_signal', 'avg_gain', 'avg_loss']
+
+VALUE_COLUMNS = ['macd', 'macd_signal', 'macd_hist', 'rsi']
+
+# SQLite caps the number of ? placeholders in one statement
+MAX_QUERY_SYMBOLS = 500
+
+
+def symbol_chunks(symbols):
+    symbols = list(symbols)
+    for start in range(0, len(symbols), MAX_QUERY_SYMBOLS):
+        yield symbols[start:start + MAX_QUERY_SYMBOLS]
+
+
+class IndicatorStore:
+    '''
+    Daily closes, the running state of the indicators and their recent values per symbol in sql/database.db.
+    Only the last closes_kept closes and values_kept values of a symbol are kept.
+    '''
+
+    def __init__(self, path=database_path):
+        self.path = path
+        self._schema_created = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        if not self._schema_created:
+            with open(indicator_schema_path) as f:
+                conn.executescript(f.read())
+            self._schema_created = True
+        return conn
+
+    def get_states(self, symbols):
+        states = {}
+        conn = self._connect()
+        try:
+            for chunk in symbol_chunks(symbols):
+                rows = conn.execute(f'SELECT * FROM indicator_state WHERE symbol IN ({", ".join("?" * len(chunk))})',
+                                    chunk)
+                states.update({row['symbol']: dict(row) for row in rows})
+        finally:
+            conn.close()
+        return states
+
+    def _get_latest_rows(self, table, columns, symbols, limit):
+        ''' The last limit rows of each symbol, oldest first '''
+        rows_by_symbol = {symbol: [] for symbol in symbols}
+        conn = self._connect()
+        try:
+            for chunk in symbol_chunks(symbols):
+                rows = conn.execute(
+                    f'SELECT symbol, price_date, {", ".join(columns)} FROM ('
+                    f'SELECT *, ROW_NUMBER() OVER (PARTITION BY symbol ORDER BY price_date DESC) AS age FROM {table} '
+                    f'WHERE symbol IN ({", ".join("?" * len(chunk))})) WHERE age <= ? ORDER BY symbol, price_date',
+                    (*chunk, limit))
+                for row in rows:
+                    rows_by_symbol[row['symbol']].append(dict(row))
+        finally:
+            conn.close()
+        return rows_by_symbol
+
+    def get_closes(self, symbols, limit):
+        return self._get_latest_rows('daily_closes', ['close'], symbols, limit)
+
+    def get_values(self, symbols, limit):
+        return self._get_latest_rows('indicator_values', VALUE_COLUMNS, symbols, limit)
+
+    def save(self, states, closes, values, reseeded_symbols, closes_kept, values_kept):
+        '''
+        Stores new closes, indicator values and states in one transaction, then drops what falls outside the kept
+        windows. The history of reseeded symbols is replaced rather than extended.
+        '''
+        conn = self._connect()
+        try:
+            with conn:
+                for table in ['daily_closes', 'indicator_values']:
+                    conn.executemany(f'DELETE FROM {table} WHERE symbol = ?',
+                                     [(symbol,) for symbol in reseeded_symbols])
+                conn.executemany('INSERT OR REPLACE INTO daily_closes (symbol, price_date, close) VALUES (?, ?, ?)',
+                                 closes)
+                conn.executemany(f'INSERT OR REPLACE INTO indicator_values (symbol, price_date, '
+                                 f'{", ".join(VALUE_COLUMNS)}) VALUES ({", ".join("?" * (len(VALUE_COLUMNS) + 2))})',
+                                 values)
+                conn.executemany(f'INSERT OR REPLACE INTO indicator_state (symbol, price_date, '
+                                 f'{", ".join(STATE_COLUMNS)}) VALUES ({", ".join("?" * (len(STATE_COLUMNS) + 2))})',
+                                 [(symbol, state['price_date'], *[state[column] for column in STATE_COLUMNS])
+                                  for symbol, state in states.items()])
+                for table, kept in [('daily_closes', closes_kept), ('indicator_values', values_kept)]:
+                    conn.executemany(f'DELETE FROM {table} WHERE symbol = ? AND price_date <= (SELECT price_date '
+                                     f'FROM {table} WHERE symbol = ? ORDER BY price_date DESC LIMIT 1 OFFSET ?)',
+                                     [(symbol, symbol, kept) for symbol in states])
+        finally:
+            conn.close()
+
+
+indicator_store = IndicatorStore()
@@ -6,6 +6,10 @@ try:
     # Execute the schema script
     with open('schema.sql') as f:
         connection.executescript(f.read())
+    with open('history_schema.sql') as f:
+        connection.executescript(f.read())
+    with open('indicator_schema.sql') as f:
+        connection.executescript(f.read())
 
     # Insert values into the variables table
     cur = connection.cursor()